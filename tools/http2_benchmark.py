@@ -0,0 +1,303 @@
+# Copyright 2017 VMware, Inc.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""Benchmark of the HTTP providers against a local HTTPS stand-in of NSX.
+
+Compares the sockets opened by, and the requests per second of,
+NSXRequestsHTTPProvider and NSXHTTP2Provider. The stand-in runs in a
+child process, negotiates h2 or HTTP/1.1 through ALPN and answers every
+request after a fixed delay, mimicking the latency of a NSX manager.
+
+Requires python 3 and the httpx library with its http2 extra:
+
+    python tools/http2_benchmark.py --requests 2000 --concurrency 20
+
+Use --http1-only to have the stand-in refuse h2, and check the fallback of
+the HTTP/2 provider to HTTP/1.1.
+"""
+
+import argparse
+import collections
+import heapq
+import http.server
+import json
+import os
+import select
+import socketserver
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+RESULT = json.dumps({'results': [{'id': 'tz1'}],
+                     'result_count': 1}).encode('utf-8')
+
+
+class StandInServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """HTTPS server answering over HTTP/2 or HTTP/1.1."""
+
+    daemon_threads = True
+
+    def __init__(self, context, delay):
+        http.server.HTTPServer.__init__(
+            self, ('127.0.0.1', 0), Http1Handler)
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+        self.delay = delay
+        self.stats = collections.Counter()
+        self._lock = threading.Lock()
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def respond(self, path):
+        """Return the body of the response and its delay."""
+        if path == '/stats':
+            with self._lock:
+                return json.dumps(self.stats).encode('utf-8'), 0
+        if path == '/reset':
+            with self._lock:
+                self.stats.clear()
+            return b'{}', 0
+        self.count('requests')
+        return RESULT, self.delay
+
+    def process_request(self, request, client_address):
+        self.count('sockets')
+        socketserver.ThreadingMixIn.process_request(
+            self, request, client_address)
+
+    def finish_request(self, request, client_address):
+        if request.selected_alpn_protocol() == 'h2':
+            self.count('h2_sockets')
+            H2Connection(self, request).serve()
+        else:
+            http.server.HTTPServer.finish_request(
+                self, request, client_address)
+
+
+class Http1Handler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def _respond(self):
+        body, delay = self.server.respond(self.path)
+        time.sleep(delay)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    do_GET = do_HEAD = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+class H2Connection(object):
+    """Single threaded server side of a HTTP/2 connection.
+
+    The responses are delayed with a heap of due times rather than a
+    thread per stream, as ssl sockets cannot be read and written from
+    different threads.
+    """
+
+    def __init__(self, server, sock):
+        import h2.config
+        import h2.connection
+
+        self.server = server
+        self.sock = sock
+        self.conn = h2.connection.H2Connection(
+            config=h2.config.H2Configuration(client_side=False,
+                                             header_encoding='utf-8'))
+
+    def _flush(self):
+        data = self.conn.data_to_send()
+        if data:
+            self.sock.sendall(data)
+
+    def _send(self, stream_id, body):
+        self.conn.send_headers(stream_id, [
+            (':status', '200'),
+            ('content-type', 'application/json'),
+            ('content-length', str(len(body)))])
+        self.conn.send_data(stream_id, body, end_stream=True)
+
+    def serve(self):
+        import h2.events
+
+        self.conn.initiate_connection()
+        self._flush()
+        pending = []
+        while True:
+            timeout = None
+            if self.sock.pending():
+                timeout = 0
+            elif pending:
+                timeout = max(pending[0][0] - time.time(), 0)
+            readable = select.select([self.sock], [], [], timeout)[0]
+            if readable or self.sock.pending():
+                data = self.sock.recv(65535)
+                if not data:
+                    return
+                for event in self.conn.receive_data(data):
+                    if isinstance(event, h2.events.RequestReceived):
+                        body, delay = self.server.respond(
+                            dict(event.headers)[':path'])
+                        heapq.heappush(pending, (time.time() + delay,
+                                                 event.stream_id, body))
+                    elif isinstance(event, h2.events.DataReceived):
+                        self.conn.acknowledge_received_data(
+                            event.flow_controlled_length, event.stream_id)
+                    elif isinstance(event, h2.events.ConnectionTerminated):
+                        return
+            while pending and pending[0][0] <= time.time():
+                due, stream_id, body = heapq.heappop(pending)
+                self._send(stream_id, body)
+            self._flush()
+
+
+def serve(args):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(args.cert, args.key)
+    context.set_alpn_protocols(
+        ['http/1.1'] if args.http1_only else ['h2', 'http/1.1'])
+    server = StandInServer(context, args.delay)
+    # let the parent process know where to connect
+    print(server.server_address[1])
+    sys.stdout.flush()
+    server.serve_forever()
+
+
+def _stand_in_request(port, path):
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    response = urllib.request.urlopen(
+        'https://127.0.0.1:%d%s' % (port, path), context=context)
+    return json.loads(response.read().decode('utf-8'))
+
+
+def run(http_provider, port, args):
+    import eventlet
+
+    from vmware_nsxlib.v3 import client
+    from vmware_nsxlib.v3 import cluster
+    from vmware_nsxlib.v3 import config
+
+    _stand_in_request(port, '/reset')
+    nsxlib_config = config.NsxLibConfig(
+        nsx_api_managers=['https://127.0.0.1:%d' % port],
+        username='admin', password='secret', insecure=True,
+        concurrent_connections=args.concurrency,
+        adaptive_concurrency=False, conn_idle_timeout=600,
+        http_provider=http_provider)
+    nsxlib_config.extend(keepalive_section='transport-zones',
+                         url_base=client.NSX3Client.NSX_V1_API_PREFIX)
+    api = cluster.NSXClusteredAPI(nsxlib_config)
+    nsx_client = client.NSX3Client(
+        api, nsx_api_managers=nsxlib_config.nsx_api_managers)
+
+    pool = eventlet.GreenPool(args.concurrency)
+    start = time.time()
+    for result in pool.imap(lambda i: nsx_client.get('transport-zones'),
+                            range(args.requests)):
+        pass
+    elapsed = time.time() - start
+
+    stats = _stand_in_request(port, '/stats')
+    # the sockets of the stats requests are not part of the benchmark
+    stats['sockets'] -= 1
+    return {'provider': http_provider.provider_id,
+            'requests/s': args.requests / elapsed,
+            'sockets': stats['sockets'],
+            'h2 sockets': stats.get('h2_sockets', 0)}
+
+
+def benchmark(args):
+    # httpx imports the trio async backend if installed, which does not
+    # load over eventlet green sockets; it is not used here
+    sys.modules.setdefault('trio', None)
+    import eventlet
+    eventlet.monkey_patch()
+
+    from vmware_nsxlib.v3 import client_cert
+    from vmware_nsxlib.v3 import cluster
+    from vmware_nsxlib.v3 import http2_provider
+
+    cert, key = client_cert.generate_self_signed_cert_pair(
+        2048, 1, 'sha256', {client_cert.CERT_SUBJECT_HOST: 'localhost'})
+    tmp = tempfile.mkdtemp()
+    cert_file = os.path.join(tmp, 'cert.pem')
+    key_file = os.path.join(tmp, 'key.pem')
+    with open(cert_file, 'wb') as f:
+        f.write(client_cert.crypto.dump_certificate(
+            client_cert.crypto.FILETYPE_PEM, cert))
+    with open(key_file, 'wb') as f:
+        f.write(client_cert.crypto.dump_privatekey(
+            client_cert.crypto.FILETYPE_PEM, key))
+
+    cmd = [sys.executable, __file__, '--serve', '--cert', cert_file,
+           '--key', key_file, '--delay', str(args.delay)]
+    if args.http1_only:
+        cmd.append('--http1-only')
+    server = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    try:
+        port = int(server.stdout.readline())
+        results = [run(cluster.NSXRequestsHTTPProvider(), port, args),
+                   run(http2_provider.NSXHTTP2Provider(), port, args)]
+    finally:
+        server.terminate()
+        server.wait()
+        os.unlink(cert_file)
+        os.unlink(key_file)
+        os.rmdir(tmp)
+
+    print("%d GET requests, %d concurrent, %.3fs server delay" %
+          (args.requests, args.concurrency, args.delay))
+    print("%-20s %12s %8s %12s" % ('provider', 'requests/s', 'sockets',
+                                   'h2 sockets'))
+    for result in results:
+        print("%(provider)-20s %(requests/s)12.1f %(sockets)8d "
+              "%(h2 sockets)12d" % result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--delay', type=float, default=0.02,
+                        help='server latency of every request in seconds')
+    parser.add_argument('--http1-only', action='store_true')
+    # internal, used to start the stand-in
+    parser.add_argument('--serve', action='store_true',
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--cert', help=argparse.SUPPRESS)
+    parser.add_argument('--key', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args)
+    else:
+        benchmark(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+# Copyright 2017 VMware, Inc.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""Micro-benchmark of the JSON codecs of the REST client.
+
+Measures the CPU time spent by JSONRESTClient encoding the body of a
+request and decoding its response, for large firewall section and logical
+port payloads. The legacy pipeline encodes with sorted keys and decodes
+the response twice, once for the debug log (computed even when debug
+logging is disabled) and once for the caller.
+
+    python tools/json_codec_benchmark.py --items 1000 --repeat 20
+"""
+
+import argparse
+import time
+
+from oslo_serialization import jsonutils
+import requests
+
+from vmware_nsxlib.v3 import client
+from vmware_nsxlib.v3 import json_codec
+
+
+def _tags(i):
+    return [{'scope': 'os-neutron-port-id', 'tag': 'port-%d' % i},
+            {'scope': 'os-project-id', 'tag': 'project-%d' % (i % 10)},
+            {'scope': 'os-api-version', 'tag': '2.1.0'}]
+
+
+def firewall_section(items):
+    """A firewall section with its rules, as created by create_with_rules."""
+    def _target(kind, i):
+        return {'target_type': kind, 'target_id': 'id-%s-%d' % (kind, i),
+                'target_display_name': '%s-%d' % (kind, i),
+                'is_valid': True}
+
+    rules = [{'display_name': 'rule-%d' % i,
+              'id': 'rule-id-%d' % i,
+              'action': 'ALLOW',
+              'direction': 'IN_OUT',
+              'ip_protocol': 'IPV4_IPV6',
+              'logged': False,
+              'disabled': False,
+              'sources': [_target('NSGroup', i)],
+              'destinations': [_target('NSGroup', i + 1),
+                               _target('IPSet', i)],
+              'services': [{'service': {
+                  'resource_type': 'L4PortSetNSService',
+                  'l4_protocol': 'TCP',
+                  'source_ports': [],
+                  'destination_ports': ['%d' % (1024 + i)]}}],
+              'applied_tos': [_target('LogicalSwitch', i)],
+              '_revision': 0}
+             for i in range(items)]
+    return {'display_name': 'section', 'section_type': 'LAYER3',
+            'stateful': True, 'tags': _tags(0), 'rules': rules}
+
+
+def logical_ports(items):
+    """A page of logical ports, as returned by a list request."""
+    ports = [{'id': 'port-id-%d' % i,
+              'display_name': 'port-%d' % i,
+              'resource_type': 'LogicalPort',
+              'logical_switch_id': 'switch-id-%d' % (i % 50),
+              'admin_state': 'UP',
+              'attachment': {
+                  'attachment_type': 'VIF',
+                  'id': 'vif-%d' % i,
+                  'context': {'resource_type': 'VifAttachmentContext',
+                              'vif_type': 'CHILD',
+                              'traffic_tag': i % 4096}},
+              'address_bindings': [{'ip_address': '10.0.%d.%d' % (
+                  i // 256 % 256, i % 256),
+                  'mac_address': 'fa:16:3e:00:%02x:%02x' % (
+                      i // 256 % 256, i % 256)}],
+              'switching_profile_ids': [
+                  {'key': 'SpoofGuardSwitchingProfile',
+                   'value': 'profile-%d' % j} for j in range(4)],
+              'tags': _tags(i),
+              '_create_user': 'admin',
+              '_create_time': 1500000000000 + i,
+              '_revision': i % 7}
+             for i in range(items)]
+    return {'results': ports, 'result_count': items, 'cursor': '0000'}
+
+
+class _Connection(object):
+    """Answers every request with the same JSON document."""
+
+    def __init__(self, content):
+        self._content = content
+
+    def _respond(self, url, data=None, headers=None):
+        response = requests.Response()
+        response.status_code = requests.codes.ok
+        response._content = self._content
+        response.encoding = 'utf-8'
+        return response
+
+    get = post = put = _respond
+
+
+def _legacy_call(connection, body):
+    data = jsonutils.dumps(body, sort_keys=True)
+    response = connection.post('url', data=data)
+    response.json()
+    return response.json()
+
+
+def _measure(call, repeat, rounds=3):
+    """Return the best CPU time of a call over a few rounds, in ms."""
+    call()
+    best = None
+    for r in range(rounds):
+        start = time.process_time()
+        for i in range(repeat):
+            call()
+        elapsed = (time.process_time() - start) / repeat * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark(args):
+    payloads = [
+        ('firewall section', firewall_section(args.items)),
+        ('logical ports', logical_ports(args.items)),
+    ]
+    codecs = [('json', True), ('json', False)]
+    if json_codec.orjson:
+        codecs += [('orjson', True), ('orjson', False)]
+
+    print("%d items per payload, CPU milliseconds per request "
+          "(encoding the payload and decoding it back)" % args.items)
+    print("%-18s %-22s %10s %8s" % ('payload', 'pipeline', 'ms', 'saved'))
+    for name, payload in payloads:
+        content = jsonutils.dump_as_bytes(payload)
+        connection = _Connection(content)
+        legacy = _measure(lambda: _legacy_call(connection, payload),
+                          args.repeat)
+        print("%-18s %-22s %10.2f %8s" % (name, 'legacy', legacy, '-'))
+        for codec_name, sort_keys in codecs:
+            api = client.JSONRESTClient(
+                connection, codec=json_codec.get_codec(
+                    codec_name, sort_keys=sort_keys))
+            elapsed = _measure(lambda: api.url_post('url', payload),
+                               args.repeat)
+            pipeline = '%s%s' % (codec_name,
+                                 ', sorted keys' if sort_keys else '')
+            print("%-18s %-22s %10.2f %7.0f%%" % (
+                name, pipeline, elapsed, (1 - elapsed / legacy) * 100))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--items', type=int, default=1000,
+                        help='rules or ports in each payload')
+    parser.add_argument('--repeat', type=int, default=20)
+    benchmark(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
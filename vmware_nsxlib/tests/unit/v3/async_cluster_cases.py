@@ -0,0 +1,268 @@
+# Copyright 2017 VMware, Inc.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""Test cases of the asyncio flavor of the cluster, loaded by
+test_async_cluster on python 3 only, coroutines being a syntax error for
+python 2.
+"""
+import asyncio
+
+import mock
+from oslo_serialization import jsonutils
+from requests import exceptions as requests_exceptions
+
+from vmware_nsxlib.tests.unit.v3 import nsxlib_testcase
+from vmware_nsxlib.v3 import async_cluster
+from vmware_nsxlib.v3 import cluster
+from vmware_nsxlib.v3 import exceptions as nsxlib_exc
+from vmware_nsxlib.v3 import utils
+
+
+class _MemorySession(object):
+    """Async session answering every request from a callable."""
+
+    def __init__(self, provider_id, respond):
+        self.provider_id = provider_id
+        self._respond = respond
+        self.calls = []
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def close(self):
+        pass
+
+    def __getattr__(self, verb):
+        async def _request(url, data=None, headers=None):
+            self.calls.append((verb, url))
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            try:
+                await asyncio.sleep(0.001)
+                return self._respond(self.provider_id, verb, url, data)
+            finally:
+                self.in_flight -= 1
+        return _request
+
+
+class _MemoryAsyncProvider(cluster.AbstractHTTPProvider):
+
+    def __init__(self, respond, validate=None):
+        self._respond = respond
+        self._validate = validate
+        self.sessions = {}
+
+    @property
+    def provider_id(self):
+        return "Memory async API"
+
+    async def validate_connection(self, cluster_api, endpoint, conn):
+        if self._validate:
+            self._validate(endpoint.provider.id)
+
+    def new_connection(self, cluster_api, provider):
+        session = _MemorySession(provider.id, self._respond)
+        self.sessions[provider.id] = session
+        return session
+
+    def is_connection_exception(self, exception):
+        return isinstance(exception, requests_exceptions.ConnectionError)
+
+
+def _ok(provider_id, verb, url, data):
+    return async_cluster.AsyncResponse(
+        200, content=jsonutils.dumps({'id': 'tz1', 'served_by': provider_id}))
+
+
+class _AsyncTestCase(nsxlib_testcase.NsxClientTestCase):
+
+    def setUp(self):
+        super(_AsyncTestCase, self).setUp()
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def _run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def _new_cluster(self, respond=_ok, validate=None,
+                     conf_managers=('8.9.10.11', '9.10.11.12'),
+                     concurrent_connections=None, **config_kwargs):
+        nsxlib_config = nsxlib_testcase.get_default_nsxlib_config()
+        nsxlib_config.nsx_api_managers = list(conf_managers)
+        for name, value in config_kwargs.items():
+            setattr(nsxlib_config, name, value)
+        if concurrent_connections:
+            nsxlib_config.concurrent_connections = concurrent_connections
+        nsxlib_config.http_provider = _MemoryAsyncProvider(
+            respond, validate=validate)
+        nsxlib_config.extend(keepalive_section='transport-zones',
+                             url_base='api/v1/')
+        api = async_cluster.AsyncNSXClusteredAPI(nsxlib_config)
+        self._run(api.start())
+        self.addCleanup(lambda: self._run(api.close()))
+        return api
+
+
+class AsyncClusteredAPITestCase(_AsyncTestCase):
+
+    def test_sync_provider_rejected(self):
+        nsxlib_config = nsxlib_testcase.get_default_nsxlib_config()
+        nsxlib_config.nsx_api_managers = ['8.9.10.11']
+        nsxlib_config.http_provider = nsxlib_testcase.MemoryMockAPIProvider(
+            mock.Mock())
+        self.assertRaises(nsxlib_exc.UnsupportedHTTPProvider,
+                          async_cluster.AsyncNSXClusteredAPI, nsxlib_config)
+
+    def test_health(self):
+        def _validate(provider_id):
+            if provider_id == '8.9.10.11':
+                raise requests_exceptions.ConnectionError()
+
+        api = self._new_cluster(validate=_validate)
+        # let the validation of every endpoint complete
+        self._run(asyncio.sleep(0.01))
+        self.assertEqual(cluster.ClusterHealth.ORANGE, api.health)
+
+    def test_round_robin(self):
+        api = self._new_cluster()
+        served = [self._run(api.get('api/v1/transport-zones')).json()[
+            'served_by'] for i in range(4)]
+        self.assertEqual(['8.9.10.11', '9.10.11.12',
+                          '8.9.10.11', '9.10.11.12'], served)
+
+    def test_failover_on_connection_error(self):
+        def _respond(provider_id, verb, url, data):
+            if provider_id == '8.9.10.11':
+                raise requests_exceptions.ConnectionError()
+            return _ok(provider_id, verb, url, data)
+
+        api = self._new_cluster(respond=_respond)
+        for i in range(3):
+            result = self._run(api.get('api/v1/transport-zones')).json()
+            self.assertEqual('9.10.11.12', result['served_by'])
+        self.assertEqual(cluster.EndpointState.DOWN,
+                         api.endpoints['8.9.10.11'].state)
+
+    def test_all_endpoints_down(self):
+        def _validate(provider_id):
+            raise requests_exceptions.ConnectionError()
+
+        api = self._new_cluster(validate=_validate)
+        self.assertEqual(cluster.ClusterHealth.RED, api.health)
+        self.assertRaises(nsxlib_exc.ServiceClusterUnavailable,
+                          self._run, api.get('api/v1/transport-zones'))
+
+    def test_concurrency_bounded_per_endpoint(self):
+        api = self._new_cluster(conf_managers=['1.2.3.4'],
+                                concurrent_connections=2)
+
+        async def _burst():
+            await asyncio.gather(*[api.get('api/v1/ports/%d' % i)
+                                   for i in range(10)])
+
+        self._run(_burst())
+        session = api.http_provider.sessions['1.2.3.4']
+        self.assertEqual(10, len(session.calls))
+        self.assertEqual(2, session.peak_in_flight)
+
+    def test_resizable_semaphore(self):
+        semaphore = async_cluster.ResizableSemaphore(1)
+
+        async def _acquire_twice():
+            await semaphore.acquire()
+            waiter = asyncio.ensure_future(semaphore.acquire())
+            await asyncio.sleep(0.001)
+            self.assertFalse(waiter.done())
+            semaphore.resize(2)
+            await waiter
+            # shrinking keeps the slots acquired
+            semaphore.resize(1)
+            self.assertEqual(2, semaphore.acquired)
+            semaphore.release()
+            semaphore.release()
+
+        self._run(_acquire_twice())
+        self.assertEqual(0, semaphore.acquired)
+
+    def test_throttled_request_shrinks_concurrency(self):
+        def _respond(provider_id, verb, url, data):
+            return async_cluster.AsyncResponse(
+                429, headers={'retry-after': '0'})
+
+        api = self._new_cluster(respond=_respond, conf_managers=['1.2.3.4'],
+                                concurrent_connections=8,
+                                adaptive_concurrency=True,
+                                throttle_retries=3)
+        response = self._run(api.get('api/v1/ports'))
+        self.assertEqual(429, response.status_code)
+        # one retry per throttle_retries, honoring the Retry-After delay
+        self.assertEqual(4, len(api.http_provider.sessions['1.2.3.4'].calls))
+        self.assertEqual(4, api.endpoints['1.2.3.4'].semaphore.size)
+
+
+class AsyncNSX3ClientTestCase(_AsyncTestCase):
+
+    def _new_client(self, respond):
+        api = self._new_cluster(respond=respond, conf_managers=['1.2.3.4'])
+        return async_cluster.AsyncNSX3Client(
+            api, nsx_api_managers=['1.2.3.4']), api
+
+    def test_get(self):
+        client, api = self._new_client(_ok)
+        result = self._run(client.get('transport-zones/tz1'))
+        self.assertEqual('tz1', result['id'])
+        self.assertEqual(
+            ('get', 'https://1.2.3.4/api/v1/transport-zones/tz1'),
+            api.http_provider.sessions['1.2.3.4'].calls[-1])
+
+    def test_cached_get_awaitable(self):
+        api = self._new_cluster(conf_managers=['1.2.3.4'])
+        client = async_cluster.AsyncNSX3Client(
+            api, nsx_api_managers=['1.2.3.4'],
+            cache=utils.ResponseCache({'transport-zones': 60}))
+        client.cache.put(client._build_url('transport-zones/tz1'),
+                         {'id': 'cached'}, 60)
+        # the cache is not used, its hits would not be awaitable
+        result = self._run(client.get('transport-zones/tz1'))
+        self.assertEqual('tz1', result['id'])
+
+    def test_blocking_calls_not_supported(self):
+        client, api = self._new_client(_ok)
+        self.assertRaises(NotImplementedError, client.iter_list, 'ports')
+        self.assertRaises(NotImplementedError, client.new_batch)
+        self.assertRaises(NotImplementedError, client.find, 'ports',
+                          'display_name', 'port1')
+
+    def test_get_not_found(self):
+        def _respond(provider_id, verb, url, data):
+            return async_cluster.AsyncResponse(404)
+
+        client, api = self._new_client(_respond)
+        self.assertRaises(nsxlib_exc.ResourceNotFound,
+                          self._run, client.get('ports/1'))
+
+    def test_list_follows_cursor(self):
+        pages = {
+            'https://1.2.3.4/api/v1/ports': {
+                'results': [{'id': '1'}], 'cursor': '1'},
+            'https://1.2.3.4/api/v1/ports?cursor=1': {
+                'results': [{'id': '2'}]}}
+
+        def _respond(provider_id, verb, url, data):
+            return async_cluster.AsyncResponse(
+                200, content=jsonutils.dumps(pages.get(url, {})))
+
+        client, api = self._new_client(_respond)
+        result = self._run(client.list('ports'))
+        self.assertEqual(['1', '2'], [r['id'] for r in result['results']])
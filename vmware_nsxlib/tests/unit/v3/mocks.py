@@ -83,9 +83,10 @@ def make_fake_metadata_proxy():
 
 
 class MockRequestsResponse(object):
-    def __init__(self, status_code, content=None):
+    def __init__(self, status_code, content=None, headers=None):
         self.status_code = status_code
         self.content = content
+        self.headers = headers or {}
 
     def json(self):
         return jsonutils.loads(self.content)
@@ -22,6 +22,7 @@ from oslo_utils import uuidutils
 from requests import exceptions as requests_exceptions
 
 from vmware_nsxlib import v3
+from vmware_nsxlib.tests.unit.v3 import mocks
 from vmware_nsxlib.v3 import client as nsx_client
 from vmware_nsxlib.v3 import client_cert
 from vmware_nsxlib.v3 import cluster as nsx_cluster
@@ -190,7 +191,9 @@ class NsxClientTestCase(NsxLibTestCase):
             http_timeout=None,
             http_read_timeout=None,
             conn_idle_timeout=None,
-            nsx_api_managers=None):
+            nsx_api_managers=None,
+            adaptive_concurrency=False,
+            throttle_retries=0):
 
             nsxlib_config = config.NsxLibConfig(
                 username=username or NSX_USER,
@@ -208,7 +211,9 @@ class NsxClientTestCase(NsxLibTestCase):
                 nsx_api_managers=nsx_api_managers or [NSX_MANAGER],
                 plugin_scope=PLUGIN_SCOPE,
                 plugin_tag=PLUGIN_TAG,
-                plugin_ver=PLUGIN_VER)
+                plugin_ver=PLUGIN_VER,
+                adaptive_concurrency=adaptive_concurrency,
+                throttle_retries=throttle_retries)
 
             super(NsxClientTestCase.MockNSXClusteredAPI, self).__init__(
                 nsxlib_config)
@@ -353,6 +358,32 @@ class NsxClientTestCase(NsxLibTestCase):
 
         return client
 
+    def new_responding_client(self, responses, **kwargs):
+        """Return a NSX3Client sent the responses in turn.
+
+        A response is a MockRequestsResponse, a callable returning one, or
+        else a body sent as JSON with a 200 status. The kwargs are passed
+        to the client, such as its caches.
+        """
+        return self.new_mocked_client(
+            nsx_client.NSX3Client, mock_validate=False,
+            session_response=[
+                mocks.MockRequestsResponse(200, jsonutils.dumps(response))
+                if isinstance(response, (dict, list)) else response
+                for response in responses],
+            **kwargs)
+
+    @staticmethod
+    def sent_verbs(client):
+        """Return the verbs of the requests sent by the client, in order."""
+        return [call[0] for call in client._conn.recorded_calls.method_calls]
+
+    @staticmethod
+    def sent_requests(client, verb):
+        """Return the kwargs, such as url, of the requests of a verb sent."""
+        return [call[1] for call in
+                getattr(client._conn.recorded_calls, verb).call_args_list]
+
     def new_mocked_cluster(self, conf_managers, validate_conn_func,
                            concurrent_connections=None):
         mock_provider = mock.Mock()
@@ -0,0 +1,27 @@
+# Copyright 2017 VMware, Inc.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""Tests of vmware_nsxlib.v3.async_cluster, run on python 3 only.
+
+The test cases are defined in async_cluster_cases, which python 2 cannot
+even compile.
+"""
+import six
+
+if not six.PY2:
+    from vmware_nsxlib.tests.unit.v3 import async_cluster_cases
+
+    AsyncClusteredAPITestCase = async_cluster_cases.AsyncClusteredAPITestCase
+    AsyncNSX3ClientTestCase = async_cluster_cases.AsyncNSX3ClientTestCase
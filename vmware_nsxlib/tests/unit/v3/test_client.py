@@ -13,8 +13,12 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 #
+import collections
 import copy
+import unittest
 
+import eventlet
+import mock
 from oslo_log import log
 from oslo_serialization import jsonutils
 import requests
@@ -22,7 +26,11 @@ import requests
 from vmware_nsxlib.tests.unit.v3 import mocks
 from vmware_nsxlib.tests.unit.v3 import nsxlib_testcase
 from vmware_nsxlib.v3 import client
+from vmware_nsxlib.v3 import core_resources
 from vmware_nsxlib.v3 import exceptions as nsxlib_exc
+from vmware_nsxlib.v3 import json_codec
+from vmware_nsxlib.v3 import load_balancer
+from vmware_nsxlib.v3 import utils
 
 
 LOG = log.getLogger(__name__)
@@ -166,6 +174,16 @@ class NsxV3RESTClientTestCase(nsxlib_testcase.NsxClientTestCase):
             'https://1.2.3.4/api/v1/ports/unique-id',
             data=jsonutils.dumps({'name': 'a-new-name'}))
 
+    def test_client_patch(self):
+        api = self.new_mocked_client(client.RESTClient,
+                                     url_prefix='api/v1/ports')
+        api.patch('unique-id', jsonutils.dumps({'name': 'a-new-name'}))
+
+        assert_call(
+            'patch', api,
+            'https://1.2.3.4/api/v1/ports/unique-id',
+            data=jsonutils.dumps({'name': 'a-new-name'}))
+
     def test_client_create(self):
         api = self.new_mocked_client(client.RESTClient,
                                      url_prefix='api/v1/ports')
@@ -262,6 +280,16 @@ class NsxV3RESTClientTestCase(nsxlib_testcase.NsxClientTestCase):
                 _verb_response_code, verb,
                 requests.codes.NOT_FOUND, 202)
 
+    def test_client_throttling_errors(self):
+        self.assertEqual(
+            nsxlib_exc.TooManyRequests,
+            client.http_error_to_exception(
+                requests.codes.TOO_MANY_REQUESTS, None))
+        self.assertEqual(
+            nsxlib_exc.ServiceUnavailable,
+            client.http_error_to_exception(
+                requests.codes.SERVICE_UNAVAILABLE, None))
+
 
 class NsxV3JSONClientTestCase(nsxlib_testcase.NsxClientTestCase):
 
@@ -298,6 +326,695 @@ class NsxV3JSONClientTestCase(nsxlib_testcase.NsxClientTestCase):
 
         self.assertEqual(json_body, masked_body)
 
+    @unittest.skipIf(json_codec.orjson is None, "orjson is not available")
+    def test_mask_password_orjson(self):
+        body = json_codec.OrjsonCodec().dumps({'name': 'admin',
+                                               'password': 'my!pwd0#'})
+        masked_body = client.RESTClient(None)._mask_password(body)
+        self.assertNotIn('my!pwd0#', masked_body)
+        self.assertEqual('{"name":"admin","password": "********"}',
+                         masked_body)
+
+    def _paginated_client(self, pages):
+        session_response = []
+        for i in range(pages):
+            page = {'results': [{'id': '%d-%d' % (i, j)} for j in range(2)]}
+            if i < pages - 1:
+                page['cursor'] = str(i + 1)
+            session_response.append(
+                mocks.MockRequestsResponse(200, jsonutils.dumps(page)))
+        return self.new_mocked_client(client.JSONRESTClient,
+                                      session_response=session_response,
+                                      url_prefix='api/v1/ports')
+
+    def test_iter_list(self):
+        api = self._paginated_client(3)
+        results = [r['id'] for r in api.iter_list()]
+        self.assertEqual(['0-0', '0-1', '1-0', '1-1', '2-0', '2-1'],
+                         results)
+        assert_json_call('get', api,
+                         'https://1.2.3.4/api/v1/ports/?cursor=2',
+                         single_call=False)
+
+    def test_iter_list_without_prefetch(self):
+        api = self._paginated_client(3)
+        results = api.iter_list(prefetch_depth=0)
+        self.assertEqual('0-0', next(results)['id'])
+        self.assertEqual(1, len(self.sent_requests(api, 'get')))
+        self.assertEqual(6, len(list(results)) + 1)
+
+    def test_iter_list_prefetch_bounded(self):
+        api = self._paginated_client(5)
+        results = api.iter_list(prefetch_depth=1)
+        self.assertEqual('0-0', next(results)['id'])
+        for i in range(3):
+            eventlet.sleep(0)
+        # a page is buffered, and another one waits for room
+        self.assertEqual(3, len(self.sent_requests(api, 'get')))
+        results.close()
+        eventlet.sleep(0)
+        self.assertEqual(3, len(self.sent_requests(api, 'get')))
+
+    def test_iter_list_stream(self):
+        api = self._paginated_client(2)
+        results = list(api.iter_list(stream=True, fields=['id']))
+        self.assertEqual([{'id': '0-0'}, {'id': '0-1'},
+                          {'id': '1-0'}, {'id': '1-1'}], results)
+        assert_json_call('get', api,
+                         'https://1.2.3.4/api/v1/ports/?cursor=1',
+                         single_call=False)
+
+    def test_url_list_fields(self):
+        api = self._paginated_client(2)
+        result = api.url_list('', fields=['id'])
+        self.assertEqual(4, result['result_count'])
+        self.assertEqual({'id': '1-1'}, result['results'][-1])
+
+    def test_iter_list_error(self):
+        api = self.new_mocked_client(
+            client.JSONRESTClient, url_prefix='api/v1/ports',
+            mock_validate=False,
+            session_response=[
+                mocks.MockRequestsResponse(200, jsonutils.dumps(
+                    {'results': [{'id': '1'}], 'cursor': '1'})),
+                mocks.MockRequestsResponse(404, jsonutils.dumps({}))])
+        results = api.iter_list()
+        self.assertEqual('1', next(results)['id'])
+        self.assertRaises(nsxlib_exc.ResourceNotFound, next, results)
+
+
+class JSONCodecTestCase(nsxlib_testcase.NsxClientTestCase):
+
+    def test_get_codec(self):
+        codec = json_codec.get_codec(json_codec.CODEC_AUTO, sort_keys=False)
+        self.assertEqual(json_codec.CODEC_ORJSON if json_codec.orjson
+                         else json_codec.CODEC_JSON, codec.name)
+        self.assertFalse(codec.sort_keys)
+        self.assertRaises(nsxlib_exc.InvalidInput,
+                          json_codec.get_codec, 'yaml')
+
+    def test_unsorted_keys(self):
+        codec = json_codec.get_codec(sort_keys=False)
+        body = collections.OrderedDict([('b', 1), ('a', 2)])
+        self.assertEqual('{"b": 1, "a": 2}', codec.dumps(body))
+
+    @unittest.skipIf(json_codec.orjson is None, "orjson is not available")
+    def test_orjson_request(self):
+        api = self.new_mocked_client(
+            client.JSONRESTClient, url_prefix='api/v1/ports',
+            session_response=mocks.MockRequestsResponse(
+                200, b'{"id": "port1", "name": "\xc3\xa9"}'),
+            codec=json_codec.get_codec(json_codec.CODEC_ORJSON))
+
+        result = api.create(body={'name': u'\xe9', 'id': 'port1'})
+        self.assertEqual({'id': 'port1', 'name': u'\xe9'}, result)
+        assert_json_call('post', api, 'https://1.2.3.4/api/v1/ports',
+                         data=u'{"id":"port1","name":"\xe9"}'.encode('utf-8'))
+
+    def test_response_decoded_once(self):
+        api = self.new_mocked_client(
+            client.JSONRESTClient, url_prefix='api/v1/ports',
+            mock_validate=False,
+            session_response=mocks.MockRequestsResponse(
+                404, jsonutils.dumps({'error_message': 'not found'})))
+
+        with mock.patch.object(api.codec, 'loads',
+                               wraps=api.codec.loads) as loads, \
+                mock.patch.object(client.LOG, 'isEnabledFor',
+                                  return_value=True):
+            self.assertRaises(nsxlib_exc.ResourceNotFound,
+                              api.get, 'port1')
+        self.assertEqual(1, loads.call_count)
+
+    def test_iter_results(self):
+        page = {'result_count': 2, 'cursor': '0002', 'results': [
+            {'id': 'port1', 'display_name': u'\xe9', 'tags': [],
+             'address_bindings': [{'ip_address': '10.0.0.1'}]},
+            {'id': 'port2', 'display_name': 'p2', 'tags': [{'tag': 't'}]}]}
+        content = jsonutils.dump_as_bytes(page)
+        for size in (1, 3, len(content)):
+            chunks = [content[i:i + size]
+                      for i in range(0, len(content), size)]
+            decoded = {}
+            results = list(json_codec.iter_results(
+                chunks, page=decoded, fields=['id', 'tags']))
+            self.assertEqual([{'id': 'port1', 'tags': []},
+                              {'id': 'port2', 'tags': [{'tag': 't'}]}],
+                             results)
+            self.assertEqual({'result_count': 2, 'cursor': '0002'}, decoded)
+
+    def test_iter_results_empty(self):
+        self.assertEqual([], list(json_codec.iter_results([b'{}'])))
+        self.assertEqual([], list(json_codec.iter_results(
+            [b' {"results": [ ]} '])))
+
+    def test_iter_results_truncated(self):
+        results = json_codec.iter_results([b'{"results": [{"id": 1}, '])
+        self.assertEqual({'id': 1}, next(results))
+        self.assertRaises(ValueError, next, results)
+
+    def test_new_client_for_shares_codec(self):
+        codec = json_codec.get_codec(sort_keys=False)
+        api = client.JSONRESTClient(None, codec=codec)
+        self.assertIs(codec, api.new_client_for('ports').codec)
+
+
+class CacheTestCase(nsxlib_testcase.NsxClientTestCase):
+
+    def test_lru_eviction(self):
+        cache = utils._LRUCache(max_entries=2)
+        cache._put_entry('k1', 'v1')
+        cache._put_entry('k2', 'v2')
+        # k1 becomes the most recently used
+        self.assertEqual('v1', cache._get_entry('k1'))
+        cache._put_entry('k3', 'v3')
+        self.assertIsNone(cache._get_entry('k2'))
+        self.assertEqual(['k1', 'k3'], list(cache._entries))
+        self.assertEqual(1, cache.evictions)
+
+    def test_sub_client_shares_caches(self):
+        api = self.new_responding_client(
+            [], cache=utils.ResponseCache({}),
+            validators=utils.ValidatorCache(),
+            object_states=utils.ObjectStateCache(),
+            lookup_index=utils.LookupIndex())
+        sub_client = api.new_client_for('firewall')
+        for name in ('cache', 'validators', 'object_states', 'lookup_index'):
+            self.assertIs(getattr(api, name), getattr(sub_client, name))
+
+
+class ResponseCacheTestCase(nsxlib_testcase.NsxClientTestCase):
+
+    def _cached_client(self, responses):
+        return self.new_responding_client(
+            responses, cache=utils.ResponseCache({'transport-zones': 60}))
+
+    def _get_calls(self, api):
+        return len(self.sent_requests(api, 'get'))
+
+    def test_ttl(self):
+        cache = utils.ResponseCache({'transport-zones': 60, 'dhcp': 10,
+                                     'dhcp/server-profiles': 30})
+        self.assertEqual(60, cache.ttl('https://1.2.3.4/api/v1/'
+                                       'transport-zones/tz1?x=1'))
+        self.assertEqual(30, cache.ttl('policy/api/v1/dhcp/server-profiles'))
+        self.assertEqual(10, cache.ttl('api/v1/dhcp/relays'))
+        self.assertIsNone(cache.ttl('api/v1/transport-zones-x'))
+        self.assertIsNone(cache.ttl('api/v1/logical-ports/tz1'))
+
+    def test_read_through(self):
+        api = self._cached_client([{'id': 'tz1'}, {'id': 'port1'},
+                                   {'id': 'port1'}])
+        self.assertEqual({'id': 'tz1'}, api.get('transport-zones/tz1'))
+        result = api.get('transport-zones/tz1')
+        self.assertEqual({'id': 'tz1'}, result)
+        # callers get their own copy
+        result['id'] = 'modified'
+        self.assertEqual({'id': 'tz1'}, api.get('transport-zones/tz1'))
+        self.assertEqual(1, self._get_calls(api))
+
+        # other resources are not cached
+        api.get('logical-ports/port1')
+        api.get('logical-ports/port1')
+        self.assertEqual(3, self._get_calls(api))
+        self.assertEqual({'hits': 2, 'misses': 1, 'evictions': 0,
+                          'invalidations': 0, 'entries': 1},
+                         api.cache_stats)
+
+    def test_expiry(self):
+        api = self._cached_client([{'id': 'tz1'}, {'id': 'tz1'}])
+        with mock.patch.object(utils.time, 'time', return_value=100):
+            api.get('transport-zones/tz1')
+        with mock.patch.object(utils.time, 'time', return_value=159):
+            api.get('transport-zones/tz1')
+        self.assertEqual(1, self._get_calls(api))
+        with mock.patch.object(utils.time, 'time', return_value=161):
+            api.get('transport-zones/tz1')
+        self.assertEqual(2, self._get_calls(api))
+
+    def test_write_invalidates(self):
+        api = self._cached_client([{'id': 'tz1'}, {'results': []},
+                                   {'id': 'tz1'}, {'id': 'tz1'},
+                                   {'results': []}])
+        api.get('transport-zones/tz1')
+        api.list('transport-zones')
+        api.update('transport-zones/tz1', body={'id': 'tz1'})
+        # the object and its list are read again
+        api.get('transport-zones/tz1')
+        api.list('transport-zones')
+        self.assertEqual(4, self._get_calls(api))
+        self.assertEqual(2, api.cache_stats['invalidations'])
+
+    def test_sub_client_reads_through(self):
+        api = self._cached_client([{'id': 'tz1'}, {'id': 'tz1'}])
+        api.new_client_for('transport-zones').get('tz1')
+        api.get('transport-zones/tz1')
+        self.assertEqual(1, self._get_calls(api))
+
+    def test_write_during_read_not_cached(self):
+        cache = utils.ResponseCache({'transport-zones': 60})
+        generation = cache.generation
+        cache.invalidate('api/v1/transport-zones/tz1')
+        cache.put('api/v1/transport-zones/tz1', {'id': 'tz1'}, 60,
+                  generation=generation)
+        self.assertIsNone(cache.get('api/v1/transport-zones/tz1'))
+
+
+class ConditionalGetTestCase(nsxlib_testcase.NsxClientTestCase):
+
+    def _conditional_client(self, responses):
+        return self.new_responding_client(
+            responses, validators=utils.ValidatorCache())
+
+    def _sent_validators(self, api):
+        return [request['headers'].get('If-None-Match')
+                for request in self.sent_requests(api, 'get')]
+
+    def test_not_modified(self):
+        body = jsonutils.dumps({'id': 'vs1', 'status': 'UP'})
+        api = self._conditional_client([
+            mocks.MockRequestsResponse(200, body, headers={'ETag': '"e1"'}),
+            mocks.MockRequestsResponse(304, ''),
+            mocks.MockRequestsResponse(304, '')])
+
+        for i in range(3):
+            result = api.get('loadbalancer/services/lb1/status')
+            self.assertEqual({'id': 'vs1', 'status': 'UP'}, result)
+            # callers get their own copy
+            result['status'] = 'DOWN'
+        self.assertEqual([None, '"e1"', '"e1"'], self._sent_validators(api))
+        self.assertEqual({'requests': 2, 'not_modified': 2,
+                          'bytes_saved': 2 * len(body), 'entries': 1},
+                         api.conditional_get_stats)
+
+    def test_revision_validator(self):
+        api = self._conditional_client([
+            mocks.MockRequestsResponse(
+                200, jsonutils.dumps({'id': 's1', '_revision': 3})),
+            mocks.MockRequestsResponse(
+                200, jsonutils.dumps({'id': 's1', '_revision': 4})),
+            mocks.MockRequestsResponse(304, '')])
+
+        api.get('firewall/sections/s1')
+        self.assertEqual({'id': 's1', '_revision': 4},
+                         api.get('firewall/sections/s1'))
+        self.assertEqual({'id': 's1', '_revision': 4},
+                         api.get('firewall/sections/s1'))
+        self.assertEqual([None, '"3"', '"4"'], self._sent_validators(api))
+
+    def test_no_validator(self):
+        api = self._conditional_client([
+            mocks.MockRequestsResponse(200, jsonutils.dumps({'id': 's1'})),
+            mocks.MockRequestsResponse(200, jsonutils.dumps({'id': 's1'}))])
+        api.get('firewall/sections/s1')
+        api.get('firewall/sections/s1')
+        self.assertEqual([None, None], self._sent_validators(api))
+        self.assertEqual(0, api.conditional_get_stats['entries'])
+
+    def test_evicted_body(self):
+        api = self._conditional_client([
+            mocks.MockRequestsResponse(200, jsonutils.dumps({'id': 's1'}),
+                                       headers={'ETag': '"e1"'}),
+            mocks.MockRequestsResponse(304, ''),
+            mocks.MockRequestsResponse(200, jsonutils.dumps({'id': 's1'}))])
+        api.get('firewall/sections/s1')
+        # the response is evicted while the request is in flight
+        with mock.patch.object(api.validators, 'get',
+                               side_effect=api.validators.discard):
+            self.assertEqual({'id': 's1'}, api.get('firewall/sections/s1'))
+        self.assertEqual([None, '"e1"', None], self._sent_validators(api))
+
+
+class ObjectStateTestCase(nsxlib_testcase.NsxClientTestCase):
+
+    def _state_client(self, responses):
+        api = self.new_responding_client(
+            responses, object_states=utils.ObjectStateCache())
+        return api, utils.NsxLibApiBase(
+            api, nsxlib_testcase.get_default_nsxlib_config())
+
+    def test_update_skips_get(self):
+        api, resource_api = self._state_client([
+            mocks.MockRequestsResponse(200, jsonutils.dumps(
+                {'id': 'p1', '_revision': 1, 'display_name': 'a'})),
+            mocks.MockRequestsResponse(200, jsonutils.dumps(
+                {'id': 'p1', '_revision': 2, 'display_name': 'b'})),
+            mocks.MockRequestsResponse(200, jsonutils.dumps(
+                {'id': 'p1', '_revision': 3, 'display_name': 'c'}))])
+        resource_api._update_resource_with_retry('logical-ports/p1',
+                                                 {'display_name': 'b'})
+        resource_api._update_resource_with_retry('logical-ports/p1',
+                                                 {'display_name': 'c'})
+        self.assertEqual(['get', 'put', 'put'], self.sent_verbs(api))
+        # the second update is based on the state returned by the first
+        self.assertEqual(
+            {'id': 'p1', '_revision': 2, 'display_name': 'c'},
+            jsonutils.loads(
+                self.sent_requests(api, 'put')[-1]['body']))
+        self.assertEqual({'hits': 1, 'misses': 1, 'entries': 1},
+                         api.object_states.as_dict())
+
+    def test_stale_state(self):
+        api, resource_api = self._state_client([
+            mocks.MockRequestsResponse(200, jsonutils.dumps(
+                {'id': 'p1', '_revision': 1})),
+            mocks.MockRequestsResponse(412, jsonutils.dumps(
+                {'error_message': 'stale'})),
+            mocks.MockRequestsResponse(200, jsonutils.dumps(
+                {'id': 'p1', '_revision': 5})),
+            mocks.MockRequestsResponse(200, jsonutils.dumps(
+                {'id': 'p1', '_revision': 6, 'display_name': 'b'}))])
+        api.get('logical-ports/p1')
+        resource_api._update_resource_with_retry('logical-ports/p1',
+                                                 {'display_name': 'b'})
+        # the update failing with the stale state reads the object again
+        self.assertEqual(['get', 'put', 'get', 'put'], self.sent_verbs(api))
+        self.assertEqual(6, api.get_object_state(
+            'logical-ports/p1')['_revision'])
+
+    def test_partial_and_deleted_objects(self):
+        api, resource_api = self._state_client([
+            mocks.MockRequestsResponse(200, jsonutils.dumps(
+                {'id': 'p1', '_revision': 1})),
+            mocks.MockRequestsResponse(200, jsonutils.dumps(
+                {'id': 'p1', '_revision': 1})),
+            mocks.MockRequestsResponse(200, '')])
+        api.get('logical-ports/p1?fields=id')
+        self.assertIsNone(api.get_object_state('logical-ports/p1'))
+        # created in the collection
+        api.create('logical-ports', body={})
+        self.assertEqual({'id': 'p1', '_revision': 1},
+                         api.get_object_state('logical-ports/p1'))
+        api.delete('logical-ports/p1')
+        self.assertIsNone(api.get_object_state('logical-ports/p1'))
+
+    def test_write_discards_parents(self):
+        states = utils.ObjectStateCache(max_entries=2)
+        states.put('https://nsx/api/v1/firewall/sections/s1',
+                   {'id': 's1', '_revision': 1})
+        states.put('https://nsx/api/v1/firewall/sections/s2',
+                   {'id': 's2', '_revision': 1})
+        states.discard('https://nsx/api/v1/firewall/sections/s1/rules')
+        self.assertIsNone(states.get(
+            'https://nsx/api/v1/firewall/sections/s1'))
+        self.assertIsNotNone(states.get(
+            'https://nsx/api/v1/firewall/sections/s2'))
+
+
+class LookupIndexTestCase(nsxlib_testcase.NsxClientTestCase):
+
+    def _list_response(self, *objects):
+        return mocks.MockRequestsResponse(200, jsonutils.dumps(
+            {'results': list(objects), 'result_count': len(objects)}))
+
+    def _indexed_client(self, responses):
+        api = self.new_responding_client(
+            responses, lookup_index=utils.LookupIndex())
+        return api, utils.NsxLibApiBase(
+            api, nsxlib_testcase.get_default_nsxlib_config())
+
+    def test_lookups_list_once(self):
+        api, resource_api = self._indexed_client([self._list_response(
+            {'id': 's1', 'display_name': 'web',
+             'attachment': {'target_id': 'r1'}},
+            {'id': 's2', 'display_name': 'db',
+             'attachment': {'target_id': 'r2'}})])
+        self.assertEqual(['s2'], [obj['id'] for obj in api.find(
+            'loadbalancer/services', 'display_name', 'db')])
+        self.assertEqual('s1', api.find('loadbalancer/services',
+                                        'attachment.target_id',
+                                        'r1')[0]['id'])
+        self.assertEqual('s2', resource_api._get_resource_by_name_or_id(
+            's2', 'loadbalancer/services'))
+        self.assertEqual('s1', resource_api._get_resource_by_name_or_id(
+            'web', 'loadbalancer/services'))
+        self.assertEqual(['get'], self.sent_verbs(api))
+        self.assertEqual({'hits': 3, 'misses': 1, 'invalidations': 0,
+                          'collections': 1}, api.lookup_index.as_dict())
+
+    def test_list_path_of_api(self):
+        api, resource_api = self._indexed_client([
+            self._list_response({'id': 'p1', 'display_name': 'default'}),
+            self._list_response({'id': 's1',
+                                 'attachment': {'target_id': 'r1'}})])
+        profiles = core_resources.NsxLibSwitchingProfile(
+            api, nsxlib_testcase.get_default_nsxlib_config())
+        services = load_balancer.Service(
+            api, nsxlib_testcase.get_default_nsxlib_config())
+        self.assertEqual('p1', profiles.find_by_display_name(
+            'default')[0]['id'])
+        self.assertEqual('s1', services.get_router_lb_service('r1')['id'])
+        urls = [request['url']
+                for request in self.sent_requests(api, 'get')]
+        self.assertEqual(['https://1.2.3.4/api/v1/switching-profiles/'
+                          '?include_system_owned=True',
+                          'https://1.2.3.4/api/v1/loadbalancer/services'],
+                         urls)
+
+    def test_local_writes(self):
+        api, resource_api = self._indexed_client([
+            self._list_response({'id': 'p1', 'display_name': 'a'}),
+            mocks.MockRequestsResponse(201, jsonutils.dumps(
+                {'id': 'p2', 'display_name': 'a'})),
+            mocks.MockRequestsResponse(200, jsonutils.dumps(
+                {'id': 'p2', 'display_name': 'b'})),
+            mocks.MockRequestsResponse(200, ''),
+            self._list_response({'id': 'p2', 'display_name': 'b'})])
+        api.find('ip-sets', 'display_name', 'a')
+        api.create('ip-sets', body={'display_name': 'a'})
+        self.assertEqual(['p1', 'p2'], [obj['id'] for obj in api.find(
+            'ip-sets', 'display_name', 'a')])
+        api.update('ip-sets/p2', body={'display_name': 'b'})
+        api.delete('ip-sets/p1')
+        self.assertEqual(['p2'], [obj['id'] for obj in api.find(
+            'ip-sets', 'display_name', 'b')])
+        # the writes were applied to the index, which was listed once
+        self.assertEqual(['get', 'post', 'put', 'delete'],
+                         self.sent_verbs(api))
+        # not finding anything lists the collection again
+        self.assertEqual([], api.find('ip-sets', 'display_name', 'a'))
+        self.assertEqual('get', self.sent_verbs(api)[-1])
+
+    def test_not_found_lists_again(self):
+        api, resource_api = self._indexed_client([
+            self._list_response({'id': 'p1', 'display_name': 'a'}),
+            self._list_response({'id': 'p1', 'display_name': 'a'},
+                                {'id': 'p2', 'display_name': 'b'})])
+        api.find('ip-sets', 'display_name', 'a')
+        # created by another client
+        self.assertEqual('p2', api.find('ip-sets', 'display_name',
+                                        'b')[0]['id'])
+        self.assertEqual(['get', 'get'], self.sent_verbs(api))
+
+    def test_action_invalidates(self):
+        api, resource_api = self._indexed_client([
+            self._list_response({'id': 'g1', 'display_name': 'a'}),
+            mocks.MockRequestsResponse(200, jsonutils.dumps(
+                {'id': 'g1', 'display_name': 'a'})),
+            self._list_response({'id': 'g1', 'display_name': 'a'})])
+        api.find('ns-groups', 'display_name', 'a')
+        api.create('ns-groups/g1?action=ADD_MEMBERS', body={})
+        api.find('ns-groups', 'display_name', 'a')
+        self.assertEqual(['get', 'post', 'get'], self.sent_verbs(api))
+        self.assertEqual(1, api.lookup_index.invalidations)
+
+    def test_disabled(self):
+        api = self.new_mocked_client(client.NSX3Client)
+        self.assertIsNone(api.find('ip-sets', 'display_name', 'a'))
+
+
+class SingleFlightTestCase(nsxlib_testcase.NsxClientTestCase):
+
+    def _slow_response(self, status, body):
+        def _respond():
+            # let the other greenthreads send their requests meanwhile
+            eventlet.sleep(0.01)
+            return mocks.MockRequestsResponse(status, jsonutils.dumps(body))
+        return _respond
+
+    def _client(self, responses):
+        return self.new_responding_client(
+            responses, single_flight=client.SingleFlight())
+
+    def _get_calls(self, api):
+        return len(self.sent_requests(api, 'get'))
+
+    def test_coalesced_gets(self):
+        api = self._client([self._slow_response(200, {'id': 'r1'})])
+        threads = [eventlet.spawn(api.get, 'logical-routers/r1')
+                   for i in range(3)]
+        results = [thread.wait() for thread in threads]
+
+        self.assertEqual([{'id': 'r1'}] * 3, results)
+        # each caller gets its own copy
+        self.assertIsNot(results[0], results[1])
+        self.assertIsNot(results[1], results[2])
+        self.assertEqual(1, self._get_calls(api))
+        self.assertEqual({'calls': 3, 'coalesced': 2},
+                         api.single_flight_stats)
+
+    def test_different_gets(self):
+        api = self._client([self._slow_response(200, {'id': 'r1'}),
+                            self._slow_response(200, {'id': 'r2'})])
+        threads = [eventlet.spawn(api.get, 'logical-routers/%s' % uuid)
+                   for uuid in ('r1', 'r2')]
+        self.assertEqual([{'id': 'r1'}, {'id': 'r2'}],
+                         [thread.wait() for thread in threads])
+        self.assertEqual(2, self._get_calls(api))
+
+    def test_get_after_write(self):
+        api = self._client([self._slow_response(200, {'id': 'r1'}),
+                            mocks.MockRequestsResponse(200, '{}'),
+                            self._slow_response(200, {'id': 'r1'})])
+        first = eventlet.spawn(api.get, 'logical-routers/r1')
+        eventlet.sleep(0)
+        api.update('logical-routers/r1', body={'id': 'r1'})
+        # the GET in flight may have been read before the update
+        second = eventlet.spawn(api.get, 'logical-routers/r1')
+        first.wait()
+        second.wait()
+        self.assertEqual(2, self._get_calls(api))
+
+    def test_shared_error(self):
+        api = self._client([self._slow_response(
+            404, {'error_message': 'not found'})])
+        threads = [eventlet.spawn(api.get, 'logical-routers/r1')
+                   for i in range(2)]
+        for thread in threads:
+            self.assertRaises(nsxlib_exc.ResourceNotFound, thread.wait)
+        self.assertEqual(1, self._get_calls(api))
+
+
+class BatchRequestTestCase(nsxlib_testcase.NsxClientTestCase):
+
+    def _posted(self, api):
+        return [(request['url'], jsonutils.loads(request['body']))
+                for request in self.sent_requests(api, 'post')]
+
+    def test_submit(self):
+        api = self.new_responding_client([{'results': [
+            {'code': 201, 'body': {'id': 'port1'}},
+            {'code': 200, 'body': {'id': 'port2'}},
+            {'code': 200}]}])
+        batch = api.new_batch()
+        created = batch.create('logical-ports', body={'name': 'port1'})
+        updated = batch.update('logical-ports/port2', body={'name': 'port2'})
+        deleted = batch.delete('logical-ports/port3?detach=true')
+        self.assertRaises(nsxlib_exc.BatchNotSubmitted, created.result)
+
+        batch.submit()
+        self.assertEqual({'id': 'port1'}, created.result())
+        self.assertEqual({'id': 'port2'}, updated.result())
+        self.assertIsNone(deleted.result())
+        self.assertEqual([(
+            'https://1.2.3.4/api/v1/batch?atomic=false',
+            {'continue_on_error': True, 'requests': [
+                {'method': 'POST', 'uri': '/v1/logical-ports',
+                 'body': {'name': 'port1'}},
+                {'method': 'PUT', 'uri': '/v1/logical-ports/port2',
+                 'body': {'name': 'port2'}},
+                {'method': 'DELETE',
+                 'uri': '/v1/logical-ports/port3?detach=true'}]})],
+            self._posted(api))
+
+    def test_sub_client_uris(self):
+        api = self.new_responding_client([{'results': [{'code': 200}]}])
+        batch = api.new_client_for('logical-ports').new_batch(atomic=True)
+        batch.delete('port1')
+        batch.submit()
+        url, body = self._posted(api)[0]
+        self.assertEqual('https://1.2.3.4/api/v1/batch?atomic=true', url)
+        self.assertEqual('/v1/logical-ports/port1',
+                         body['requests'][0]['uri'])
+
+    def test_split(self):
+        api = self.new_responding_client([
+            {'results': [{'code': 201, 'body': {'id': i}}
+                         for i in range(2)]},
+            {'results': [{'code': 201, 'body': {'id': 2}}]}])
+        batch = api.new_batch(max_requests=2)
+        items = [batch.create('ip-sets', body={}) for i in range(3)]
+        self.assertEqual(items, batch.submit())
+        self.assertEqual([0, 1, 2], [item.result()['id'] for item in items])
+        self.assertEqual([2, 1], [len(body['requests'])
+                                  for url, body in self._posted(api)])
+
+    def test_continue_on_error(self):
+        api = self.new_responding_client([{'has_errors': True, 'results': [
+            {'code': 404, 'body': {'error_message': 'not found',
+                                   'error_code': 202}},
+            {'code': 200}]}])
+        batch = api.new_batch()
+        missing = batch.delete('ip-sets/set1')
+        deleted = batch.delete('ip-sets/set2')
+        batch.submit()
+        self.assertRaises(nsxlib_exc.BackendResourceNotFound,
+                          missing.result)
+        self.assertEqual(404, missing.status_code)
+        self.assertIsNone(deleted.result())
+
+    def test_stop_on_error(self):
+        api = self.new_responding_client([{'has_errors': True, 'results': [
+            {'code': 400, 'body': {'error_message': 'invalid'}}]}])
+        batch = api.new_batch(continue_on_error=False, max_requests=2)
+        items = [batch.delete('ip-sets/set%d' % i) for i in range(3)]
+        batch.submit()
+        # the second request was not run, and the next batch not sent
+        self.assertEqual(1, len(self._posted(api)))
+        for item in items:
+            self.assertRaises(nsxlib_exc.ManagerError, item.result)
+
+    def test_atomic_rolled_back(self):
+        api = self.new_responding_client([
+            {'has_errors': True, 'rolled_back': True,
+             'results': [{'code': 201, 'body': {}},
+                         {'code': 400, 'body': {}}]}])
+        batch = api.new_batch(atomic=True)
+        created = batch.create('ip-sets', body={})
+        invalid = batch.create('ip-sets', body={})
+        batch.submit()
+        self.assertRaises(nsxlib_exc.ManagerError, created.result)
+        self.assertRaises(nsxlib_exc.ManagerError, invalid.result)
+
+    def test_invalidates_cache(self):
+        api = self.new_responding_client(
+            [{'id': 'tz1'}, {'results': [{'code': 200}]}, {'id': 'tz1'}],
+            cache=utils.ResponseCache({'transport-zones': 60}))
+        api.get('transport-zones/tz1')
+        batch = api.new_batch()
+        batch.update('transport-zones/tz1', body={})
+        batch.submit()
+        api.get('transport-zones/tz1')
+        self.assertEqual(2, len(self.sent_requests(api, 'get')))
+
+    def test_updates_object_states_and_lookup_index(self):
+        api = self.new_responding_client(
+            [{'results': [{'id': 'p1', 'display_name': 'a'}],
+              'result_count': 1},
+             {'id': 'p2', 'display_name': 'b', '_revision': 0},
+             {'results': [{'code': 201,
+                           'body': {'id': 'p3', 'display_name': 'c'}},
+                          {'code': 200,
+                           'body': {'id': 'p2', 'display_name': 'd'}},
+                          {'code': 200}]}],
+            object_states=utils.ObjectStateCache(),
+            lookup_index=utils.LookupIndex())
+        api.find('logical-ports', 'display_name', 'a')
+        api.get('logical-ports/p2')
+        self.assertIsNotNone(api.get_object_state('logical-ports/p2'))
+        batch = api.new_batch()
+        batch.create('logical-ports', body={'display_name': 'c'})
+        batch.update('logical-ports/p2', body={'display_name': 'd'})
+        batch.delete('logical-ports/p1')
+        batch.submit()
+        self.assertIsNone(api.get_object_state('logical-ports/p2'))
+        # the created and deleted ports were applied to the index
+        self.assertEqual('p3', api.find('logical-ports', 'display_name',
+                                        'c')[0]['id'])
+        self.assertEqual({'hits': 1, 'misses': 1, 'invalidations': 0,
+                          'collections': 1}, api.lookup_index.as_dict())
+        self.assertEqual(2, len(self.sent_requests(api, 'get')))
+
 
 class NsxV3APIClientTestCase(nsxlib_testcase.NsxClientTestCase):
 
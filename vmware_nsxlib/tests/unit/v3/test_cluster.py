@@ -13,11 +13,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 #
+import gc
 import unittest
 
 import mock
 from oslo_serialization import jsonutils
 from requests import exceptions as requests_exceptions
+from requests.packages.urllib3 import exceptions as urllib3_exceptions
 import six.moves.urllib.parse as urlparse
 
 from vmware_nsxlib.tests.unit.v3 import mocks
@@ -26,6 +28,7 @@ from vmware_nsxlib.v3 import client
 from vmware_nsxlib.v3 import client_cert
 from vmware_nsxlib.v3 import cluster
 from vmware_nsxlib.v3 import exceptions as nsxlib_exc
+from vmware_nsxlib.v3 import utils
 
 
 def _validate_conn_up(*args, **kwargs):
@@ -96,6 +99,38 @@ class RequestsHTTPProviderTestCase(unittest.TestCase):
                        headers=client.JSONRESTClient._DEFAULT_HEADERS)
         provider.validate_connection(mock.Mock(), mock_ep, mock_conn)
 
+    def _probe_config(self, **kwargs):
+        nsxlib_config = nsxlib_testcase.get_default_nsxlib_config()
+        nsxlib_config.extend(keepalive_section='transport-zones',
+                             url_base='api/v1/')
+        for key, value in kwargs.items():
+            setattr(nsxlib_config, key, value)
+        return nsxlib_config
+
+    def test_keepalive_probe(self):
+        self.assertEqual(('GET', 'transport-zones'),
+                         cluster.keepalive_probe(self._probe_config()))
+        self.assertEqual(
+            ('HEAD', 'node/status'),
+            cluster.keepalive_probe(self._probe_config(
+                keepalive_probe_method='head',
+                keepalive_probe_uri='node/status')))
+
+    def test_validate_probe_result(self):
+        mock_ep = mock.Mock()
+        mock_ep.provider.url = 'https://1.2.3.4'
+        cluster.validate_probe_result(
+            mock_ep, 'GET', 'transport-zones', {'result_count': 1})
+        cluster.validate_probe_result(
+            mock_ep, 'GET', 'node/status', {'node_status': 'UP'})
+        # HEAD responses have no body to check
+        cluster.validate_probe_result(
+            mock_ep, 'HEAD', 'transport-zones', mock.Mock())
+        self.assertRaises(nsxlib_exc.ResourceNotFound,
+                          cluster.validate_probe_result,
+                          mock_ep, 'GET', 'transport-zones',
+                          {'result_count': 0, 'results': []})
+
 
 class NsxV3ClusteredAPITestCase(nsxlib_testcase.NsxClientTestCase):
 
@@ -230,7 +265,723 @@ class ClusteredAPITestCase(nsxlib_testcase.NsxClientTestCase):
         eps[0]._state = cluster.EndpointState.UP
         self.assertEqual(_get_schedule(4), [eps[0], eps[2], eps[0], eps[2]])
 
+    def test_keepalive_skips_endpoint_serving_traffic(self):
+        api = self.mock_nsx_clustered_api()
+        api._validate = mock.Mock()
+        endpoint = api.endpoints['1.2.3.4']
+
+        api.get('api/v1/transport-zones')
+        self.assertTrue(api._endpoint_keepalive(endpoint) > 0)
+        self.assertFalse(api._validate.called)
+        self.assertEqual(1, api.endpoint_stats['1.2.3.4']['responses'])
+
+    def test_probe_stats(self):
+        api = self.new_mocked_cluster(['8.9.10.11'], _validate_conn_down)
+        endpoint = api.endpoints['8.9.10.11']
+        stats = api.endpoint_stats['8.9.10.11']
+        self.assertEqual(stats['probes'], stats['probe_failures'])
+        self.assertTrue(stats['probes'] >= 1)
+
+        api._http_provider.validate_connection = _validate_conn_up
+        api._validate(endpoint)
+        stats = api.endpoint_stats['8.9.10.11']
+        self.assertEqual(stats['probes'] - 1, stats['probe_failures'])
+        self.assertIsNotNone(stats['last_probe_latency'])
+
     def test_reinitialize_cluster(self):
         api = self.mock_nsx_clustered_api()
         # just make sure this api is defined, and does not crash
         api._reinit_cluster()
+
+    def test_lazy_init(self):
+        def _validate(cluster_api, endpoint, conn):
+            cluster.eventlet.sleep(0.05)
+
+        nsxlib_config = nsxlib_testcase.get_default_nsxlib_config()
+        nsxlib_config.nsx_api_managers = ['8.9.10.11', '9.10.11.12']
+        nsxlib_config.http_provider = mock.Mock(
+            validate_connection=_validate)
+        nsxlib_config.lazy_cluster_init = True
+        api = cluster.NSXClusteredAPI(nsxlib_config)
+        # returned before validating the endpoints
+        self.assertEqual(cluster.ClusterHealth.RED, api.health)
+
+        with api.endpoint_connection() as conn_data:
+            self.assertEqual(cluster.EndpointState.UP,
+                             conn_data.endpoint.state)
+
+    def test_reinitialize_after_fork(self):
+        api = self.mock_nsx_clustered_api()
+        endpoints = api.endpoints
+        loops = list(api._keepalive_loops)
+        with mock.patch.object(cluster.os, 'getpid',
+                               return_value=api._pid + 1):
+            api.get('api/v1/transport-zones')
+            self.assertEqual(api._pid, cluster.os.getpid())
+        self.assertIsNot(endpoints['1.2.3.4'], api.endpoints['1.2.3.4'])
+        self.assertTrue(all(not loop._running for loop in loops))
+
+    def test_proxy_tracks_outstanding_and_latency(self):
+        api = self.mock_nsx_clustered_api()
+        endpoint = api.endpoints['1.2.3.4']
+        self.assertIsNone(endpoint.latency)
+
+        api.get('api/v1/transport-zones')
+        self.assertEqual(0, endpoint.outstanding)
+        self.assertIsNotNone(endpoint.latency)
+
+        with api.endpoint_connection() as conn_data:
+            self.assertEqual(1, conn_data.endpoint.outstanding)
+        self.assertEqual(0, endpoint.outstanding)
+
+    def test_streamed_response_holds_connection(self):
+        response = mock.Mock(status_code=200)
+        response.iter_content.return_value = iter([b'{', b'}'])
+        mock_provider = mock.Mock(default_scheme='https')
+        mock_provider.new_connection.return_value.get.return_value = response
+        nsxlib_config = nsxlib_testcase.get_default_nsxlib_config()
+        nsxlib_config.nsx_api_managers = ['1.2.3.4']
+        nsxlib_config.http_provider = mock_provider
+        api = cluster.NSXClusteredAPI(nsxlib_config)
+        endpoint = api.endpoints['1.2.3.4']
+
+        streamed = api.get('api/v1/transport-zones', stream=True)
+        # checked out until the body is read to the end
+        self.assertEqual(1, endpoint.outstanding)
+        self.assertEqual([b'{', b'}'], list(streamed.iter_content(8)))
+        self.assertEqual(0, endpoint.outstanding)
+        response.close.assert_called_once_with()
+
+        streamed = api.get('api/v1/transport-zones', stream=True)
+        self.assertEqual(1, endpoint.outstanding)
+        streamed.close()
+        streamed.close()
+        self.assertEqual(0, endpoint.outstanding)
+
+    def test_streamed_response_read_paths_release(self):
+        response = mock.Mock(status_code=200, text='{}')
+        response.json.return_value = {}
+        response.iter_lines.return_value = iter([b'{}'])
+        mock_provider = mock.Mock(default_scheme='https')
+        mock_provider.new_connection.return_value.get.return_value = response
+        nsxlib_config = nsxlib_testcase.get_default_nsxlib_config()
+        nsxlib_config.nsx_api_managers = ['1.2.3.4']
+        nsxlib_config.http_provider = mock_provider
+        api = cluster.NSXClusteredAPI(nsxlib_config)
+        endpoint = api.endpoints['1.2.3.4']
+
+        streamed = api.get('api/v1/transport-zones', stream=True)
+        self.assertEqual({}, streamed.json())
+        self.assertEqual(0, endpoint.outstanding)
+
+        streamed = api.get('api/v1/transport-zones', stream=True)
+        self.assertEqual([b'{}'], list(streamed.iter_lines()))
+        self.assertEqual(0, endpoint.outstanding)
+
+        streamed = api.get('api/v1/transport-zones', stream=True)
+        self.assertEqual('{}', streamed.text)
+        self.assertEqual(0, endpoint.outstanding)
+
+        # a body read from the raw stream is released once collected
+        streamed = api.get('api/v1/transport-zones', stream=True)
+        streamed.raw.read()
+        self.assertEqual(1, endpoint.outstanding)
+        del streamed
+        gc.collect()
+        self.assertEqual(0, endpoint.outstanding)
+
+
+class EndpointSchedulerTestCase(unittest.TestCase):
+
+    def _endpoints(self, count=3):
+        endpoints = []
+        for i in range(count):
+            endpoint = cluster.Endpoint(
+                cluster.Provider(str(i), 'https://%s' % i, None, None, None),
+                None)
+            endpoint._state = cluster.EndpointState.UP
+            endpoints.append(endpoint)
+        return endpoints
+
+    def test_least_outstanding(self):
+        eps = self._endpoints()
+        scheduler = cluster.get_scheduler(
+            cluster.SCHEDULER_LEAST_OUTSTANDING, eps)
+        eps[0].outstanding = 4
+        eps[1].outstanding = 1
+        eps[2].outstanding = 2
+        self.assertEqual(eps[1], scheduler.select())
+
+        # ties are serviced in turn
+        eps[0].outstanding = eps[1].outstanding = eps[2].outstanding = 0
+        self.assertEqual(set(eps),
+                         set([scheduler.select() for i in range(3)]))
+
+    def test_ewma_latency(self):
+        eps = self._endpoints()
+        scheduler = cluster.get_scheduler(cluster.SCHEDULER_EWMA_LATENCY, eps)
+        eps[0].record_latency(0.5)
+        eps[1].record_latency(0.1)
+        # unmeasured endpoints are tried first
+        self.assertEqual(eps[2], scheduler.select())
+
+        eps[2].record_latency(0.2)
+        self.assertEqual(eps[1], scheduler.select())
+
+        # a fast endpoint with a backlog costs more than a slower idle one
+        eps[1].outstanding = 4
+        self.assertEqual(eps[2], scheduler.select())
+
+    def test_ewma_latency_decay(self):
+        endpoint = self._endpoints(1)[0]
+        endpoint.record_latency(1.0)
+        endpoint.record_latency(0.0)
+        self.assertAlmostEqual(1 - cluster.Endpoint.LATENCY_DECAY,
+                               endpoint.latency)
+
+    def test_power_of_two(self):
+        eps = self._endpoints(2)
+        scheduler = cluster.get_scheduler(cluster.SCHEDULER_POWER_OF_TWO, eps)
+        eps[0].outstanding = 3
+        for i in range(5):
+            self.assertEqual(eps[1], scheduler.select())
+
+    def test_down_endpoints_skipped(self):
+        for name in cluster.SCHEDULERS:
+            eps = self._endpoints()
+            scheduler = cluster.get_scheduler(name, eps)
+            eps[0]._state = cluster.EndpointState.DOWN
+            eps[2]._state = cluster.EndpointState.DOWN
+            self.assertEqual(eps[1], scheduler.select())
+
+            eps[1]._state = cluster.EndpointState.DOWN
+            self.assertIsNone(scheduler.select())
+
+    def test_unknown_scheduler(self):
+        self.assertRaises(nsxlib_exc.InvalidInput,
+                          cluster.get_scheduler, 'fastest', [])
+
+    def test_cluster_scheduler_from_config(self):
+        nsxlib_config = nsxlib_testcase.get_default_nsxlib_config()
+        nsxlib_config.endpoint_scheduler = cluster.SCHEDULER_POWER_OF_TWO
+        nsxlib_config.nsx_api_managers = ['1.2.3.4']
+        nsxlib_config.http_provider = mock.Mock()
+        api = cluster.NSXClusteredAPI(nsxlib_config)
+        self.assertIsInstance(api._scheduler, cluster.PowerOfTwoScheduler)
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+
+    def _expire_backoff(self, breaker):
+        breaker._retry_at = 0
+
+    def _trip(self, breaker):
+        for i in range(breaker.window_size):
+            if breaker.record_failure():
+                return
+        self.fail("the breaker was not opened")
+
+    def test_hard_failure_rate(self):
+        breaker = cluster.CircuitBreaker(backoff=4, window_size=10,
+                                         hard_failure_rate=0.3)
+        for i in range(7):
+            breaker.record_success()
+        self.assertFalse(breaker.record_failure())
+        self.assertFalse(breaker.record_failure())
+        self.assertEqual(cluster.CircuitBreakerState.CLOSED, breaker.state)
+        self.assertTrue(breaker.record_failure())
+        self.assertEqual(cluster.CircuitBreakerState.OPEN, breaker.state)
+        self.assertTrue(2 <= breaker.retry_in() <= 4)
+        self.assertFalse(breaker.trial_available())
+
+    def test_isolated_hard_failure(self):
+        breaker = cluster.CircuitBreaker()
+        self.assertFalse(breaker.record_failure())
+        self.assertEqual(cluster.CircuitBreakerState.CLOSED, breaker.state)
+        for i in range(breaker.window_size):
+            breaker.record_success()
+        self.assertFalse(breaker.record_failure())
+        self.assertEqual(cluster.CircuitBreakerState.CLOSED, breaker.state)
+        self.assertEqual(0, breaker.trips)
+
+    def test_half_open_trials(self):
+        breaker = cluster.CircuitBreaker(half_open_requests=2)
+        self._trip(breaker)
+        self._expire_backoff(breaker)
+        self.assertEqual(cluster.CircuitBreakerState.HALF_OPEN,
+                         breaker.state)
+        self.assertEqual(0, breaker.retry_in())
+        breaker.start_trial()
+        self.assertTrue(breaker.trial_available())
+        breaker.start_trial()
+        self.assertFalse(breaker.trial_available())
+
+        breaker.record_success()
+        self.assertEqual(cluster.CircuitBreakerState.CLOSED, breaker.state)
+
+    def test_exponential_backoff(self):
+        breaker = cluster.CircuitBreaker(backoff=1, max_backoff=6)
+        for trips, max_delay in ((1, 1), (2, 2), (3, 4), (4, 6), (5, 6)):
+            self._trip(breaker)
+            self.assertEqual(trips, breaker.trips)
+            self.assertTrue(max_delay / 2.0 <= breaker.retry_in() <=
+                            max_delay)
+            # the trial fails as well
+            self._expire_backoff(breaker)
+
+    def test_trips_forgotten_once_healthy(self):
+        breaker = cluster.CircuitBreaker(window_size=4)
+        self._trip(breaker)
+        self._expire_backoff(breaker)
+        breaker.record_success()
+        self.assertEqual(1, breaker.trips)
+        for i in range(4):
+            breaker.record_success()
+        self.assertEqual(0, breaker.trips)
+
+    def test_soft_failure_rate(self):
+        breaker = cluster.CircuitBreaker(window_size=4, failure_rate=0.5)
+        breaker.record_success()
+        breaker.record_success()
+        self.assertFalse(breaker.record_failure(hard=False))
+        self.assertEqual(cluster.CircuitBreakerState.CLOSED, breaker.state)
+        self.assertTrue(breaker.record_failure(hard=False))
+        self.assertEqual(cluster.CircuitBreakerState.OPEN, breaker.state)
+
+    def test_half_open_failure_reopens(self):
+        breaker = cluster.CircuitBreaker()
+        self._trip(breaker)
+        self._expire_backoff(breaker)
+        breaker.start_trial()
+        self.assertTrue(breaker.record_failure(hard=False))
+        self.assertEqual(cluster.CircuitBreakerState.OPEN, breaker.state)
+        self.assertEqual(2, breaker.trips)
+
+
+class ClusteredAPICircuitBreakerTestCase(nsxlib_testcase.NsxClientTestCase):
+
+    def _down_endpoint(self, api, provider_id):
+        endpoint = api.endpoints[provider_id]
+        for i in range(endpoint.breaker.window_size // 2):
+            api._record_failure(endpoint)
+        return endpoint
+
+    def test_isolated_connection_error(self):
+        api = self.mock_nsx_clustered_api(
+            nsx_api_managers=['8.9.10.11', '9.10.11.12'])
+        endpoint = api.endpoints['8.9.10.11']
+        for i in range(endpoint.breaker.window_size):
+            api._record_response(endpoint, mocks.MockRequestsResponse(200))
+        api._record_failure(endpoint)
+        # left to the next keepalive probe, without backing off
+        self.assertEqual(cluster.EndpointState.DOWN, endpoint.state)
+        self.assertEqual(cluster.CircuitBreakerState.CLOSED,
+                         endpoint.breaker.state)
+        self.assertEqual(0, endpoint.breaker.retry_in())
+
+    def test_open_endpoint_not_selected(self):
+        api = self.mock_nsx_clustered_api(
+            nsx_api_managers=['8.9.10.11', '9.10.11.12'])
+        endpoint = self._down_endpoint(api, '8.9.10.11')
+        self.assertEqual(cluster.EndpointState.DOWN, endpoint.state)
+        for i in range(4):
+            self.assertNotEqual(endpoint, api._select_endpoint())
+
+    def test_half_open_endpoint_trial(self):
+        api = self.mock_nsx_clustered_api(
+            nsx_api_managers=['8.9.10.11', '9.10.11.12'])
+        endpoint = self._down_endpoint(api, '8.9.10.11')
+        endpoint.breaker._retry_at = 0
+
+        selected = [api._select_endpoint() for i in range(4)]
+        # a single trial request at a time
+        self.assertEqual(1, selected.count(endpoint))
+
+        api._record_response(endpoint, mocks.MockRequestsResponse(200))
+        self.assertEqual(cluster.EndpointState.UP, endpoint.state)
+        self.assertEqual(cluster.CircuitBreakerState.CLOSED,
+                         endpoint.breaker.state)
+
+    def test_overloaded_responses_open_breaker(self):
+        api = self.mock_nsx_clustered_api()
+        endpoint = api.endpoints['1.2.3.4']
+        for i in range(5):
+            api._record_response(endpoint, mocks.MockRequestsResponse(503))
+        self.assertEqual(cluster.EndpointState.DOWN, endpoint.state)
+        self.assertEqual(5, endpoint.stats.responses)
+
+    def test_keepalive_backs_off(self):
+        api = self.mock_nsx_clustered_api()
+        api._validate = mock.Mock()
+        endpoint = self._down_endpoint(api, '1.2.3.4')
+
+        delay = api._endpoint_keepalive(endpoint)
+        self.assertFalse(api._validate.called)
+        self.assertTrue(0 < delay <= endpoint.breaker.backoff)
+
+        endpoint.breaker._retry_at = 0
+        api._endpoint_keepalive(endpoint)
+        api._validate.assert_called_once_with(endpoint)
+
+    def test_read_timeout_not_retried(self):
+
+        def read_timeout():
+            raise requests_exceptions.ReadTimeout()
+
+        api = self.mock_nsx_clustered_api(session_response=read_timeout)
+        self.assertRaises(requests_exceptions.ReadTimeout,
+                          api.get, 'api/v1/transport-zones')
+        endpoint = api.endpoints['1.2.3.4']
+        self.assertEqual(cluster.EndpointState.UP, endpoint.state)
+        # counted as a soft failure of the endpoint
+        self.assertIs(False, endpoint.breaker._window[-1])
+
+
+class ClusteredAPIRetryBudgetTestCase(nsxlib_testcase.NsxClientTestCase):
+
+    def _budgeted_api(self, max_tokens, **kwargs):
+        api = self.mock_nsx_clustered_api(**kwargs)
+        api._retry_budget = utils.RetryBudget(
+            ratio=0, min_retries_per_second=0, max_tokens=max_tokens)
+        return api
+
+    def test_failover_within_budget(self):
+        def connect_timeout():
+            raise requests_exceptions.ConnectTimeout()
+
+        api = self._budgeted_api(
+            10, session_response=[connect_timeout, connect_timeout],
+            nsx_api_managers=['8.9.10.11', '9.10.11.12'])
+        self.assertRaises(nsxlib_exc.ServiceClusterUnavailable,
+                          api.get, 'api/v1/transport-zones')
+        self.assertEqual({'requests': 1, 'retries': 2, 'retries_denied': 0,
+                          'tokens': 8}, api.retry_budget_stats)
+
+    def test_failover_budget_exhausted(self):
+        def connect_timeout():
+            raise requests_exceptions.ConnectTimeout()
+
+        api = self._budgeted_api(
+            0, session_response=connect_timeout,
+            nsx_api_managers=['8.9.10.11', '9.10.11.12'])
+        self.assertRaises(requests_exceptions.ConnectTimeout,
+                          api.get, 'api/v1/transport-zones')
+        self.assertEqual(1, api.retry_budget_stats['retries_denied'])
+        # the other endpoint was not tried
+        self.assertEqual(cluster.ClusterHealth.ORANGE, api.health)
+
+    def test_no_budget(self):
+        api = self.mock_nsx_clustered_api()
+        self.assertIsNone(api.retry_budget)
+        self.assertIsNone(api.retry_budget_stats)
+
+    def test_urllib3_retries_draw_from_budget(self):
+        budget = utils.RetryBudget(ratio=0, min_retries_per_second=0,
+                                   max_tokens=1)
+        retry = cluster.BudgetedRetry(total=3, budget=budget)
+        retry = retry.increment(method='GET', url='/api/v1/ports')
+        self.assertIs(budget, retry.budget)
+        self.assertRaises(urllib3_exceptions.MaxRetryError, retry.increment,
+                          method='GET', url='/api/v1/ports')
+        self.assertEqual(1, budget.retries)
+        self.assertEqual(1, budget.retries_denied)
+
+    def test_new_connection_with_budget(self):
+        mock_api = mock.Mock()
+        mock_api.nsxlib_config.retries = 5
+        mock_api.nsxlib_config.client_cert_provider = None
+        mock_api.retry_budget = utils.RetryBudget()
+        session = cluster.NSXRequestsHTTPProvider().new_connection(
+            mock_api, cluster.Provider('9.8.7.6', 'https://9.8.7.6',
+                                       'nsxuser', 'nsxpassword', None))
+        max_retries = session.adapters['https://'].max_retries
+        self.assertEqual(5, max_retries.total)
+        self.assertIs(mock_api.retry_budget, max_retries.budget)
+
+
+class ConcurrencyLimiterTestCase(unittest.TestCase):
+
+    def test_overload_decreases_limit(self):
+        limiter = cluster.ConcurrencyLimiter(10, min_limit=2)
+        limiter.record_overload()
+        self.assertEqual(5, limiter.limit)
+        # a burst of overload signals is a single decrease
+        limiter.record_overload()
+        self.assertEqual(5, limiter.limit)
+
+        for i in range(3):
+            limiter._decreased_at = 0
+            limiter.record_overload()
+        self.assertEqual(2, limiter.limit)
+        self.assertEqual(4, limiter.decreases)
+
+    def test_additive_increase(self):
+        limiter = cluster.ConcurrencyLimiter(10)
+        limiter.record_overload()
+        # about a whole limit of successful responses grows the limit by one
+        for i in range(6):
+            limiter.record_latency(0.1)
+        self.assertEqual(6, limiter.limit)
+        for i in range(100):
+            limiter.record_latency(0.1)
+        self.assertEqual(10, limiter.limit)
+
+    def test_latency_rise_decreases_limit(self):
+        limiter = cluster.ConcurrencyLimiter(10)
+        for i in range(10):
+            limiter.record_latency(0.1)
+        self.assertEqual(10, limiter.limit)
+        for i in range(3):
+            limiter.record_latency(2)
+        self.assertEqual(5, limiter.limit)
+
+    def test_small_latency_rise_ignored(self):
+        limiter = cluster.ConcurrencyLimiter(10)
+        limiter.record_latency(0.001)
+        limiter.record_latency(0.01)
+        self.assertEqual(10, limiter.limit)
+
+
+class ClusteredAPIThrottlingTestCase(nsxlib_testcase.NsxClientTestCase):
+
+    def test_retry_after(self):
+        self.assertEqual(3, cluster.get_retry_after(
+            mocks.MockRequestsResponse(429, headers={'Retry-After': '3'})))
+        self.assertIsNone(cluster.get_retry_after(
+            mocks.MockRequestsResponse(429)))
+        self.assertEqual(0, cluster.get_retry_after(
+            mocks.MockRequestsResponse(503, headers={
+                'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'})))
+
+    def test_throttle_delay(self):
+        response = mocks.MockRequestsResponse(429)
+        for attempt in range(3):
+            delay = cluster.throttle_delay(response, attempt)
+            self.assertTrue(
+                0 <= delay <= cluster.THROTTLE_BACKOFF * 2 ** attempt)
+        response.headers['Retry-After'] = '3600'
+        self.assertEqual(cluster.THROTTLE_MAX_DELAY,
+                         cluster.throttle_delay(response, 0))
+
+    def test_throttled_request_retried(self):
+        api = self.mock_nsx_clustered_api(session_response=[
+            mocks.MockRequestsResponse(429, headers={'Retry-After': '2'}),
+            mocks.MockRequestsResponse(200)],
+            adaptive_concurrency=True, throttle_retries=3)
+        with mock.patch.object(cluster.eventlet, 'sleep') as mock_sleep:
+            response = api.get('api/v1/transport-zones')
+        self.assertEqual(200, response.status_code)
+        mock_sleep.assert_called_once_with(2)
+
+        endpoint = api.endpoints['1.2.3.4']
+        self.assertEqual(nsxlib_testcase.NSX_CONCURENT_CONN // 2,
+                         endpoint.pool.max_size)
+        # a throttled request is not an endpoint failure
+        self.assertEqual(cluster.EndpointState.UP, endpoint.state)
+
+    def test_throttled_request_retries_exhausted(self):
+        api = self.mock_nsx_clustered_api(session_response=[
+            mocks.MockRequestsResponse(503) for i in range(4)],
+            throttle_retries=3)
+        with mock.patch.object(cluster.eventlet, 'sleep') as mock_sleep:
+            response = api.get('api/v1/transport-zones')
+        self.assertEqual(503, response.status_code)
+        self.assertEqual(3, mock_sleep.call_count)
+
+    def test_throttled_post_not_resent_on_503(self):
+        api = self.mock_nsx_clustered_api(session_response=[
+            mocks.MockRequestsResponse(503), mocks.MockRequestsResponse(201)],
+            throttle_retries=3)
+        with mock.patch.object(cluster.eventlet, 'sleep') as mock_sleep:
+            response = api.post('api/v1/transport-zones', data='{}')
+        self.assertEqual(503, response.status_code)
+        mock_sleep.assert_not_called()
+
+    def test_throttled_request_not_retried_by_default(self):
+        api = self.mock_nsx_clustered_api(session_response=[
+            mocks.MockRequestsResponse(503), mocks.MockRequestsResponse(200)])
+        with mock.patch.object(cluster.eventlet, 'sleep') as mock_sleep:
+            response = api.get('api/v1/transport-zones')
+        self.assertEqual(503, response.status_code)
+        mock_sleep.assert_not_called()
+        self.assertIsNone(api.endpoints['1.2.3.4'].limiter)
+
+
+class ConnectionRegistryTestCase(nsxlib_testcase.NsxClientTestCase):
+
+    def test_endpoint_for_connection(self):
+        api = self.mock_nsx_clustered_api(
+            nsx_api_managers=['8.9.10.11', '9.10.11.12'])
+        for provider_id, endpoint in api.endpoints.items():
+            with api.endpoint_connection() as conn_data:
+                self.assertEqual(
+                    conn_data.endpoint,
+                    api.endpoint_for_connection(conn_data.connection))
+        self.assertIsNone(api.endpoint_for_connection(mock.Mock()))
+
+    def test_connection_usage(self):
+        api = self.mock_nsx_clustered_api()
+        api.get('api/v1/transport-zones')
+        with api.endpoint_connection() as conn_data:
+            info = api.connection_info(conn_data.connection)
+        self.assertEqual(api.endpoints['1.2.3.4'], info.endpoint)
+        # the validation of the endpoint, the proxied request and this one
+        self.assertEqual(3, info.requests)
+        self.assertIsNotNone(info.last_used)
+
+    def test_connection_max_requests(self):
+        api = self.mock_nsx_clustered_api()
+        api._connections.max_requests = 2
+        endpoint = api.endpoints['1.2.3.4']
+        conns = []
+        for i in range(4):
+            with api.endpoint_connection() as conn_data:
+                conns.append(conn_data.connection)
+        # the validation of the endpoint used the first connection once
+        self.assertNotEqual(conns[0], conns[1])
+        self.assertEqual(conns[1], conns[2])
+        self.assertNotEqual(conns[2], conns[3])
+        self.assertIsNone(api.connection_info(conns[0]))
+        # the pool was not rebuilt
+        self.assertEqual(1, endpoint.pool.current_size)
+
+    def test_untrusted_certificate_renews_connections(self):
+        api = self.mock_nsx_clustered_api()
+        endpoint = api.endpoints['1.2.3.4']
+        conn = endpoint.pool.free_items[0]
+        with mock.patch.object(
+                api.http_provider, 'validate_connection',
+                side_effect=nsxlib_exc.ClientCertificateNotTrusted):
+            api._validate(endpoint)
+        self.assertTrue(api.connection_info(conn).retired)
+
+        with api.endpoint_connection() as conn_data:
+            self.assertNotEqual(conn, conn_data.connection)
+
+    def test_connection_max_age(self):
+        registry = cluster.ConnectionRegistry(max_age=10)
+        conn = mock.Mock()
+        info = registry.register(conn, mock.Mock())
+        self.assertFalse(registry.expired(conn))
+        info.created -= 10
+        self.assertTrue(registry.expired(conn))
+
+    def test_retire_endpoint(self):
+        registry = cluster.ConnectionRegistry()
+        endpoint = mock.Mock()
+        conns = [mock.Mock(), mock.Mock()]
+        registry.register(conns[0], endpoint)
+        registry.register(conns[1], mock.Mock())
+        registry.retire_endpoint(endpoint)
+        self.assertTrue(registry.expired(conns[0]))
+        self.assertFalse(registry.expired(conns[1]))
+
+    def test_dropped_connection_unregistered(self):
+        registry = cluster.ConnectionRegistry()
+        registry.register(mock.Mock(), mock.Mock())
+        self.assertEqual(0, len(registry))
+
+
+class ClusteredAPIHedgingTestCase(nsxlib_testcase.NsxClientTestCase):
+
+    def _new_cluster(self, get):
+        mock_provider = mock.Mock()
+        mock_provider.default_scheme = 'https'
+        mock_provider.new_connection.return_value.get.side_effect = get
+
+        nsxlib_config = nsxlib_testcase.get_default_nsxlib_config()
+        nsxlib_config.nsx_api_managers = ['1.2.3.4', '8.9.10.11']
+        nsxlib_config.http_provider = mock_provider
+        nsxlib_config.hedge_percentile = 90
+        api = cluster.NSXClusteredAPI(nsxlib_config)
+        for endpoint in api.endpoints.values():
+            for i in range(cluster.HedgePolicy.MIN_SAMPLES):
+                endpoint.record_latency(0.01)
+        return api
+
+    def _get(self, api, endpoint):
+        with mock.patch.object(api._scheduler, 'select',
+                               return_value=endpoint):
+            return api.get('api/v1/transport-zones')
+
+    @staticmethod
+    def _slow_get(url, *args, **kwargs):
+        if url.startswith('https://1.2.3.4'):
+            cluster.eventlet.sleep(0.2)
+            return mocks.MockRequestsResponse(200, content='slow')
+        return mocks.MockRequestsResponse(200, content='fast')
+
+    def test_latency_percentile(self):
+        endpoint = cluster.Endpoint(mock.Mock(), None)
+        self.assertIsNone(endpoint.latency_percentile(90))
+        for latency in range(1, 11):
+            endpoint.record_latency(latency)
+        self.assertEqual(9, endpoint.latency_percentile(90))
+        self.assertEqual(10, endpoint.latency_percentile(100))
+        self.assertIsNone(endpoint.latency_percentile(90, min_samples=11))
+
+    def test_slow_get_hedged(self):
+        api = self._new_cluster(self._slow_get)
+        response = self._get(api, api.endpoints['1.2.3.4'])
+        self.assertEqual('fast', response.content)
+        stats = api.hedge_stats
+        self.assertEqual(1, stats['hedges'])
+        self.assertEqual(1, stats['wins'])
+
+    def test_fast_get_not_hedged(self):
+        api = self._new_cluster(self._slow_get)
+        response = self._get(api, api.endpoints['8.9.10.11'])
+        self.assertEqual('fast', response.content)
+        self.assertEqual(0, api.hedge_stats['hedges'])
+
+    def test_hedge_budget_exhausted(self):
+        api = self._new_cluster(self._slow_get)
+        api._hedge_policy.budget._tokens = 0
+        response = self._get(api, api.endpoints['1.2.3.4'])
+        self.assertEqual('slow', response.content)
+        self.assertEqual(0, api.hedge_stats['hedges'])
+        self.assertEqual(1, api.hedge_stats['hedges_denied'])
+
+    def test_hedge_loser_closed(self):
+        responses = []
+
+        def _get(url, *args, **kwargs):
+            response = self._slow_get(url)
+            response.close = mock.Mock()
+            responses.append(response)
+            return response
+
+        api = self._new_cluster(_get)
+        response = self._get(api, api.endpoints['1.2.3.4'])
+        self.assertEqual('fast', response.content)
+        response.close.assert_not_called()
+        cluster.eventlet.sleep(0.3)
+        self.assertEqual(2, len(responses))
+        slow = [r for r in responses if r.content == 'slow'][0]
+        slow.close.assert_called_once_with()
+
+    def test_hedge_delay_floor(self):
+        api = self._new_cluster(self._slow_get)
+        endpoint = api.endpoints['1.2.3.4']
+        endpoint.latencies.clear()
+        for i in range(cluster.HedgePolicy.MIN_SAMPLES):
+            endpoint.record_latency(0)
+        self.assertEqual(cluster.HedgePolicy.MIN_DELAY,
+                         api._hedge_policy.delay(endpoint))
+
+    def test_failed_hedge_loses(self):
+        def _get(url, *args, **kwargs):
+            if url.startswith('https://8.9.10.11'):
+                raise nsxlib_exc.ManagerError(details='error')
+            return self._slow_get(url)
+
+        api = self._new_cluster(_get)
+        response = self._get(api, api.endpoints['1.2.3.4'])
+        self.assertEqual('slow', response.content)
+        self.assertEqual(0, api.hedge_stats['wins'])
+
+    def test_hedging_disabled(self):
+        nsxlib_config = nsxlib_testcase.get_default_nsxlib_config()
+        self.assertIsNone(nsxlib_config.hedge_opts())
+        api = self.mock_nsx_clustered_api()
+        self.assertIsNone(api.hedge_stats)
@@ -0,0 +1,138 @@
+# Copyright 2017 VMware, Inc.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+import unittest
+
+import mock
+
+from vmware_nsxlib.tests.unit.v3 import nsxlib_testcase
+from vmware_nsxlib.v3 import client
+from vmware_nsxlib.v3 import cluster
+from vmware_nsxlib.v3 import http2_provider
+
+httpx = http2_provider.httpx
+
+
+@unittest.skipIf(httpx is None, "httpx is not available")
+class NSXHTTP2ProviderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(NSXHTTP2ProviderTestCase, self).setUp()
+        self.requests = []
+        self.http_provider = http2_provider.NSXHTTP2Provider()
+        # answer from memory rather than over the network
+        mock.patch.object(self.http_provider, '_new_client',
+                          side_effect=self._new_client).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def _handler(self, request):
+        self.requests.append(request)
+        return httpx.Response(200, json={'results': [{'id': 'tz1'}],
+                                         'result_count': 1})
+
+    def _new_client(self, config, provider):
+        return httpx.Client(transport=httpx.MockTransport(self._handler))
+
+    def _new_cluster(self, conf_managers=('1.2.3.4',)):
+        nsxlib_config = nsxlib_testcase.get_default_nsxlib_config()
+        nsxlib_config.nsx_api_managers = list(conf_managers)
+        nsxlib_config.http_provider = self.http_provider
+        nsxlib_config.extend(keepalive_section='transport-zones',
+                             url_base=client.NSX3Client.NSX_V1_API_PREFIX)
+        return cluster.NSXClusteredAPI(nsxlib_config)
+
+    def test_requests(self):
+        api = self._new_cluster()
+        nsx_client = client.NSX3Client(api, nsx_api_managers=['1.2.3.4'])
+        result = nsx_client.create('transport-zones', body={'name': 'tz'})
+        self.assertEqual('tz1', result['results'][0]['id'])
+
+        request = self.requests[-1]
+        self.assertEqual('POST', request.method)
+        self.assertEqual('https://1.2.3.4/api/v1/transport-zones',
+                         str(request.url))
+        self.assertEqual(b'{"name": "tz"}', request.content)
+
+    def test_stream_list(self):
+        api = self._new_cluster()
+        nsx_client = client.NSX3Client(api, nsx_api_managers=['1.2.3.4'])
+        results = list(nsx_client.iter_list('transport-zones', stream=True,
+                                            fields=['id']))
+        self.assertEqual([{'id': 'tz1'}], results)
+
+    def test_connections_share_client(self):
+        api = self._new_cluster(conf_managers=['1.2.3.4', '5.6.7.8'])
+        providers = dict((p.id, p) for p in api.providers)
+        sessions = [self.http_provider.new_connection(api, providers[p_id])
+                    for p_id in ('1.2.3.4', '1.2.3.4', '5.6.7.8')]
+        self.assertIs(sessions[0]._shared, sessions[1]._shared)
+        self.assertIsNot(sessions[0]._shared, sessions[2]._shared)
+
+    def _provider(self):
+        return cluster.Provider('1.2.3.4', 'https://1.2.3.4',
+                                None, None, None)
+
+    def test_close_keeps_client(self):
+        api = mock.Mock()
+        sessions = [self.http_provider.new_connection(api, self._provider())
+                    for i in range(2)]
+        shared = sessions[0]._shared
+
+        sessions[0].close()
+        new_session = self.http_provider.new_connection(api, self._provider())
+        self.assertIs(shared, new_session._shared)
+        sessions[1].close()
+        new_session.close()
+        # closed once unused
+        self.assertTrue(shared.client.is_closed)
+        self.assertIsNot(shared, self.http_provider.new_connection(
+            api, self._provider())._shared)
+
+    def test_broken_client_rotated(self):
+        def _refuse(request):
+            raise httpx.ConnectError('refused')
+
+        api = mock.Mock()
+        sessions = [self.http_provider.new_connection(api, self._provider())
+                    for i in range(2)]
+        shared = sessions[0]._shared
+        shared.client = httpx.Client(transport=httpx.MockTransport(_refuse))
+        self.assertRaises(httpx.ConnectError, sessions[0].get,
+                          'https://1.2.3.4/api/v1/transport-zones')
+
+        sessions[0].close()
+        # new connections use a new client, the broken one stays open for
+        # the sessions still using it
+        new_session = self.http_provider.new_connection(api, self._provider())
+        self.assertIsNot(shared, new_session._shared)
+        self.assertFalse(shared.client.is_closed)
+        sessions[1].close()
+        self.assertTrue(shared.client.is_closed)
+
+    def test_http_version(self):
+        api = self._new_cluster()
+        with api.endpoint_connection() as conn_data:
+            # negotiated by the validation of the endpoint
+            self.assertEqual('HTTP/1.1', conn_data.connection.http_version)
+
+    def test_exceptions(self):
+        self.assertTrue(self.http_provider.is_connection_exception(
+            httpx.ConnectError('refused')))
+        self.assertTrue(self.http_provider.is_connection_exception(
+            httpx.ConnectTimeout('timeout')))
+        self.assertFalse(self.http_provider.is_connection_exception(
+            httpx.ReadTimeout('timeout')))
+        self.assertTrue(self.http_provider.is_timeout_exception(
+            httpx.ReadTimeout('timeout')))
@@ -14,12 +14,17 @@
 #    under the License.
 #
 
+import copy
+
+import eventlet
 import mock
 
 from vmware_nsxlib.tests.unit.v3 import nsxlib_testcase
 from vmware_nsxlib.tests.unit.v3 import test_constants as consts
 from vmware_nsxlib.v3 import exceptions as nsxlib_exc
 from vmware_nsxlib.v3 import load_balancer
+from vmware_nsxlib.v3 import utils
+from vmware_nsxlib.v3 import write_executor
 
 
 app_profile_types = load_balancer.ApplicationProfileTypes
@@ -143,6 +148,17 @@ class TestRule(nsxlib_testcase.NsxClientTestCase):
             self.nsxlib.load_balancer.rule.create(**body)
             create.assert_called_with('loadbalancer/rules', body)
 
+    def test_find_rule_by_display_name(self):
+        with mock.patch.object(self.nsxlib.client, 'iter_list',
+                               return_value=iter([
+                                   {'id': 'rule1', 'display_name': 'a'},
+                                   {'id': 'rule2', 'display_name': 'b'}])
+                               ) as iter_list:
+            found = self.nsxlib.load_balancer.rule.find_by_display_name('b')
+        self.assertEqual(['rule2'], [rule['id'] for rule in found])
+        iter_list.assert_called_once_with('loadbalancer/rules', stream=False,
+                                          fields=None)
+
     def test_list_rules(self):
         with mock.patch.object(self.nsxlib.client, 'list') as list_call:
             self.nsxlib.load_balancer.rule.list()
@@ -354,6 +370,36 @@ class TestPool(nsxlib_testcase.NsxClientTestCase):
                 resource = 'loadbalancer/pools/%s' % fake_pool['id']
                 update.assert_called_with(resource, body)
 
+    def test_add_monitors_concurrently(self):
+        fake_pool = consts.FAKE_POOL.copy()
+        fake_pool['active_monitor_ids'] = []
+
+        def _get(resource):
+            eventlet.sleep(0.01)
+            return copy.deepcopy(fake_pool)
+
+        def _update(resource, body):
+            fake_pool.update(body)
+            return body
+
+        with mock.patch.object(self.nsxlib.client, 'write_queue',
+                               write_executor.WriteMergeQueue()), \
+            mock.patch.object(self.nsxlib.client, 'get',
+                              side_effect=_get) as get, \
+            mock.patch.object(self.nsxlib.client, 'update',
+                              side_effect=_update) as update:
+            adds = [eventlet.spawn(
+                self.nsxlib.load_balancer.pool.add_monitor_to_pool,
+                fake_pool['id'], monitor_id)
+                for monitor_id in ('monitor1', 'monitor2', 'monitor3')]
+            for add in adds:
+                add.wait()
+        self.assertEqual(['monitor1', 'monitor2', 'monitor3'],
+                         fake_pool['active_monitor_ids'])
+        # the additions queued during the first one are merged
+        self.assertEqual(2, get.call_count)
+        self.assertEqual(2, update.call_count)
+
 
 class TestVirtualServer(nsxlib_testcase.NsxClientTestCase):
 
@@ -469,6 +515,20 @@ class TestService(nsxlib_testcase.NsxClientTestCase):
             get.assert_called_with(
                 'loadbalancer/services/%s' % fake_service['id'])
 
+    def test_get_router_lb_service_indexed(self):
+        fake_service = consts.FAKE_SERVICE.copy()
+        with mock.patch.object(self.nsxlib.client, 'lookup_index',
+                               utils.LookupIndex()), \
+                mock.patch.object(self.nsxlib.client, 'iter_list',
+                                  return_value=[fake_service]) as iter_list:
+            for i in range(2):
+                self.assertEqual(
+                    fake_service,
+                    self.nsxlib.load_balancer.service.get_router_lb_service(
+                        consts.FAKE_ROUTER_UUID))
+            iter_list.assert_called_once_with('loadbalancer/services',
+                                              stream=True)
+
     def test_get_stats(self):
         with mock.patch.object(self.nsxlib.client, 'get') as get:
             fake_service = consts.FAKE_SERVICE.copy()
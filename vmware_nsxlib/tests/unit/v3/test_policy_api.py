@@ -15,6 +15,7 @@
 #
 from vmware_nsxlib.tests.unit.v3 import nsxlib_testcase
 from vmware_nsxlib.v3 import client
+from vmware_nsxlib.v3 import exceptions
 from vmware_nsxlib.v3 import policy_constants
 from vmware_nsxlib.v3 import policy_defs as policy
 
@@ -65,6 +66,15 @@ class TestPolicyDomain(TestPolicyApi):
         self.policy_api.list(domain_def)
         self.assert_json_call('GET', self.client, 'infra/domains')
 
+    def test_update(self):
+        domain_def = policy.DomainDef('archaea')
+        domain_def.update_attributes_in_body(name='prokaryotes')
+        self.policy_api.update(domain_def)
+        # only the attributes set are sent
+        self.assert_json_call('PATCH', self.client,
+                              'infra/domains/archaea',
+                              data={'display_name': 'prokaryotes'})
+
 
 class TestPolicyGroup(TestPolicyApi):
 
@@ -194,6 +204,15 @@ class TestPolicyService(TestPolicyApi):
                               'infra/services/icmpservice',
                               data=expected_data)
 
+    def test_update(self):
+        service_def = policy.ServiceDef('roomservice')
+        service_def.update_attributes_in_body(description='dinner')
+        self.policy_api.update(service_def)
+        # the service entries are left unchanged
+        self.assert_json_call('PATCH', self.client,
+                              'infra/services/roomservice',
+                              data={'description': 'dinner'})
+
 
 class TestPolicyCommunicationProfile(TestPolicyApi):
 
@@ -339,3 +358,84 @@ class TestPolicyDeploymentMap(TestPolicyApi):
         self.assert_json_call('POST', self.client,
                               'infra/domains/d1/domain-deployment-maps/dm1',
                               data=expected_data)
+
+
+class TestPolicyTransaction(TestPolicyApi):
+
+    def test_apply(self):
+        transaction = self.policy_api.new_transaction()
+        transaction.create_or_update(policy.DomainDef('d1', name='tenant'))
+        transaction.create_or_update(policy.GroupDef(
+            'd1', 'g1', name='web',
+            conditions=policy.Condition('web')))
+        transaction.create_or_update(policy.CommunicationMapEntryDef(
+            'd1', 'cm1', sequence_number=1, source_groups=['g1'],
+            profile_id='p1'))
+        transaction.create_or_update(policy.CommunicationProfileDef(
+            'p1', name='web'))
+        transaction.create_or_update(policy.CommunicationProfileEntryDef(
+            'p1', 'pe1', services=['/infra/services/s1']))
+        transaction.create_or_update(policy.ServiceDef('s1', name='http'))
+        self.assertEqual(6, len(transaction))
+        transaction.apply()
+
+        group = policy.GroupDef('d1', 'g1', name='web',
+                                conditions=policy.Condition('web'))
+        entry = policy.CommunicationMapEntryDef(
+            'd1', 'cm1', sequence_number=1, source_groups=['g1'],
+            profile_id='p1').get_obj_dict()
+        profile = policy.CommunicationProfileDef(
+            'p1', name='web').get_obj_dict()
+        # the entries are children rather than inlined
+        del profile['communication_profile_entries']
+        expected_data = {'resource_type': 'Infra', 'children': [
+            {'resource_type': 'ChildDomain', 'Domain': {
+                'id': 'd1', 'display_name': 'tenant', 'description': None,
+                'resource_type': 'Domain', 'children': [
+                    {'resource_type': 'ChildGroup',
+                     'Group': dict(group.get_obj_dict(),
+                                   resource_type='Group')},
+                    {'resource_type': 'ChildCommunicationMap',
+                     'CommunicationMap': {
+                         'resource_type': 'CommunicationMap',
+                         'children': [{
+                             'resource_type': 'ChildCommunicationEntry',
+                             'CommunicationEntry': dict(
+                                 entry,
+                                 resource_type='CommunicationEntry')}]}}]}},
+            {'resource_type': 'ChildCommunicationProfile',
+             'CommunicationProfile': dict(
+                 profile, resource_type='CommunicationProfile', children=[
+                     {'resource_type': 'ChildCommunicationProfileEntry',
+                      'CommunicationProfileEntry': dict(
+                          policy.CommunicationProfileEntryDef(
+                              'p1', 'pe1',
+                              services=['/infra/services/s1']
+                          ).get_obj_dict(),
+                          resource_type='CommunicationProfileEntry')}])},
+            {'resource_type': 'ChildService',
+             'Service': dict(policy.ServiceDef(
+                 's1', name='http').get_obj_dict(),
+                 resource_type='Service')}]}
+        self.assert_json_call('PATCH', self.client, 'infra',
+                              data=expected_data)
+
+    def test_parent_not_in_transaction(self):
+        transaction = self.policy_api.new_transaction()
+        transaction.delete(policy.L4ServiceEntryDef('s1', 'e1'))
+        self.assertEqual(1, len(transaction))
+        self.assertEqual(
+            {'resource_type': 'Infra', 'children': [
+                {'resource_type': 'ChildService', 'Service': {
+                    'id': 's1', 'resource_type': 'Service', 'children': [
+                        {'resource_type': 'ChildServiceEntry',
+                         'ServiceEntry': {
+                             'id': 'e1', 'resource_type': 'ServiceEntry',
+                             'marked_for_delete': True}}]}}]},
+            transaction.get_obj_dict())
+
+    def test_other_tenant(self):
+        transaction = self.policy_api.new_transaction()
+        self.assertRaises(exceptions.InvalidInput,
+                          transaction.create_or_update,
+                          policy.DomainDef('d1', tenant='other'))
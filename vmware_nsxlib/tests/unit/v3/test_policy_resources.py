@@ -19,6 +19,7 @@ import mock
 
 from vmware_nsxlib.tests.unit.v3 import nsxlib_testcase
 from vmware_nsxlib import v3
+from vmware_nsxlib.v3 import exceptions
 from vmware_nsxlib.v3 import policy_constants
 from vmware_nsxlib.v3 import policy_defs
 
@@ -70,6 +71,13 @@ class NsxPolicyLibTestCase(unittest.TestCase):
         actual_dict = mock_api.call_args_list[call_num][0][0].body
         self.assertEqual(expected_dict, actual_dict)
 
+    def assert_applied_with_dict(self, mock_api, expected_dict,
+                                 call_num=0):
+        # verify the api was called with a transaction of that body
+        mock_api.assert_called()
+        transaction = mock_api.call_args_list[call_num][0][0]
+        self.assertEqual(expected_dict, transaction.get_obj_dict())
+
 
 class TestPolicyDomain(NsxPolicyLibTestCase):
 
@@ -143,7 +151,7 @@ class TestPolicyDomain(NsxPolicyLibTestCase):
         name = 'new name'
         description = 'new desc'
         with mock.patch.object(self.policy_api,
-                               "create_or_update") as update_call:
+                               "update") as update_call:
             self.resourceApi.update(id,
                                     name=name,
                                     description=description,
@@ -274,7 +282,7 @@ class TestPolicyGroup(NsxPolicyLibTestCase):
         name = 'new name'
         description = 'new desc'
         with mock.patch.object(self.policy_api,
-                               "create_or_update") as update_call:
+                               "update") as update_call:
             self.resourceApi.update(domain_id, id,
                                     name=name,
                                     description=description,
@@ -291,10 +299,8 @@ class TestPolicyGroup(NsxPolicyLibTestCase):
         domain_id = '111'
         id = '222'
         cond_val = '123'
-        with mock.patch.object(self.policy_api, "get",
-                               return_value={}) as get_call,\
-            mock.patch.object(self.policy_api,
-                              "create_or_update") as update_call:
+        with mock.patch.object(self.policy_api, "get") as get_call, \
+            mock.patch.object(self.policy_api, "update") as update_call:
             self.resourceApi.update_condition(domain_id, id,
                                               cond_val=cond_val,
                                               tenant=TEST_TENANT)
@@ -307,22 +313,16 @@ class TestPolicyGroup(NsxPolicyLibTestCase):
                         'value': cond_val,
                         'operator': policy_constants.CONDITION_OP_EQUALS}
             expected_dict = {'expression': [exp_cond]}
-            self.assert_called_with_def(get_call, expected_def)
+            # the conditions are replaced without reading the group
+            get_call.assert_not_called()
             self.assert_called_with_def_and_dict(
                 update_call, expected_def, expected_dict)
 
     def test_remove_condition(self):
         domain_id = '111'
         id = '222'
-        old_cond = {'resource_type': 'Condition',
-                    'member_type': policy_constants.CONDITION_MEMBER_PORT,
-                    'key': policy_constants.CONDITION_KEY_TAG,
-                    'value': 'abc',
-                    'operator': policy_constants.CONDITION_OP_EQUALS}
-        with mock.patch.object(self.policy_api, "get",
-                               return_value={'expression': [old_cond]}) as get_call,\
-            mock.patch.object(self.policy_api,
-                              "create_or_update") as update_call:
+        with mock.patch.object(self.policy_api, "get") as get_call, \
+            mock.patch.object(self.policy_api, "update") as update_call:
             self.resourceApi.update_condition(domain_id, id,
                                               cond_val=None,
                                               tenant=TEST_TENANT)
@@ -330,7 +330,8 @@ class TestPolicyGroup(NsxPolicyLibTestCase):
                                                 group_id=id,
                                                 tenant=TEST_TENANT)
             expected_dict = {'expression': []}
-            self.assert_called_with_def(get_call, expected_def)
+            # the conditions are replaced without reading the group
+            get_call.assert_not_called()
             self.assert_called_with_def_and_dict(
                 update_call, expected_def, expected_dict)
 
@@ -423,32 +424,38 @@ class TestPolicyService(NsxPolicyLibTestCase):
         with mock.patch.object(self.policy_api, "get",
                                return_value={}) as get_call,\
             mock.patch.object(self.policy_api,
-                              "create_or_update") as update_call:
+                              "apply_transaction") as update_call:
             self.resourceApi.update(id,
                                     name=name,
                                     description=description,
                                     tenant=TEST_TENANT)
             expected_def = policy_defs.ServiceDef(service_id=id,
                                                   tenant=TEST_TENANT)
-            expected_dict = {'display_name': name,
-                             'description': description,
-                             'service_entries': []}
             self.assert_called_with_def(get_call, expected_def)
-            self.assert_called_with_def_and_dict(
-                update_call, expected_def, expected_dict)
+            # only the service is updated, as it has no entry
+            expected_dict = {
+                'resource_type': 'Infra',
+                'children': [{
+                    'resource_type': 'ChildService',
+                    'Service': {'resource_type': 'Service',
+                                'id': id,
+                                'display_name': name,
+                                'description': description}}]}
+            self.assert_applied_with_dict(update_call, expected_dict)
 
     def test_update_entry(self):
         id = '111'
         protocol = 'udp'
         dest_ports = [555]
         service_entry_id = '222'
-        service_entry = {'id': service_entry_id}
+        service_entry = {'id': service_entry_id,
+                         'resource_type': 'L4PortSetServiceEntry'}
 
         with mock.patch.object(
             self.policy_api, "get",
             return_value={'service_entries': [service_entry]}) as get_call,\
             mock.patch.object(self.policy_api,
-                              "create_or_update") as update_call:
+                              "apply_transaction") as update_call:
             self.resourceApi.update(id,
                                     protocol=protocol,
                                     dest_ports=dest_ports,
@@ -458,16 +465,22 @@ class TestPolicyService(NsxPolicyLibTestCase):
                                                   tenant=TEST_TENANT)
             self.assert_called_with_def(get_call, expected_def)
 
-            # update will be called for the service entry only
-            expected_entry_def = policy_defs.L4ServiceEntryDef(
-                service_id=id,
-                service_entry_id=service_entry_id,
-                tenant=TEST_TENANT)
-            expected_entry_dict = {'id': service_entry_id,
+            # the service and its entry are updated with a single call
+            expected_entry_dict = {'resource_type': 'L4PortSetServiceEntry',
+                                   'id': service_entry_id,
                                    'l4_protocol': protocol.upper(),
                                    'destination_ports': dest_ports}
-            self.assert_called_with_def_and_dict(
-                update_call, expected_entry_def, expected_entry_dict)
+            expected_dict = {
+                'resource_type': 'Infra',
+                'children': [{
+                    'resource_type': 'ChildService',
+                    'Service': {
+                        'resource_type': 'Service',
+                        'id': id,
+                        'children': [{
+                            'resource_type': 'ChildServiceEntry',
+                            'ServiceEntry': expected_entry_dict}]}}]}
+            self.assert_applied_with_dict(update_call, expected_dict)
 
     def test_update_all(self):
         id = '111'
@@ -476,15 +489,14 @@ class TestPolicyService(NsxPolicyLibTestCase):
         protocol = 'udp'
         dest_ports = [555]
         service_entry_id = '222'
-        service_entry = {'id': service_entry_id}
+        service_entry = {'id': service_entry_id,
+                         'resource_type': 'L4PortSetServiceEntry'}
 
         with mock.patch.object(
             self.policy_api, "get",
             return_value={'service_entries': [service_entry]}) as get_call,\
             mock.patch.object(self.policy_api,
-                              "create_or_update") as update_call,\
-            mock.patch.object(self.policy_api, "list",
-                              return_value={'results': []}):
+                              "apply_transaction") as update_call:
             self.resourceApi.update(id,
                                     name=name,
                                     description=description,
@@ -496,25 +508,47 @@ class TestPolicyService(NsxPolicyLibTestCase):
                                                   tenant=TEST_TENANT)
             self.assert_called_with_def(get_call, expected_def)
 
-            # update will be called for the service and entry (2 calls)
-            expected_dict = {'display_name': name,
-                             'description': description,
-                             'service_entries': []}
-            self.assert_called_with_def_and_dict(
-                update_call, expected_def, expected_dict)
-
-            expected_entry_def = policy_defs.L4ServiceEntryDef(
-                service_id=id,
-                service_entry_id=service_entry_id,
-                tenant=TEST_TENANT)
-            expected_entry_dict = {'id': service_entry_id,
+            # the service and its entry are updated with a single call
+            expected_entry_dict = {'resource_type': 'L4PortSetServiceEntry',
+                                   'id': service_entry_id,
                                    'display_name': name,
                                    'description': description,
                                    'l4_protocol': protocol.upper(),
                                    'destination_ports': dest_ports}
-            self.assert_called_with_def_and_dict(
-                update_call, expected_entry_def, expected_entry_dict,
-                call_num=1)
+            expected_dict = {
+                'resource_type': 'Infra',
+                'children': [{
+                    'resource_type': 'ChildService',
+                    'Service': {
+                        'resource_type': 'Service',
+                        'id': id,
+                        'display_name': name,
+                        'description': description,
+                        'children': [{
+                            'resource_type': 'ChildServiceEntry',
+                            'ServiceEntry': expected_entry_dict}]}}]}
+            self.assert_applied_with_dict(update_call, expected_dict)
+
+    def test_update_returns_current_data(self):
+        id = '111'
+        service = {'id': id, 'display_name': 'name', 'service_entries': [
+            {'id': '222', 'resource_type': 'L4PortSetServiceEntry',
+             'destination_ports': [80]}]}
+        with mock.patch.object(self.policy_api, "get",
+                               return_value=service) as get_call, \
+            mock.patch.object(self.policy_api,
+                              "apply_transaction") as update_call:
+            result = self.resourceApi.update(id, name='new name',
+                                             dest_ports=[555],
+                                             tenant=TEST_TENANT)
+        # a GET for the id of the entry and the PATCH, no other call
+        self.assertEqual(1, get_call.call_count)
+        self.assertEqual(1, update_call.call_count)
+        self.assertEqual(
+            {'id': id, 'display_name': 'new name', 'service_entries': [
+                {'id': '222', 'resource_type': 'L4PortSetServiceEntry',
+                 'display_name': 'new name', 'destination_ports': [555]}]},
+            result)
 
 
 class TestPolicyIcmpService(NsxPolicyLibTestCase):
@@ -587,31 +621,37 @@ class TestPolicyIcmpService(NsxPolicyLibTestCase):
         with mock.patch.object(self.policy_api, "get",
                                return_value={}) as get_call,\
             mock.patch.object(self.policy_api,
-                              "create_or_update") as update_call:
+                              "apply_transaction") as update_call:
             self.resourceApi.update(id,
                                     name=name,
                                     description=description,
                                     tenant=TEST_TENANT)
             expected_def = policy_defs.ServiceDef(service_id=id,
                                                   tenant=TEST_TENANT)
-            expected_dict = {'display_name': name,
-                             'description': description,
-                             'service_entries': []}
             self.assert_called_with_def(get_call, expected_def)
-            self.assert_called_with_def_and_dict(
-                update_call, expected_def, expected_dict)
+            # only the service is updated, as it has no entry
+            expected_dict = {
+                'resource_type': 'Infra',
+                'children': [{
+                    'resource_type': 'ChildService',
+                    'Service': {'resource_type': 'Service',
+                                'id': id,
+                                'display_name': name,
+                                'description': description}}]}
+            self.assert_applied_with_dict(update_call, expected_dict)
 
     def test_update_entry(self):
         id = '111'
         icmp_code = 12
         service_entry_id = '222'
-        service_entry = {'id': service_entry_id}
+        service_entry = {'id': service_entry_id,
+                         'resource_type': 'ICMPTypeServiceEntry'}
 
         with mock.patch.object(
             self.policy_api, "get",
             return_value={'service_entries': [service_entry]}) as get_call,\
             mock.patch.object(self.policy_api,
-                              "create_or_update") as update_call:
+                              "apply_transaction") as update_call:
             self.resourceApi.update(id,
                                     icmp_code=icmp_code,
                                     tenant=TEST_TENANT)
@@ -620,15 +660,21 @@ class TestPolicyIcmpService(NsxPolicyLibTestCase):
                                                   tenant=TEST_TENANT)
             self.assert_called_with_def(get_call, expected_def)
 
-            # update will be called for the service entry only
-            expected_entry_def = policy_defs.IcmpServiceEntryDef(
-                service_id=id,
-                service_entry_id=service_entry_id,
-                tenant=TEST_TENANT)
-            expected_entry_dict = {'id': service_entry_id,
+            # the service and its entry are updated with a single call
+            expected_entry_dict = {'resource_type': 'ICMPTypeServiceEntry',
+                                   'id': service_entry_id,
                                    'icmp_code': icmp_code}
-            self.assert_called_with_def_and_dict(
-                update_call, expected_entry_def, expected_entry_dict)
+            expected_dict = {
+                'resource_type': 'Infra',
+                'children': [{
+                    'resource_type': 'ChildService',
+                    'Service': {
+                        'resource_type': 'Service',
+                        'id': id,
+                        'children': [{
+                            'resource_type': 'ChildServiceEntry',
+                            'ServiceEntry': expected_entry_dict}]}}]}
+            self.assert_applied_with_dict(update_call, expected_dict)
 
     def test_update_all(self):
         id = '111'
@@ -638,15 +684,14 @@ class TestPolicyIcmpService(NsxPolicyLibTestCase):
         icmp_type = 3
         icmp_code = 3
         service_entry_id = '222'
-        service_entry = {'id': service_entry_id}
+        service_entry = {'id': service_entry_id,
+                         'resource_type': 'ICMPTypeServiceEntry'}
 
         with mock.patch.object(
             self.policy_api, "get",
             return_value={'service_entries': [service_entry]}) as get_call,\
             mock.patch.object(self.policy_api,
-                              "create_or_update") as update_call,\
-            mock.patch.object(self.policy_api, "list",
-                              return_value={'results': []}):
+                              "apply_transaction") as update_call:
             self.resourceApi.update(id,
                                     name=name,
                                     description=description,
@@ -659,26 +704,27 @@ class TestPolicyIcmpService(NsxPolicyLibTestCase):
                                                   tenant=TEST_TENANT)
             self.assert_called_with_def(get_call, expected_def)
 
-            # update will be called for the service and entry (2 calls)
-            expected_dict = {'display_name': name,
-                             'description': description,
-                             'service_entries': []}
-            self.assert_called_with_def_and_dict(
-                update_call, expected_def, expected_dict)
-
-            expected_entry_def = policy_defs.IcmpServiceEntryDef(
-                service_id=id,
-                service_entry_id=service_entry_id,
-                tenant=TEST_TENANT)
-            expected_entry_dict = {'id': service_entry_id,
+            # the service and its entry are updated with a single call
+            expected_entry_dict = {'resource_type': 'ICMPTypeServiceEntry',
+                                   'id': service_entry_id,
                                    'display_name': name,
                                    'description': description,
                                    'protocol': 'ICMPv6',
                                    'icmp_type': icmp_type,
                                    'icmp_code': icmp_code}
-            self.assert_called_with_def_and_dict(
-                update_call, expected_entry_def, expected_entry_dict,
-                call_num=1)
+            expected_dict = {
+                'resource_type': 'Infra',
+                'children': [{
+                    'resource_type': 'ChildService',
+                    'Service': {
+                        'resource_type': 'Service',
+                        'id': id,
+                        'display_name': name,
+                        'description': description,
+                        'children': [{
+                            'resource_type': 'ChildServiceEntry',
+                            'ServiceEntry': expected_entry_dict}]}}]}
+            self.assert_applied_with_dict(update_call, expected_dict)
 
 
 class TestPolicyCommunicationProfile(NsxPolicyLibTestCase):
@@ -756,19 +802,25 @@ class TestPolicyCommunicationProfile(NsxPolicyLibTestCase):
         with mock.patch.object(self.policy_api, "get",
                                return_value={}) as get_call,\
             mock.patch.object(self.policy_api,
-                              "create_or_update") as update_call:
+                              "apply_transaction") as update_call:
             self.resourceApi.update(id,
                                     name=name,
                                     description=description,
                                     tenant=TEST_TENANT)
             expected_def = policy_defs.CommunicationProfileDef(
                 profile_id=id, tenant=TEST_TENANT)
-            expected_dict = {'display_name': name,
-                             'description': description,
-                             'communication_profile_entries': []}
             self.assert_called_with_def(get_call, expected_def)
-            self.assert_called_with_def_and_dict(
-                update_call, expected_def, expected_dict)
+            # only the profile is updated, as it has no entry
+            expected_dict = {
+                'resource_type': 'Infra',
+                'children': [{
+                    'resource_type': 'ChildCommunicationProfile',
+                    'CommunicationProfile': {
+                        'resource_type': 'CommunicationProfile',
+                        'id': id,
+                        'display_name': name,
+                        'description': description}}]}
+            self.assert_applied_with_dict(update_call, expected_dict)
 
     def test_update_entry(self):
         id = '111'
@@ -781,26 +833,35 @@ class TestPolicyCommunicationProfile(NsxPolicyLibTestCase):
         with mock.patch.object(
             self.policy_api, "get", return_value=entries_dict) as get_call,\
             mock.patch.object(self.policy_api,
-                              "create_or_update") as update_call:
+                              "apply_transaction") as update_call:
             self.resourceApi.update(id,
                                     services=[service_id],
                                     action=action,
                                     tenant=TEST_TENANT)
-            # get will be called for the entire service
+            # get will be called for the entire profile
             expected_def = policy_defs.CommunicationProfileDef(
                 profile_id=id, tenant=TEST_TENANT)
             self.assert_called_with_def(get_call, expected_def)
 
-            # update will be called for the service entry only
-            expected_entry_def = policy_defs.CommunicationProfileEntryDef(
-                profile_id=id,
-                profile_entry_id=entry_id,
-                tenant=TEST_TENANT)
-            expected_entry_dict = {'id': entry_id,
-                                   'action': action.upper(),
-                                   'services': [service_id]}
-            self.assert_called_with_def_and_dict(
-                update_call, expected_entry_def, expected_entry_dict)
+            # only the profile entry is updated
+            expected_entry_dict = {
+                'resource_type': 'CommunicationProfileEntry',
+                'id': entry_id,
+                'action': action.upper(),
+                'services': [service_id]}
+            expected_dict = {
+                'resource_type': 'Infra',
+                'children': [{
+                    'resource_type': 'ChildCommunicationProfile',
+                    'CommunicationProfile': {
+                        'resource_type': 'CommunicationProfile',
+                        'id': id,
+                        'children': [{
+                            'resource_type':
+                                'ChildCommunicationProfileEntry',
+                            'CommunicationProfileEntry':
+                                expected_entry_dict}]}}]}
+            self.assert_applied_with_dict(update_call, expected_dict)
 
     def test_update_all(self):
         id = '111'
@@ -815,37 +876,61 @@ class TestPolicyCommunicationProfile(NsxPolicyLibTestCase):
         with mock.patch.object(
             self.policy_api, "get", return_value=entries_dict) as get_call,\
             mock.patch.object(self.policy_api,
-                              "create_or_update") as update_call:
+                              "apply_transaction") as update_call:
             self.resourceApi.update(id,
                                     name=name,
                                     description=description,
                                     services=[service_id],
                                     action=action,
                                     tenant=TEST_TENANT)
-            # get will be called for the entire service
+            # get will be called for the entire profile
             expected_def = policy_defs.CommunicationProfileDef(
                 profile_id=id, tenant=TEST_TENANT)
             self.assert_called_with_def(get_call, expected_def)
 
-            # update will be called for the service and entry (2 calls)
-            expected_dict = {'display_name': name,
-                             'description': description,
-                             'communication_profile_entries': []}
-            self.assert_called_with_def_and_dict(
-                update_call, expected_def, expected_dict)
-
-            expected_entry_def = policy_defs.CommunicationProfileEntryDef(
-                profile_id=id,
-                profile_entry_id=entry_id,
-                tenant=TEST_TENANT)
-            expected_entry_dict = {'id': entry_id,
-                                   'display_name': name,
-                                   'description': description,
-                                   'action': action.upper(),
-                                   'services': [service_id]}
-            self.assert_called_with_def_and_dict(
-                update_call, expected_entry_def, expected_entry_dict,
-                call_num=1)
+            # the profile and its entry are updated with a single call
+            expected_entry_dict = {
+                'resource_type': 'CommunicationProfileEntry',
+                'id': entry_id,
+                'display_name': name,
+                'description': description,
+                'action': action.upper(),
+                'services': [service_id]}
+            expected_dict = {
+                'resource_type': 'Infra',
+                'children': [{
+                    'resource_type': 'ChildCommunicationProfile',
+                    'CommunicationProfile': {
+                        'resource_type': 'CommunicationProfile',
+                        'id': id,
+                        'display_name': name,
+                        'description': description,
+                        'children': [{
+                            'resource_type':
+                                'ChildCommunicationProfileEntry',
+                            'CommunicationProfileEntry':
+                                expected_entry_dict}]}}]}
+            self.assert_applied_with_dict(update_call, expected_dict)
+
+    def test_update_returns_current_data(self):
+        id = '111'
+        profile = {'id': id, 'display_name': 'name',
+                   'communication_profile_entries': [
+                       {'id': '222', 'action': 'ALLOW'}]}
+        with mock.patch.object(self.policy_api, "get",
+                               return_value=profile) as get_call, \
+            mock.patch.object(self.policy_api,
+                              "apply_transaction") as update_call:
+            result = self.resourceApi.update(id, action='DENY',
+                                             tenant=TEST_TENANT)
+        # a GET for the id of the entry and the PATCH, no other call
+        self.assertEqual(1, get_call.call_count)
+        self.assertEqual(1, update_call.call_count)
+        self.assertEqual(
+            {'id': id, 'display_name': 'name',
+             'communication_profile_entries': [
+                 {'id': '222', 'action': 'DENY'}]},
+            result)
 
 
 class TestPolicyCommunicationMap(NsxPolicyLibTestCase):
@@ -1006,10 +1091,8 @@ class TestPolicyCommunicationMap(NsxPolicyLibTestCase):
         source_group = 'ng1'
         dest_group = 'ng2'
         profile_id = 'nc1'
-        with mock.patch.object(self.policy_api, "get",
-                               return_value={}) as get_call,\
-            mock.patch.object(self.policy_api,
-                              "create_or_update") as update_call:
+        with mock.patch.object(self.policy_api, "get") as get_call, \
+            mock.patch.object(self.policy_api, "update") as update_call:
             self.resourceApi.update(domain_id, id,
                                     name=name,
                                     description=description,
@@ -1032,10 +1115,41 @@ class TestPolicyCommunicationMap(NsxPolicyLibTestCase):
                              'communication_profile_path': profile_path,
                              'source_groups': [sgroup_path],
                              'destination_groups': [dgroup_path]}
-            self.assert_called_with_def(get_call, expected_def)
+            get_call.assert_not_called()
             self.assert_called_with_def_and_dict(
                 update_call, expected_def, expected_dict)
 
+    def test_update_missing(self):
+        domain_id = '111'
+        id = '222'
+        name = 'new name'
+        # the PATCH of a missing entry fails without its required attributes
+        with mock.patch.object(self.policy_api, "update",
+                               side_effect=exceptions.ManagerError), \
+            mock.patch.object(self.policy_api, "get",
+                              side_effect=exceptions.ResourceNotFound), \
+            mock.patch.object(self.resourceApi,
+                              "create_or_overwrite") as create_call:
+            self.resourceApi.update(domain_id, id, name=name,
+                                    tenant=TEST_TENANT)
+            create_call.assert_called_once_with(
+                name, domain_id, id, None, None, None, None, None,
+                TEST_TENANT)
+
+    def test_update_invalid(self):
+        domain_id = '111'
+        id = '222'
+        with mock.patch.object(self.policy_api, "update",
+                               side_effect=exceptions.ManagerError), \
+            mock.patch.object(self.policy_api, "get",
+                              return_value={'id': id}), \
+            mock.patch.object(self.resourceApi,
+                              "create_or_overwrite") as create_call:
+            self.assertRaises(exceptions.ManagerError,
+                              self.resourceApi.update, domain_id, id,
+                              sequence_number=-1, tenant=TEST_TENANT)
+            create_call.assert_not_called()
+
     def test_get_realized(self):
         domain_id = 'd1'
         ep_id = 'ef1'
@@ -1120,7 +1234,7 @@ class TestPolicyEnforcementPoint(NsxPolicyLibTestCase):
         username = 'admin'
         password = 'zzz'
         with mock.patch.object(self.policy_api,
-                               "create_or_update") as update_call:
+                               "update") as update_call:
             self.resourceApi.update(id,
                                     name=name,
                                     username=username,
@@ -1223,7 +1337,7 @@ class TestPolicyDeploymentMap(NsxPolicyLibTestCase):
         domain_id = 'domain2'
         ep_id = 'ep2'
         with mock.patch.object(self.policy_api,
-                               "create_or_update") as update_call:
+                               "update") as update_call:
             self.resourceApi.update(id,
                                     name=name,
                                     ep_id=ep_id,
@@ -14,6 +14,7 @@
 #    under the License.
 #
 import copy
+import re
 
 import mock
 
@@ -223,6 +224,20 @@ class TestSwitchingProfileTestCase(nsxlib_testcase.NsxClientTestCase):
         self.assertEqual(resp_resources['results'],
                          mocked_resource.find_by_display_name('resource-1'))
 
+    def test_find_system_owned_by_display_name(self):
+        session_response = mocks.MockRequestsResponse(200, jsonutils.dumps(
+            {'results': [{'display_name': 'nsx-default-qos-profile',
+                          '_system_owned': True}]}))
+        mocked_resource = self._mocked_switching_profile(
+            session_response=session_response)
+        self.assertEqual(1, len(mocked_resource.find_by_display_name(
+            'nsx-default-qos-profile')))
+        test_client.assert_json_call(
+            'get', mocked_resource,
+            'https://1.2.3.4/api/v1/switching-profiles/'
+            '?include_system_owned=True',
+            data=None)
+
     def test_list_all_profiles(self):
         mocked_resource = self._mocked_switching_profile()
         mocked_resource.list()
@@ -1031,6 +1046,43 @@ class TestNsxSearch(nsxlib_testcase.NsxClientTestCase):
                 mock.call('search?query=%s&cursor=2' % query)])
             self.assertEqual(3, len(results))
 
+    def test_nsx_search_all_by_tags_parallel(self):
+        """Test search all fetching the pages after the first in parallel."""
+        user_tags = [{'scope': 'user', 'tag': 'k8s'}]
+        query = self.nsxlib._build_query(tags=user_tags)
+        first_url = 'search?query=%s' % query
+
+        def _search(url):
+            if url == first_url:
+                return {'cursor': '2', 'result_count': 7,
+                        'results': [{'id': 's0'}, {'id': 's1'}]}
+            offset = int(url.split('cursor=')[1].split('&')[0])
+            return {'cursor': str(offset + 2), 'result_count': 7,
+                    'results': [{'id': 's%d' % i} for i in
+                                range(offset, min(offset + 2, 7))]}
+
+        with mock.patch.object(self.nsxlib.client, 'url_get',
+                               side_effect=_search) as search:
+            results = self.nsxlib.search_all_by_tags(tags=user_tags,
+                                                     concurrency=2)
+            search.assert_has_calls([
+                mock.call(first_url),
+                mock.call('%s&cursor=2&page_size=2' % first_url),
+                mock.call('%s&cursor=4&page_size=2' % first_url),
+                mock.call('%s&cursor=6&page_size=2' % first_url)],
+                any_order=True)
+        self.assertEqual(['s%d' % i for i in range(7)],
+                         [r['id'] for r in results])
+
+    def test_nsx_search_all_by_tags_parallel_no_results(self):
+        with mock.patch.object(self.nsxlib.client, 'url_get',
+                               return_value={'result_count': 0,
+                                             'results': []}) as search:
+            results = self.nsxlib.search_all_by_tags(
+                tags=[{'scope': 'user', 'tag': 'k8s'}], concurrency=4)
+            self.assertEqual(1, search.call_count)
+        self.assertEqual([], results)
+
     def test_get_id_by_resource_and_tag(self):
         id = 'test'
         scope = 'user'
@@ -1065,6 +1117,69 @@ class TestNsxSearch(nsxlib_testcase.NsxClientTestCase):
                               self.nsxlib.get_id_by_resource_and_tag,
                               res_type, scope, tag, alert_multiple=True)
 
+    def _port(self, port_id, *tags):
+        return {'id': port_id,
+                'tags': [{'scope': 'os-neutron-port-id', 'tag': tag}
+                         for tag in tags]}
+
+    def test_get_ids_by_resources_and_tags(self):
+        ports = [self._port('p1', 'n1'), self._port('p2', 'n2'),
+                 self._port('p3', 'n3'), self._port('p4', 'n3')]
+        keys = [('LogicalPort', 'os-neutron-port-id', 'n%d' % i)
+                for i in range(1, 5)]
+        with mock.patch.object(self.nsxlib.client, 'url_get',
+                               return_value={'result_count': 4,
+                                             'results': ports}) as search:
+            ids = self.nsxlib.get_ids_by_resources_and_tags(keys)
+            # a single query with an OR group of the tags
+            search.assert_called_once_with(
+                'search?query=resource_type:LogicalPort AND '
+                'tags.scope:os\\-neutron\\-port\\-id AND '
+                '(tags.tag:n1 OR tags.tag:n2 OR tags.tag:n3 OR tags.tag:n4)')
+        # not found and multiple results as get_id_by_resource_and_tag
+        self.assertEqual(dict(zip(keys, ['p1', 'p2', None, None])), ids)
+
+    def test_get_ids_by_resources_and_tags_alerts(self):
+        key = ('LogicalPort', 'os-neutron-port-id', 'n1')
+        with mock.patch.object(self.nsxlib.client, 'url_get',
+                               return_value={'result_count': 0,
+                                             'results': []}):
+            self.assertRaises(exceptions.ResourceNotFound,
+                              self.nsxlib.get_ids_by_resources_and_tags,
+                              [key], alert_not_found=True)
+        with mock.patch.object(self.nsxlib.client, 'url_get',
+                               return_value={'result_count': 2,
+                                             'results': [
+                                                 self._port('p1', 'n1'),
+                                                 self._port('p2', 'n1')]}):
+            self.assertRaises(exceptions.ManagerError,
+                              self.nsxlib.get_ids_by_resources_and_tags,
+                              [key], alert_multiple=True)
+
+    def test_get_ids_by_resources_and_tags_split(self):
+        keys = [('LogicalPort', 'os-neutron-port-id', 'n%d' % i)
+                for i in range(20)] + [('NSGroup', 'os-neutron-secgr-id',
+                                        's1')]
+
+        def _search(url):
+            tags = re.findall(r'tags\.tag:(\w+)', url)
+            return {'result_count': len(tags), 'cursor': str(len(tags)),
+                    'results': [self._port(tag.replace('n', 'p'), tag)
+                                for tag in tags if tag.startswith('n')]}
+
+        with mock.patch.object(self.nsxlib.client, 'url_get',
+                               side_effect=_search) as search:
+            ids = self.nsxlib.get_ids_by_resources_and_tags(
+                keys, concurrency=4, max_query_len=300)
+        urls = [call[0][0] for call in search.call_args_list]
+        self.assertTrue(all(len(url) <= 300 for url in urls))
+        # the ports are split in several queries, the groups are searched
+        # with another one
+        self.assertGreater(len(urls), 2)
+        self.assertEqual(1, len([url for url in urls if 'NSGroup' in url]))
+        self.assertEqual(['p%d' % i for i in range(20)] + [None],
+                         [ids[key] for key in keys])
+
 
 class TransportZone(nsxlib_testcase.NsxClientTestCase):
 
@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import eventlet
 import mock
 import six
 
@@ -20,7 +21,9 @@ from oslo_utils import uuidutils
 
 from vmware_nsxlib.tests.unit.v3 import nsxlib_testcase
 from vmware_nsxlib.tests.unit.v3 import test_constants
+from vmware_nsxlib.v3 import exceptions as nsxlib_exc
 from vmware_nsxlib.v3 import nsx_constants as const
+from vmware_nsxlib.v3 import write_executor
 
 
 class TestNsxLibFirewallSection(nsxlib_testcase.NsxLibTestCase):
@@ -174,3 +177,28 @@ class TestNsxLibNSGroup(nsxlib_testcase.NsxClientTestCase):
         expected_exp = {'resource_type': const.NSGROUP_COMPLEX_EXP,
                         'expressions': port_exp}
         self.assertEqual(expected_exp, complex_exp)
+
+    def test_merged_add_members_fail_apart(self):
+        ns_group = self.nsxlib.ns_group
+
+        def _create(url, body):
+            eventlet.sleep(0.01)
+            if any(member['value'] == 'bad' for member in body['members']):
+                raise nsxlib_exc.ManagerError(details='invalid member')
+            return body
+
+        with mock.patch.object(ns_group.client, 'write_queue',
+                               write_executor.WriteMergeQueue()), \
+                mock.patch.object(ns_group.client, 'create',
+                                  side_effect=_create) as create:
+            writers = [eventlet.spawn(ns_group.add_members, 'nsgroup1',
+                                      const.TARGET_TYPE_LOGICAL_PORT,
+                                      [target_id])
+                       for target_id in ('port1', 'port2', 'bad')]
+            self.assertEqual(['port1'], [
+                member['value'] for member in writers[0].wait()['members']])
+            # the members added with the invalid one are added apart
+            self.assertEqual(['port2'], [
+                member['value'] for member in writers[1].wait()['members']])
+            self.assertRaises(nsxlib_exc.NSGroupIsFull, writers[2].wait)
+        self.assertEqual(4, create.call_count)
@@ -13,9 +13,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import unittest
+
+import mock
 from neutron_lib import exceptions as n_exc
 
 from vmware_nsxlib.tests.unit.v3 import nsxlib_testcase
+from vmware_nsxlib.v3 import exceptions as nsxlib_exc
 from vmware_nsxlib.v3 import nsx_constants
 from vmware_nsxlib.v3 import utils
 
@@ -259,3 +263,53 @@ class NsxFeaturesTestCase(nsxlib_testcase.NsxLibTestCase):
             nsx_constants.FEATURE_EXCLUDE_PORT_BY_TAG))
         self.assertTrue(self.nsxlib.feature_supported(
             nsx_constants.FEATURE_MAC_LEARNING))
+
+
+class RetryBudgetTestCase(unittest.TestCase):
+
+    def test_budget_exhausted(self):
+        budget = utils.RetryBudget(ratio=0.5, min_retries_per_second=0,
+                                   max_tokens=2)
+        self.assertTrue(budget.acquire())
+        self.assertTrue(budget.acquire())
+        self.assertFalse(budget.acquire())
+        self.assertTrue(budget.exhausted)
+
+        # every request earns a ratio of a retry
+        budget.deposit()
+        budget.deposit()
+        self.assertTrue(budget.acquire())
+        self.assertEqual({'requests': 2, 'retries': 3, 'retries_denied': 1,
+                          'tokens': 0}, budget.as_dict())
+
+    def test_budget_bounded(self):
+        budget = utils.RetryBudget(ratio=1, min_retries_per_second=0,
+                                   max_tokens=2)
+        for i in range(10):
+            budget.deposit()
+        self.assertEqual(2, budget.tokens)
+
+    def test_retry_upon_exception_within_budget(self):
+        budget = utils.RetryBudget(ratio=0, min_retries_per_second=0,
+                                   max_tokens=2)
+        do_update = mock.Mock(side_effect=nsxlib_exc.StaleRevision)
+        retried = utils.retry_upon_exception(
+            nsxlib_exc.StaleRevision, delay=0, max_attempts=10,
+            budget=budget)(do_update)
+
+        self.assertRaises(nsxlib_exc.StaleRevision, retried)
+        self.assertEqual(3, do_update.call_count)
+        self.assertEqual(1, budget.retries_denied)
+
+    def test_last_attempt_spends_no_budget(self):
+        budget = utils.RetryBudget(ratio=0, min_retries_per_second=0,
+                                   max_tokens=5)
+        do_update = mock.Mock(side_effect=nsxlib_exc.StaleRevision)
+        retried = utils.retry_upon_exception(
+            nsxlib_exc.StaleRevision, delay=0, max_attempts=3,
+            budget=budget)(do_update)
+
+        self.assertRaises(nsxlib_exc.StaleRevision, retried)
+        self.assertEqual(3, do_update.call_count)
+        self.assertEqual(2, budget.retries)
+        self.assertEqual(3, budget.tokens)
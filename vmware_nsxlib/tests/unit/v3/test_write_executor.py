@@ -0,0 +1,240 @@
+# Copyright 2017 VMware, Inc.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+import unittest
+
+import eventlet
+import mock
+
+from vmware_nsxlib.tests.unit.v3 import nsxlib_testcase
+from vmware_nsxlib.v3 import exceptions
+from vmware_nsxlib.v3 import policy_resources
+from vmware_nsxlib.v3 import security
+from vmware_nsxlib.v3 import write_executor
+
+# nsxlib_testcase mocks add_rules for the tests run after its first test case
+_ADD_RULES = security.NsxLibFirewallSection.add_rules
+
+
+class WriteExecutorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(WriteExecutorTestCase, self).setUp()
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+
+    def _write(self, name, delay=0.01):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        eventlet.sleep(delay)
+        self.running -= 1
+        self.calls.append(name)
+        return name
+
+    def test_ordered_per_key(self):
+        executor = write_executor.WriteExecutor()
+        futures = [executor.submit('sections/1', self._write, 'a', 0.03),
+                   executor.submit('sections/2', self._write, 'b', 0.01),
+                   executor.submit('sections/1', self._write, 'c', 0.01)]
+        self.assertEqual(['a', 'b', 'c'], [f.result() for f in futures])
+        # the second section did not wait for the first one
+        self.assertEqual(['b', 'a', 'c'], self.calls)
+        self.assertEqual(2, self.max_running)
+        self.assertEqual({'submitted': 3, 'completed': 3, 'failed': 0,
+                          'pending': 0, 'keys': 0}, executor.as_dict())
+
+    def test_max_workers(self):
+        executor = write_executor.WriteExecutor(max_workers=2)
+        for i in range(5):
+            executor.submit('ports/%d' % i, self._write, i)
+        self.assertTrue(executor.flush())
+        self.assertEqual(2, self.max_running)
+        self.assertEqual(5, len(self.calls))
+
+    def test_failed_write(self):
+        executor = write_executor.WriteExecutor()
+        failing = mock.Mock(side_effect=exceptions.StaleRevision(
+            manager='1.2.3.4', operation='update', details=''))
+        future = executor.submit('sections/1', failing)
+        next_future = executor.submit('sections/1', self._write, 'a')
+        self.assertRaises(exceptions.StaleRevision, future.result)
+        self.assertIsInstance(future.exception(), exceptions.StaleRevision)
+        # the next writes of the key still run
+        self.assertEqual('a', next_future.result())
+        self.assertIsNone(next_future.exception())
+        self.assertEqual(1, executor.failed)
+
+    def test_bounded_queue(self):
+        executor = write_executor.WriteExecutor(max_pending=1)
+        executor.submit('sections/1', self._write, 'a', 0.03)
+        submitter = eventlet.spawn(executor.submit, 'sections/2',
+                                   self._write, 'b')
+        eventlet.sleep(0.01)
+        # the second write waits for a free slot
+        self.assertEqual(1, executor.submitted)
+        self.assertEqual('b', submitter.wait().result())
+        self.assertEqual(['a', 'b'], self.calls)
+
+    def test_flush_timeout(self):
+        executor = write_executor.WriteExecutor()
+        future = executor.submit('sections/1', self._write, 'a', 0.05)
+        self.assertFalse(executor.flush(timeout=0.01))
+        self.assertFalse(future.done())
+        self.assertTrue(executor.flush())
+        self.assertTrue(future.done())
+
+    def test_shutdown(self):
+        executor = write_executor.WriteExecutor()
+        future = executor.submit('sections/1', self._write, 'a')
+        self.assertTrue(executor.shutdown())
+        self.assertTrue(future.done())
+        self.assertRaises(exceptions.WriteExecutorShutdown,
+                          executor.submit, 'sections/1', self._write, 'b')
+
+
+class WriteMergeQueueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(WriteMergeQueueTestCase, self).setUp()
+        self.queue = write_executor.WriteMergeQueue()
+        self.batches = []
+
+    def _merge(self, pending):
+        eventlet.sleep(0.01)
+        changes = [pending_write.change for pending_write in pending]
+        self.batches.append(changes)
+        return changes
+
+    def _spawn_writes(self, changes, merge):
+        return [eventlet.spawn(self.queue.write, 'pools/1', change, merge)
+                for change in changes]
+
+    def test_merged_writes(self):
+        writers = self._spawn_writes(['a', 'b', 'c'], self._merge)
+        results = [writer.wait() for writer in writers]
+        # the writes queued while the first one runs are merged
+        self.assertEqual([['a'], ['b', 'c']], self.batches)
+        self.assertEqual([['a'], ['b', 'c'], ['b', 'c']], results)
+        self.assertEqual({'writes': 3, 'cycles': 2, 'merged': 1,
+                          'locked': 0}, self.queue.as_dict())
+
+    def test_failed_change(self):
+        def _merge(pending):
+            for pending_write in pending:
+                if pending_write.change == 'b':
+                    pending_write.set_exception(
+                        (ValueError, ValueError('b'), None))
+            return self._merge(pending)
+
+        writers = self._spawn_writes(['a', 'b', 'c'], _merge)
+        self.assertEqual(['a'], writers[0].wait())
+        # only the write of the failed change fails
+        self.assertRaises(ValueError, writers[1].wait)
+        self.assertEqual(['b', 'c'], writers[2].wait())
+
+    def test_failed_merge(self):
+        merge = mock.Mock(side_effect=exceptions.StaleRevision(
+            manager='1.2.3.4', operation='update', details=''))
+        writers = self._spawn_writes(['a', 'b'], merge)
+        for writer in writers:
+            self.assertRaises(exceptions.StaleRevision, writer.wait)
+
+    def test_reentrant_write(self):
+        def _merge(pending):
+            if pending[0].change == 'a':
+                # a change writing the resource again
+                self.queue.write('pools/1', 'b', self._merge)
+            return self._merge(pending)
+
+        writer = eventlet.spawn(self.queue.write, 'pools/1', 'a', _merge)
+        with eventlet.Timeout(1):
+            self.assertEqual(['a'], writer.wait())
+        self.assertEqual([['b'], ['a']], self.batches)
+        self.assertEqual(0, self.queue.as_dict()['locked'])
+
+    def test_serialize(self):
+        running = []
+
+        def _write(name):
+            running.append(name)
+            eventlet.sleep(0.01)
+            self.assertEqual([name], running)
+            running.remove(name)
+            return name
+
+        writers = [eventlet.spawn(self.queue.serialize, 'excludelist',
+                                  _write, name)
+                   for name in ('a', 'b')]
+        self.assertEqual(['a', 'b'], [writer.wait() for writer in writers])
+
+
+class AsyncWriteApiTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(AsyncWriteApiTestCase, self).setUp()
+        self.api = mock.Mock(uri_segment='firewall/sections')
+
+    def test_ordering_keys(self):
+        executor = mock.Mock()
+        async_api = write_executor.AsyncWriteApi(self.api, executor)
+        async_api.add_rules('section1', ['rule'])
+        async_api.create_empty(display_name='sg', ordering_key='sgs/1')
+        async_api.create_with_rules()
+        self.assertEqual(
+            [mock.call('firewall/sections/section1', self.api.add_rules,
+                       'section1', ['rule']),
+             mock.call('sgs/1', self.api.create_empty, display_name='sg'),
+             mock.call('firewall/sections', self.api.create_with_rules)],
+            executor.submit.call_args_list)
+        self.assertEqual('firewall/sections', async_api.uri_segment)
+
+    def test_ordering_keys_of_id_arguments(self):
+        executor = mock.Mock()
+        section_api = security.NsxLibFirewallSection(
+            mock.Mock(), nsxlib_testcase.get_default_nsxlib_config())
+        async_api = write_executor.AsyncWriteApi(section_api, executor)
+        with mock.patch.object(security.NsxLibFirewallSection, 'add_rules',
+                               _ADD_RULES):
+            async_api.add_rules(['rule1'], 'section1')
+        async_api.add_rule({'id': 'rule2'}, section_id='section2')
+        async_api.update('section1', display_name='fw')
+        self.assertEqual(
+            ['NsxLibFirewallSection/section1',
+             'NsxLibFirewallSection/section2',
+             'NsxLibFirewallSection/section1'],
+            [call[0][0] for call in executor.submit.call_args_list])
+
+    def test_ordering_keys_of_policy_api(self):
+        executor = mock.Mock()
+        domain_api = policy_resources.NsxPolicyDomainApi(mock.Mock())
+        async_api = write_executor.AsyncWriteApi(domain_api, executor)
+        async_api.update('d1', name='domain1')
+        async_api.create_or_overwrite('domain2', domain_id='d2')
+        async_api.create_or_overwrite('domain3')
+        self.assertEqual(
+            ['NsxPolicyDomainApi/d1', 'NsxPolicyDomainApi/d2',
+             'NsxPolicyDomainApi/domain3'],
+            [call[0][0] for call in executor.submit.call_args_list])
+
+    def test_without_executor(self):
+        async_api = write_executor.AsyncWriteApi(self.api)
+        self.api.add_rules.return_value = {'rules': []}
+        self.assertEqual({'rules': []},
+                         async_api.add_rules('section1', []).result())
+        self.api.delete.side_effect = exceptions.ResourceNotFound
+        future = async_api.delete('section1')
+        self.assertTrue(future.done())
+        self.assertRaises(exceptions.ResourceNotFound, future.result)
@@ -14,16 +14,20 @@
 #    under the License.
 
 import abc
+import collections
 from distutils import version
 
+from eventlet import greenpool
 from oslo_log import log
 import six
+import six.moves.urllib.parse as urlparse
 
 from vmware_nsxlib._i18n import _
 from vmware_nsxlib.v3 import client
 from vmware_nsxlib.v3 import cluster
 from vmware_nsxlib.v3 import core_resources
 from vmware_nsxlib.v3 import exceptions
+from vmware_nsxlib.v3 import json_codec
 from vmware_nsxlib.v3 import load_balancer
 from vmware_nsxlib.v3 import native_dhcp
 from vmware_nsxlib.v3 import nsx_constants
@@ -32,9 +36,14 @@ from vmware_nsxlib.v3 import policy_resources
 from vmware_nsxlib.v3 import resources
 from vmware_nsxlib.v3 import security
 from vmware_nsxlib.v3 import utils
+from vmware_nsxlib.v3 import write_executor
 
 LOG = log.getLogger(__name__)
 
+# maximal length of the URL encoded query of a search, see
+# get_ids_by_resources_and_tags
+MAX_SEARCH_QUERY_LEN = 2000
+
 
 @six.add_metaclass(abc.ABCMeta)
 class NsxLibBase(object):
@@ -50,17 +59,69 @@ class NsxLibBase(object):
             self.cluster,
             nsx_api_managers=self.nsxlib_config.nsx_api_managers,
             max_attempts=self.nsxlib_config.max_attempts,
-            url_path_base=self.client_url_prefix)
+            url_path_base=self.client_url_prefix,
+            codec=json_codec.get_codec(
+                self.nsxlib_config.json_codec,
+                sort_keys=self.nsxlib_config.json_sort_keys),
+            cache=self._new_cache(),
+            validators=self._new_validator_cache(),
+            single_flight=(client.SingleFlight()
+                           if self.nsxlib_config.coalesce_gets else None),
+            write_queue=(write_executor.WriteMergeQueue()
+                         if self.nsxlib_config.merge_writes else None),
+            object_states=self._new_object_state_cache(),
+            lookup_index=self._new_lookup_index())
 
         self.general_apis = utils.NsxLibApiBase(
             self.client, self.nsxlib_config)
 
+        self.write_executor = self._new_write_executor()
+
         self.init_api()
 
         super(NsxLibBase, self).__init__()
 
         self.nsx_version = None
 
+    def _new_cache(self):
+        cache_opts = self.nsxlib_config.cache_opts()
+        if cache_opts is None:
+            return None
+        return utils.ResponseCache(**cache_opts)
+
+    def _new_validator_cache(self):
+        conditional_get_opts = self.nsxlib_config.conditional_get_opts()
+        if conditional_get_opts is None:
+            return None
+        return utils.ValidatorCache(**conditional_get_opts)
+
+    def _new_object_state_cache(self):
+        object_state_opts = self.nsxlib_config.object_state_opts()
+        if object_state_opts is None:
+            return None
+        return utils.ObjectStateCache(**object_state_opts)
+
+    def _new_lookup_index(self):
+        lookup_index_opts = self.nsxlib_config.lookup_index_opts()
+        if lookup_index_opts is None:
+            return None
+        return utils.LookupIndex(**lookup_index_opts)
+
+    def _new_write_executor(self):
+        async_write_opts = self.nsxlib_config.async_write_opts()
+        if async_write_opts is None:
+            return None
+        return write_executor.WriteExecutor(**async_write_opts)
+
+    def async_writes(self, api):
+        """Return a proxy of a NsxLib API whose calls return futures.
+
+        The calls run in the background when async_writes is enabled, in
+        order per resource, see write_executor.AsyncWriteApi. Use
+        write_executor.flush() or shutdown() to wait for them.
+        """
+        return write_executor.AsyncWriteApi(api, self.write_executor)
+
     def set_config(self, nsxlib_config):
         """Set config user provided and extend it according to application"""
         self.nsxlib_config = nsxlib_config
@@ -125,6 +186,10 @@ class NsxLibBase(object):
             query += " AND %s" % query_tags
         else:
             query = query_tags
+        return self._search_by_query(query, cursor=cursor,
+                                     page_size=page_size)
+
+    def _search_by_query(self, query, cursor=None, page_size=None):
         url = "search?query=%s" % query
         if cursor:
             url += "&cursor=%d" % cursor
@@ -132,8 +197,20 @@ class NsxLibBase(object):
             url += "&page_size=%d" % page_size
         return self.client.url_get(url)
 
-    def search_all_by_tags(self, tags, resource_type=None):
-        """Return all the results searched based on tags."""
+    def search_all_by_tags(self, tags, resource_type=None, concurrency=None):
+        """Return all the results searched based on tags.
+
+        :param concurrency: Maximum number of pages fetched in parallel once
+                            the first page returned the result count.
+                            Defaults to the search_concurrency of the
+                            configuration, pages are fetched one at a time
+                            if 1.
+        """
+        if concurrency is None:
+            concurrency = self.nsxlib_config.search_concurrency
+        if concurrency > 1:
+            return self._search_all_by_tags_parallel(
+                tags, resource_type, concurrency)
         results = []
         cursor = 0
         while True:
@@ -147,6 +224,30 @@ class NsxLibBase(object):
             if cursor >= result_count:
                 return results
 
+    def _search_all_by_tags_parallel(self, tags, resource_type,
+                                     concurrency):
+        # the search cursor is the offset of the next page, so the pages
+        # following the first one can be fetched without waiting for it
+        response = self.search_by_tags(resource_type=resource_type,
+                                       tags=tags)
+        results = response['results']
+        if not results:
+            return results
+        page_size = len(results)
+        offsets = six.moves.range(int(response['cursor']),
+                                  int(response['result_count']), page_size)
+
+        def _search_page(offset):
+            return self.search_by_tags(
+                resource_type=resource_type, tags=tags, cursor=offset,
+                page_size=page_size)['results']
+
+        pool = greenpool.GreenPool(concurrency)
+        # imap returns the pages in the order of their offsets
+        for page in pool.imap(_search_page, offsets):
+            results.extend(page)
+        return results
+
     def get_id_by_resource_and_tag(self, resource_type, scope, tag,
                                    alert_not_found=False,
                                    alert_multiple=False):
@@ -158,7 +259,14 @@ class NsxLibBase(object):
                        'tag': utils.escape_tag_data(tag)}]
         query_result = self.search_by_tags(
             tags=query_tags, resource_type=resource_type)
-        if not query_result['result_count']:
+        return self._get_single_id(
+            resource_type, scope, tag, query_result['result_count'],
+            query_result['results'], alert_not_found=alert_not_found,
+            alert_multiple=alert_multiple)
+
+    def _get_single_id(self, resource_type, scope, tag, result_count,
+                       results, alert_not_found=False, alert_multiple=False):
+        if not result_count:
             if alert_not_found:
                 msg = _("No %(type)s found for tag '%(scope)s:%(tag)s'") % {
                     'type': resource_type,
@@ -168,8 +276,8 @@ class NsxLibBase(object):
                 raise exceptions.ResourceNotFound(
                     manager=self.nsxlib_config.nsx_api_managers,
                     operation=msg)
-        elif query_result['result_count'] == 1:
-            return query_result['results'][0]['id']
+        elif result_count == 1:
+            return results[0]['id']
         else:
             # multiple results
             if alert_multiple:
@@ -184,6 +292,104 @@ class NsxLibBase(object):
                     operation=msg,
                     details='')
 
+    def get_ids_by_resources_and_tags(self, keys, alert_not_found=False,
+                                      alert_multiple=False,
+                                      concurrency=None,
+                                      max_query_len=MAX_SEARCH_QUERY_LEN):
+        """Search many resources, each by its type and 1 scope&tag.
+
+        The bulk version of get_id_by_resource_and_tag. The tags of the
+        same resource type and scope are searched together, with as few
+        queries as max_query_len allows.
+
+        :param keys: List of (resource_type, scope, tag) tuples.
+        :param concurrency: Maximum number of queries sent in parallel.
+                            Defaults to the search_concurrency of the
+                            configuration.
+        :return: A dict of the id of the single resource found for each
+                 key, None if there are none or many of them, unless
+                 alerted by raising the same errors as
+                 get_id_by_resource_and_tag.
+        """
+        if concurrency is None:
+            concurrency = self.nsxlib_config.search_concurrency
+        keys = list(collections.OrderedDict.fromkeys(keys))
+        groups = collections.OrderedDict()
+        for resource_type, scope, tag in keys:
+            groups.setdefault((resource_type, scope), []).append(tag)
+        queries = []
+        for (resource_type, scope), tags in groups.items():
+            queries.extend(self._build_tag_queries(
+                resource_type, scope, tags, max_query_len))
+
+        def _search(query):
+            results = []
+            cursor = None
+            while True:
+                response = self._search_by_query(query, cursor=cursor)
+                results.extend(response['results'])
+                if (not response['results'] or
+                        len(results) >= int(response['result_count'])):
+                    return results
+                cursor = int(response['cursor'])
+
+        found = dict((key, []) for key in keys)
+        pool = greenpool.GreenPool(concurrency)
+        # imap returns the results in the order of the queries
+        searches = pool.imap(_search, [item[3] for item in queries])
+        for (resource_type, scope, tags, query), results in six.moves.zip(
+                queries, searches):
+            for result in results:
+                # attribute the result to the keys its tags match, the
+                # same way as the query of a single scope&tag does
+                result_scopes = set(t.get('scope')
+                                    for t in result.get('tags', []))
+                result_tags = set(t.get('tag')
+                                  for t in result.get('tags', []))
+                if scope not in result_scopes:
+                    continue
+                for tag in tags:
+                    if tag in result_tags:
+                        found[(resource_type, scope, tag)].append(result)
+
+        ids = {}
+        for key in keys:
+            resource_type, scope, tag = key
+            ids[key] = self._get_single_id(
+                resource_type, scope, tag, len(found[key]), found[key],
+                alert_not_found=alert_not_found,
+                alert_multiple=alert_multiple)
+        return ids
+
+    @staticmethod
+    def _build_tag_queries(resource_type, scope, tags, max_query_len):
+        """Return the queries searching a resource type for some tags.
+
+        Each query searches as many of the tags as max_query_len allows,
+        with an OR group. Returns (resource_type, scope, tags, query)
+        tuples.
+        """
+        prefix = 'tags.scope:%s AND (' % utils.escape_tag_data(scope)
+        if resource_type:
+            prefix = 'resource_type:%s AND %s' % (resource_type, prefix)
+        queries = []
+        query_tags = []
+        terms = []
+        for tag in tags:
+            term = 'tags.tag:%s' % utils.escape_tag_data(tag)
+            query = '%s%s)' % (prefix, ' OR '.join(terms + [term]))
+            if terms and len(urlparse.quote(query)) > max_query_len:
+                queries.append((resource_type, scope, query_tags,
+                                '%s%s)' % (prefix, ' OR '.join(terms))))
+                query_tags = []
+                terms = []
+            query_tags.append(tag)
+            terms.append(term)
+        if terms:
+            queries.append((resource_type, scope, query_tags,
+                            '%s%s)' % (prefix, ' OR '.join(terms))))
+        return queries
+
     def _build_query(self, tags):
         try:
             return " AND ".join(['tags.scope:%(scope)s AND '
@@ -0,0 +1,557 @@
+# Copyright 2017 VMware, Inc.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""asyncio native counterparts of the clustered API and NSX client.
+
+The eventlet based ClusteredAPI pools one requests.Session per in-flight
+request. The classes below keep a single multiplexing HTTP session per
+endpoint and bound the number of in-flight requests with a semaphore, so
+that a single asyncio process can keep thousands of requests in flight.
+
+This module requires python 3.5 or later, and the aiohttp library for the
+default HTTP provider.
+"""
+import asyncio
+import collections
+import logging
+import time
+
+from oslo_log import log
+from oslo_serialization import jsonutils
+from requests import structures
+import six.moves.urllib.parse as urlparse
+
+from vmware_nsxlib._i18n import _
+from vmware_nsxlib.v3 import client as nsx_client
+from vmware_nsxlib.v3 import cluster
+from vmware_nsxlib.v3 import exceptions
+from vmware_nsxlib.v3 import utils
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+LOG = log.getLogger(__name__)
+
+
+class AsyncResponse(object):
+    """A fully read HTTP response.
+
+    Duck types the parts of requests.Response used by the REST clients.
+    """
+
+    def __init__(self, status_code, content=None, headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = structures.CaseInsensitiveDict(headers or {})
+
+    def json(self):
+        return jsonutils.loads(self.content)
+
+
+class AsyncSession(object):
+    """Wraps an aiohttp.ClientSession with the requests style verbs.
+
+    Each verb is a coroutine returning an AsyncResponse whose body was
+    already read, so the underlying connection is released to the session
+    connector as soon as the call returns.
+    """
+
+    def __init__(self, session):
+        self._session = session
+
+    async def _request(self, method, url, data=None, headers=None,
+                       **kwargs):
+        async with self._session.request(method, url, data=data,
+                                         headers=headers,
+                                         allow_redirects=False,
+                                         **kwargs) as response:
+            content = await response.read()
+            return AsyncResponse(response.status, content=content,
+                                 headers=dict(response.headers))
+
+    async def get(self, url, **kwargs):
+        return await self._request('GET', url, **kwargs)
+
+    async def delete(self, url, **kwargs):
+        return await self._request('DELETE', url, **kwargs)
+
+    async def head(self, url, **kwargs):
+        return await self._request('HEAD', url, **kwargs)
+
+    async def put(self, url, **kwargs):
+        return await self._request('PUT', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self._request('POST', url, **kwargs)
+
+    async def patch(self, url, **kwargs):
+        return await self._request('PATCH', url, **kwargs)
+
+    async def close(self):
+        await self._session.close()
+
+
+class AsyncNSXHTTPProvider(cluster.AbstractHTTPProvider):
+    """Concrete implementation of AbstractHTTPProvider.
+
+    using aiohttp.ClientSession() as the underlying connection. A single
+    session is created per endpoint, and its connector keeps up to
+    concurrent_connections keep-alive sockets open to the manager.
+    """
+
+    def __init__(self):
+        if aiohttp is None:
+            raise exceptions.MissingDependency(
+                library='aiohttp', feature=self.__class__.__name__)
+
+    @property
+    def provider_id(self):
+        return "aiohttp-%s" % aiohttp.__version__
+
+    async def validate_connection(self, cluster_api, endpoint, conn):
+        client = AsyncNSX3Client(
+            conn, url_prefix=endpoint.provider.url,
+            url_path_base=cluster_api.nsxlib_config.url_base)
+        method, uri = cluster.keepalive_probe(cluster_api.nsxlib_config)
+        result = await client._rest_call(uri, method=method, silent=True)
+        cluster.validate_probe_result(endpoint, method, uri, result)
+
+    def new_connection(self, cluster_api, provider):
+        config = cluster_api.nsxlib_config
+        auth = None
+        if not config.client_cert_provider:
+            auth = aiohttp.BasicAuth(provider.username, provider.password)
+
+        connector = aiohttp.TCPConnector(
+            limit=config.concurrent_connections,
+            ssl=cluster.ssl_context(config, provider))
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=config.http_timeout,
+            sock_read=config.http_read_timeout)
+        return AsyncSession(aiohttp.ClientSession(
+            connector=connector, auth=auth, timeout=timeout))
+
+    def is_connection_exception(self, exception):
+        return isinstance(exception, (aiohttp.ClientConnectionError,
+                                      asyncio.TimeoutError))
+
+
+class ResizableSemaphore(object):
+    """asyncio semaphore whose number of slots can be changed.
+
+    Shrinking does not affect the slots already acquired, acquirers wait
+    until the number of acquired slots drops below the new size.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.acquired = 0
+        self._waiters = collections.deque()
+
+    def _wake_up(self):
+        free = self.size - self.acquired
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    async def acquire(self):
+        while self.acquired >= self.size:
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # pass the wake up on to the next waiter
+                self._wake_up()
+                raise
+        self.acquired += 1
+
+    def release(self):
+        self.acquired -= 1
+        self._wake_up()
+
+    def resize(self, size):
+        self.size = size
+        self._wake_up()
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class AsyncEndpoint(cluster.Endpoint):
+    """A single NSX manager endpoint served over asyncio.
+
+    Instead of a pool of connections, the endpoint holds one shared
+    connection created on first use, and a semaphore bounding the number
+    of requests in flight towards the manager.
+    """
+
+    def __init__(self, provider, create, max_concurrency, breaker=None,
+                 limiter=None):
+        super(AsyncEndpoint, self).__init__(provider, None, breaker=breaker,
+                                            limiter=limiter)
+        self._create = create
+        self._connection = None
+        self.semaphore = ResizableSemaphore(max_concurrency)
+
+    def set_concurrency(self, limit):
+        if self.semaphore.size != limit:
+            LOG.info("Endpoint '%(ep)s' concurrency limit changing from "
+                     "%(old)s to %(new)s",
+                     {'ep': self.provider, 'old': self.semaphore.size,
+                      'new': limit})
+            self.semaphore.resize(limit)
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = self._create()
+        return self._connection
+
+    def regenerate_pool(self):
+        conn, self._connection = self._connection, None
+        if conn is not None and hasattr(conn, 'close'):
+            asyncio.ensure_future(conn.close())
+
+    async def close(self):
+        conn, self._connection = self._connection, None
+        if conn is not None and hasattr(conn, 'close'):
+            await conn.close()
+
+
+class AsyncClusteredAPI(cluster.ClusteredAPI):
+    """asyncio flavor of ClusteredAPI.
+
+    The major HTTP methods (get(), put(), post(), etc.) are coroutines
+    proxied to one of the managed NSX manager endpoints, with the same
+    endpoint scheduling, health and failover semantics as ClusteredAPI.
+
+    Nothing is validated on construction; start() must be awaited from
+    the event loop before issuing requests and close() on shutdown.
+    """
+
+    def __init__(self, providers,
+                 http_provider,
+                 min_conns_per_pool=1,
+                 max_conns_per_pool=500,
+                 keepalive_interval=33,
+                 scheduler=cluster.SCHEDULER_ROUND_ROBIN,
+                 circuit_breaker_opts=None,
+                 retry_budget_opts=None,
+                 concurrency_limiter_opts=None,
+                 throttle_retries=0):
+        # NOTE: ClusteredAPI.__init__ is not called as it initializes
+        # eventlet pools and keepalive loops
+        self._http_provider = http_provider
+        self._keepalive_interval = keepalive_interval
+        self._scheduler_name = scheduler
+        self._circuit_breaker_opts = circuit_breaker_opts or {}
+        self._concurrency_limiter_opts = concurrency_limiter_opts
+        self._throttle_retries = throttle_retries
+        self._retry_budget = (utils.RetryBudget(**retry_budget_opts)
+                              if retry_budget_opts else None)
+        self._keepalive_tasks = []
+        self._init_endpoints(providers, min_conns_per_pool,
+                             max_conns_per_pool)
+
+    def _init_endpoints(self, providers,
+                        min_conns_per_pool, max_conns_per_pool):
+        def _create_conn(p):
+            def _conn():
+                return self._http_provider.new_connection(self, p)
+
+            return _conn
+
+        self._endpoints = {}
+        for provider in providers:
+            self._endpoints[provider.id] = AsyncEndpoint(
+                provider, _create_conn(provider), max_conns_per_pool,
+                breaker=cluster.CircuitBreaker(**self._circuit_breaker_opts),
+                limiter=self._new_limiter(max_conns_per_pool))
+
+        self._scheduler = cluster.get_scheduler(self._scheduler_name,
+                                                self._endpoints.values())
+
+        # duck type to proxy http invocations
+        for method in cluster.ClusteredAPI._HTTP_VERBS:
+            setattr(self, method, self._proxy_stub(method))
+
+    def _ensure_initialized(self):
+        # the endpoints are validated by start(), from the event loop
+        pass
+
+    async def start(self):
+        """Validate the endpoints and start their keepalive tasks.
+
+        Returns as soon as one endpoint is UP, or all of them were found
+        DOWN.
+        """
+        LOG.debug("Initializing async API endpoints")
+        loop = asyncio.get_event_loop()
+        pending = [loop.create_task(self._validate(endpoint))
+                   for endpoint in self._endpoints.values()]
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            if self.health != cluster.ClusterHealth.RED:
+                # only wait for 1 or more endpoints to reduce init time
+                break
+
+        self._keepalive_tasks = [
+            loop.create_task(self._endpoint_keepalive(endpoint))
+            for endpoint in self._endpoints.values()]
+
+        LOG.debug("Done initializing async API endpoint(s). "
+                  "API cluster health: %s", self.health)
+
+    async def close(self):
+        for task in self._keepalive_tasks:
+            task.cancel()
+        self._keepalive_tasks = []
+        for endpoint in self._endpoints.values():
+            await endpoint.close()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _endpoint_keepalive(self, endpoint):
+        await asyncio.sleep(self._keepalive_delay(endpoint))
+        while True:
+            validated = self._keepalive_due(endpoint)
+            if validated:
+                await self._validate(endpoint)
+            await asyncio.sleep(
+                self._keepalive_delay(endpoint, validated=validated))
+
+    async def _validate(self, endpoint):
+        try:
+            async with endpoint.semaphore:
+                ts = time.time()
+                await self._http_provider.validate_connection(
+                    self, endpoint, endpoint.connection)
+                endpoint.stats.record_probe(latency=time.time() - ts)
+                endpoint.breaker.record_success()
+                endpoint.set_state(cluster.EndpointState.UP)
+        except exceptions.ClientCertificateNotTrusted:
+            endpoint.stats.record_probe(failed=True)
+            LOG.warning("Failed to validate API cluster endpoint "
+                        "'%(ep)s' due to untrusted client certificate",
+                        {'ep': endpoint})
+            # regenerate connection based on new certificate
+            endpoint.regenerate_pool()
+        except Exception as e:
+            endpoint.stats.record_probe(failed=True)
+            endpoint.breaker.record_failure()
+            endpoint.set_state(cluster.EndpointState.DOWN)
+            LOG.warning("Failed to validate API cluster endpoint "
+                        "'%(ep)s' due to: %(err)s",
+                        {'ep': endpoint, 'err': e})
+
+    def endpoint_for_connection(self, conn):
+        for endpoint in self._endpoints.values():
+            if endpoint._connection is conn:
+                return endpoint
+
+    def connection(self):
+        raise NotImplementedError(
+            _("Connections are not handed out by the async cluster"))
+
+    def endpoint_connection(self):
+        raise NotImplementedError(
+            _("Connections are not handed out by the async cluster"))
+
+    def _proxy_stub(self, proxy_for):
+        async def _call_proxy(url, *args, **kwargs):
+            if self._retry_budget:
+                self._retry_budget.deposit()
+            attempt = 0
+            while True:
+                response = await self._proxy(proxy_for, url, *args, **kwargs)
+                delay = self._throttled_retry_delay(
+                    proxy_for, response, attempt)
+                if delay is None:
+                    return response
+                await asyncio.sleep(delay)
+                attempt += 1
+        return _call_proxy
+
+    async def _proxy(self, proxy_for, uri, *args, **kwargs):
+        # proxy http request call to an avail endpoint
+        endpoint = self._select_endpoint()
+        if not endpoint:
+            LOG.debug("All endpoints down for: %s" %
+                      [str(ep) for ep in self._endpoints.values()])
+            raise exceptions.ServiceClusterUnavailable(
+                cluster_id=self.cluster_id)
+
+        if not uri.startswith('/'):
+            uri = "/%s" % uri
+        url = "%s%s" % (endpoint.provider.url, uri)
+        trial = (endpoint.breaker.state ==
+                 cluster.CircuitBreakerState.HALF_OPEN)
+        endpoint.outstanding += 1
+        async with endpoint.semaphore:
+            do_request = getattr(endpoint.connection, proxy_for)
+            try:
+                LOG.debug("API cluster proxy %s %s to %s",
+                          proxy_for.upper(), uri, url)
+                ts = time.time()
+                response = await do_request(url, *args, **kwargs)
+                latency = time.time() - ts
+                endpoint.record_latency(latency)
+                self._record_response(endpoint, response, latency=latency)
+                return response
+            except Exception as e:
+                LOG.warning("Request failed due to: %s", e)
+                if not self._record_exception(endpoint, e, trial=trial):
+                    # only trap and retry connection errors
+                    raise e
+                if not self._retry_allowed():
+                    LOG.warning("Not retrying %s on another endpoint, the "
+                                "retry budget is exhausted", uri)
+                    raise e
+                LOG.debug("Connection to %s failed, checking additional "
+                          "endpoints" % url)
+            finally:
+                endpoint.outstanding -= 1
+
+        # retry until exhausting endpoints, without holding a slot
+        # of the failed endpoint
+        return await self._proxy(proxy_for, uri, *args, **kwargs)
+
+
+class AsyncNSXClusteredAPI(AsyncClusteredAPI):
+    """Extends AsyncClusteredAPI to get conf values for the NSXv3 cluster."""
+
+    # the providers are built exactly like the eventlet flavor does
+    _build_conf_providers = cluster.NSXClusteredAPI._build_conf_providers
+
+    def __init__(self, nsxlib_config):
+        self.nsxlib_config = nsxlib_config
+
+        self._http_provider = (nsxlib_config.http_provider or
+                               AsyncNSXHTTPProvider())
+        # the connections of an eventlet provider cannot be awaited
+        if not asyncio.iscoroutinefunction(
+                self._http_provider.validate_connection):
+            raise exceptions.UnsupportedHTTPProvider(
+                provider=self._http_provider.provider_id,
+                feature=self.__class__.__name__)
+
+        super(AsyncNSXClusteredAPI, self).__init__(
+            self._build_conf_providers(),
+            self._http_provider,
+            max_conns_per_pool=self.nsxlib_config.concurrent_connections,
+            keepalive_interval=self.nsxlib_config.conn_idle_timeout,
+            scheduler=self.nsxlib_config.endpoint_scheduler,
+            circuit_breaker_opts=self.nsxlib_config.circuit_breaker_opts(),
+            retry_budget_opts=self.nsxlib_config.retry_budget_opts(),
+            concurrency_limiter_opts=(
+                self.nsxlib_config.concurrency_limiter_opts()),
+            throttle_retries=self.nsxlib_config.throttle_retries)
+
+        LOG.debug("Created async NSX clustered API with '%s' "
+                  "provider", self._http_provider.provider_id)
+
+
+class AsyncNSX3Client(nsx_client.NSX3Client):
+    """NSX3Client whose REST calls are coroutines.
+
+    To be used over an AsyncClusteredAPI (or an AsyncSession) connection.
+    The verbs (get(), list(), create(), update(), delete(), patch() and
+    their url_* flavors) return awaitables. The response cache, object
+    states and lookup index of the client are not used, and iter_list(),
+    new_batch() and lookup() are not supported, as they would block the
+    event loop.
+    """
+
+    def iter_list(self, *args, **kwargs):
+        # python 3.5 has no asynchronous generators
+        raise NotImplementedError(
+            _("Lists are not iterated by the async client, use list()"))
+
+    url_iter_list = iter_list
+
+    def new_batch(self, *args, **kwargs):
+        raise NotImplementedError(
+            _("Batch requests are not supported by the async client"))
+
+    def lookup(self, *args, **kwargs):
+        raise NotImplementedError(
+            _("The lookup index is not supported by the async client"))
+
+    async def url_get(self, url, headers=None, silent=False):
+        # bypass the response cache of NSX3Client.url_get
+        return await self._rest_call(url, method='GET', headers=headers,
+                                     silent=silent)
+
+    async def url_list(self, url, headers=None, silent=False):
+        concatenate_response = await self.url_get(url, headers=headers)
+        cursor = concatenate_response.get(
+            'cursor', nsx_client.NULL_CURSOR_PREFIX)
+        op = '&' if urlparse.urlparse(url).query else '?'
+        url += op + 'cursor='
+
+        while cursor and not cursor.startswith(
+                nsx_client.NULL_CURSOR_PREFIX):
+            page = await self.url_get(url + cursor, headers=headers,
+                                      silent=silent)
+            concatenate_response['results'].extend(page.get('results', []))
+            cursor = page.get('cursor', nsx_client.NULL_CURSOR_PREFIX)
+        return concatenate_response
+
+    async def _rest_call(self, url, method='GET', body=None, headers=None,
+                         silent=False):
+        if body is not None:
+            body = self.codec.dumps(body)
+        request_headers = headers.copy() if headers else {}
+        request_headers.update(self._default_headers)
+        request_url = self._build_url(url)
+
+        do_request = getattr(self._conn, method.lower())
+        # the arguments of the debug logs are costly to compute
+        debug = not silent and LOG.isEnabledFor(logging.DEBUG)
+        if debug:
+            LOG.debug("REST call: %s %s. Headers: %s. Body: %s",
+                      method, request_url, request_headers,
+                      self._mask_password(body))
+
+        ts = time.time()
+        result = await do_request(
+            request_url,
+            data=body,
+            headers=request_headers)
+        te = time.time()
+
+        if debug:
+            LOG.debug("REST call: %s %s. Response: %s. Took %2.4f",
+                      method, request_url, self._decode(result), te - ts)
+
+        self._validate_result(
+            result, nsx_client.RESTClient._VERB_RESP_CODES[method.lower()],
+            _("%(verb)s %(url)s") % {'verb': method, 'url': request_url},
+            silent=silent)
+        return self._decode(result) if result.content else result
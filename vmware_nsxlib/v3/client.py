@@ -13,20 +13,36 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 #
+import copy
+import functools
+import logging
 import re
+import sys
 import time
 
+import eventlet
+from eventlet import event
+from eventlet import queue
 from oslo_log import log
-from oslo_serialization import jsonutils
 import requests
+import six
 import six.moves.urllib.parse as urlparse
 from vmware_nsxlib._i18n import _
 from vmware_nsxlib.v3 import exceptions
+from vmware_nsxlib.v3 import json_codec
 from vmware_nsxlib.v3 import utils
 
 LOG = log.getLogger(__name__)
 
 NULL_CURSOR_PREFIX = '0000'
+# pages of a paginated list fetched ahead of the one being processed
+DEFAULT_PREFETCH = 1
+# attribute of a response caching its decoded body
+DECODED_BODY_ATTR = '_nsxlib_decoded_body'
+# bytes read at once from a streamed response
+STREAM_CHUNK_SIZE = 64 * 1024
+# maximum number of requests run by a single call to the batch API
+BATCH_MAX_REQUESTS = 50
 
 
 def http_error_to_exception(status_code, error_code):
@@ -35,6 +51,8 @@ def http_error_to_exception(status_code, error_code):
             {'202': exceptions.BackendResourceNotFound,
              'default': exceptions.ResourceNotFound},
         requests.codes.PRECONDITION_FAILED: exceptions.StaleRevision,
+        requests.codes.TOO_MANY_REQUESTS: exceptions.TooManyRequests,
+        requests.codes.SERVICE_UNAVAILABLE: exceptions.ServiceUnavailable,
         requests.codes.INTERNAL_SERVER_ERROR:
             {'99': exceptions.ClientCertificateNotTrusted}}
 
@@ -52,21 +70,134 @@ def http_error_to_exception(status_code, error_code):
     return exceptions.ManagerError
 
 
+def prefetch(iterable, depth):
+    """Iterate over iterable, consuming it ahead in a greenthread.
+
+    At most depth items are buffered. Closing the returned generator lets
+    the item being consumed complete, so no request is interrupted.
+    """
+    buffer = queue.Queue(maxsize=depth)
+    state = {'closed': False}
+
+    def _produce():
+        try:
+            for item in iterable:
+                buffer.put((True, item))
+                if state['closed']:
+                    return
+        except Exception as e:
+            buffer.put((False, e))
+        else:
+            buffer.put((False, None))
+
+    eventlet.spawn_n(_produce)
+    try:
+        while True:
+            consumed, item = buffer.get()
+            if not consumed:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        state['closed'] = True
+        # unblock the producer, to let it see it was closed
+        while not buffer.empty():
+            buffer.get_nowait()
+
+
+def copy_response(response):
+    """Return a copy of a response, whose body is decoded again."""
+    decoded = vars(response).get(DECODED_BODY_ATTR)
+    clone = copy.copy(response)
+    vars(clone).pop(DECODED_BODY_ATTR, None)
+    if decoded is not None and not response.content:
+        # the body of a 304 Not Modified response
+        vars(clone)[DECODED_BODY_ATTR] = copy.deepcopy(decoded)
+    return clone
+
+
+class SingleFlight(object):
+    """Coalesces the identical calls made concurrently by greenthreads.
+
+    The first call runs while the next ones, made before it returns, wait
+    for and share its result, or its exception.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._generation = 0
+        # key: (generation, event of the call in flight)
+        self._calls = {}
+
+    def invalidate(self):
+        """Have the next calls not share the results of those in flight."""
+        self._generation += 1
+
+    def do(self, key, func):
+        """Return whether the call was run, and its result."""
+        self.calls += 1
+        call = self._calls.get(key)
+        if call is not None and call[0] == self._generation:
+            self.coalesced += 1
+            return False, call[1].wait()
+
+        done = event.Event()
+        self._calls[key] = (self._generation, done)
+        try:
+            result = func()
+        except Exception:
+            self._forget(key, done)
+            done.send_exception(*sys.exc_info())
+            raise
+        self._forget(key, done)
+        done.send(result)
+        return True, result
+
+    def _forget(self, key, done):
+        call = self._calls.get(key)
+        if call is not None and call[1] is done:
+            del self._calls[key]
+
+    def as_dict(self):
+        return {'calls': self.calls, 'coalesced': self.coalesced}
+
+
+def iter_content(response, chunk_size=STREAM_CHUNK_SIZE):
+    """Iterate over the body of a response, streamed if possible."""
+    # requests and httpx responses respectively
+    for method in ('iter_content', 'iter_bytes'):
+        if hasattr(response, method):
+            return getattr(response, method)(chunk_size)
+    return [response.content]
+
+
 class RESTClient(object):
 
     _VERB_RESP_CODES = {
         'get': [requests.codes.ok],
+        'head': [requests.codes.ok],
         'post': [requests.codes.created, requests.codes.ok],
         'put': [requests.codes.created, requests.codes.ok],
+        'patch': [requests.codes.created, requests.codes.ok],
         'delete': [requests.codes.ok]
     }
 
     def __init__(self, connection, url_prefix=None,
                  default_headers=None,
-                 client_obj=None):
+                 client_obj=None,
+                 codec=None,
+                 validators=None,
+                 single_flight=None):
         self._conn = connection
         self._url_prefix = url_prefix or ""
         self._default_headers = default_headers or {}
+        self.codec = codec or json_codec.JSONCodec()
+        # the validators of the conditional GET requests, if enabled
+        self.validators = validators
+        # the GET requests in flight, if coalesced
+        self.single_flight = single_flight
 
     def new_client_for(self, *uri_segments):
         uri = self._build_url('/'.join(uri_segments))
@@ -75,7 +206,20 @@ class RESTClient(object):
             self._conn,
             url_prefix=uri,
             default_headers=self._default_headers,
-            client_obj=self)
+            client_obj=self,
+            codec=self.codec,
+            validators=self.validators,
+            single_flight=self.single_flight)
+
+    @property
+    def single_flight_stats(self):
+        """The GET requests coalesced with identical ones, if enabled"""
+        return self.single_flight.as_dict() if self.single_flight else None
+
+    @property
+    def conditional_get_stats(self):
+        """The requests and bytes saved by conditional GETs, if enabled"""
+        return self.validators.as_dict() if self.validators else None
 
     def list(self, resource='', headers=None, silent=False):
         return self.url_list(resource, headers=headers, silent=silent)
@@ -92,18 +236,106 @@ class RESTClient(object):
     def create(self, resource='', body=None, headers=None):
         return self.url_post(resource, body, headers=headers)
 
-    def url_list(self, url, headers=None, silent=False):
-        concatenate_response = self.url_get(url, headers=headers)
-        cursor = concatenate_response.get('cursor', NULL_CURSOR_PREFIX)
+    def patch(self, uuid, body=None, headers=None):
+        return self.url_patch(uuid, body, headers=headers)
+
+    def iter_list(self, resource='', headers=None, silent=False,
+                  prefetch_depth=DEFAULT_PREFETCH, stream=False,
+                  fields=None):
+        return self.url_iter_list(resource, headers=headers, silent=silent,
+                                  prefetch_depth=prefetch_depth,
+                                  stream=stream, fields=fields)
+
+    def _url_list_pages(self, url, headers=None, silent=False):
+        page = self.url_get(url, headers=headers)
+        yield page
+        cursor = page.get('cursor', NULL_CURSOR_PREFIX)
         op = '&' if urlparse.urlparse(url).query else '?'
         url += op + 'cursor='
 
         while cursor and not cursor.startswith(NULL_CURSOR_PREFIX):
             page = self.url_get(url + cursor, headers=headers, silent=silent)
-            concatenate_response['results'].extend(page.get('results', []))
+            yield page
             cursor = page.get('cursor', NULL_CURSOR_PREFIX)
+
+    def url_list(self, url, headers=None, silent=False, fields=None):
+        """Return all the results of a paginated list.
+
+        If fields are given, the pages are decoded from the response
+        stream and only those fields of each result are kept.
+        """
+        if fields:
+            results = list(self.url_iter_list(
+                url, headers=headers, silent=silent, stream=True,
+                fields=fields))
+            return {'results': results, 'result_count': len(results)}
+        pages = self._url_list_pages(url, headers=headers, silent=silent)
+        concatenate_response = next(pages)
+        for page in pages:
+            concatenate_response['results'].extend(page.get('results', []))
         return concatenate_response
 
+    def url_iter_list(self, url, headers=None, silent=False,
+                      prefetch_depth=DEFAULT_PREFETCH, stream=False,
+                      fields=None):
+        """Yield the results of a paginated list, page by page.
+
+        The next pages, up to prefetch_depth of them, are fetched in the
+        background while the results of the current one are consumed. With
+        a prefetch_depth of 0, a page is only fetched once the previous one
+        was consumed.
+
+        With stream, the results are decoded one at a time from the
+        response stream, and nothing is prefetched as the cursor of the
+        next page may only be known at the end of the current one.
+        Results are reduced to the said fields, if any.
+        """
+        if stream:
+            return self._url_stream_list(url, headers=headers, silent=silent,
+                                         fields=fields)
+        pages = self._url_list_pages(url, headers=headers, silent=silent)
+        if prefetch_depth > 0:
+            pages = prefetch(pages, prefetch_depth)
+        return self._page_results(pages, fields=fields)
+
+    @staticmethod
+    def _page_results(pages, fields=None):
+        for page in pages:
+            for result in page.get('results', []):
+                if fields:
+                    result = dict((field, result[field]) for field in fields
+                                  if field in result)
+                yield result
+
+    def _url_stream_list(self, url, headers=None, silent=False, fields=None):
+        op = '&' if urlparse.urlparse(url).query else '?'
+        page_url = url
+        while True:
+            page = {}
+            for result in self._stream_results(page_url, page,
+                                               headers=headers,
+                                               silent=silent, fields=fields):
+                yield result
+            cursor = page.get('cursor', NULL_CURSOR_PREFIX)
+            if not cursor or cursor.startswith(NULL_CURSOR_PREFIX):
+                return
+            page_url = url + op + 'cursor=' + cursor
+
+    def _stream_results(self, url, page, headers=None, silent=False,
+                        fields=None):
+        """Yield the results of a list request, decoded from its stream."""
+        result = self._rest_call(url, method='GET', headers=headers,
+                                 silent=silent, stream=True)
+        try:
+            for obj in json_codec.iter_results(iter_content(result),
+                                               page=page, fields=fields):
+                yield obj
+        finally:
+            close = getattr(result, 'close', None)
+            if close:
+                # release the connection of a response not read to the end
+                close()
+
     def url_get(self, url, headers=None, silent=False):
         return self._rest_call(url, method='GET', headers=headers,
                                silent=silent)
@@ -117,6 +349,10 @@ class RESTClient(object):
     def url_post(self, url, body, headers=None):
         return self._rest_call(url, method='POST', body=body, headers=headers)
 
+    def url_patch(self, url, body, headers=None):
+        return self._rest_call(url, method='PATCH', body=body,
+                               headers=headers)
+
     def _raise_error(self, status_code, operation, result_msg,
                      error_code=None):
         error = http_error_to_exception(status_code, error_code)
@@ -125,7 +361,7 @@ class RESTClient(object):
 
     def _validate_result(self, result, expected, operation, silent=False):
         if result.status_code not in expected:
-            result_msg = result.json() if result.content else ''
+            result_msg = self._decode(result)
             if not silent:
                 LOG.warning("The HTTP request returned error code "
                             "%(result)s, whereas %(expected)s response "
@@ -168,42 +404,144 @@ class RESTClient(object):
         '''Mask password value in json format'''
         if not json:
             return json
+        if isinstance(json, six.binary_type):
+            json = json.decode('utf-8')
 
-        pattern = r'\"password\": [^,}]*'
+        # compact encodings, such as orjson's, have no space after colons
+        pattern = r'"password":\s*[^,}]*'
         return re.sub(pattern, '"password": "********"', json)
 
     def _rest_call(self, url, method='GET', body=None, headers=None,
-                   silent=False):
+                   silent=False, stream=False):
+        send = functools.partial(self._send_request, url, method=method,
+                                 body=body, headers=headers, silent=silent,
+                                 stream=stream)
+        if self.single_flight is None or stream:
+            return send()
+        if method.lower() not in ('get', 'head'):
+            # the GET requests in flight may not see the write, so that
+            # the next ones are not coalesced with them
+            self.single_flight.invalidate()
+            try:
+                return send()
+            finally:
+                self.single_flight.invalidate()
+        if method.lower() != 'get':
+            return send()
+
+        key = (self._build_url(url),
+               tuple(sorted(headers.items())) if headers else ())
+        leader, result = self.single_flight.do(key, send)
+        return result if leader else copy_response(result)
+
+    def _send_request(self, url, method='GET', body=None, headers=None,
+                      silent=False, stream=False):
         request_headers = headers.copy() if headers else {}
         request_headers.update(self._default_headers)
         request_url = self._build_url(url)
+        expected = RESTClient._VERB_RESP_CODES[method.lower()]
+
+        # the caller may send its own conditional request
+        conditional = (self.validators is not None and
+                       method.lower() == 'get' and not stream and
+                       'If-None-Match' not in request_headers)
+        if conditional:
+            validator = self.validators.validator(request_url)
+            if validator:
+                request_headers['If-None-Match'] = validator
+                expected = expected + [requests.codes.not_modified]
 
         do_request = getattr(self._conn, method.lower())
-        if not silent:
-
+        # the arguments of the debug logs are costly to compute
+        debug = not silent and LOG.isEnabledFor(logging.DEBUG)
+        if debug:
             LOG.debug("REST call: %s %s. Headers: %s. Body: %s",
                       method, request_url, request_headers,
                       self._mask_password(body))
 
         ts = time.time()
-        result = do_request(
-            request_url,
-            data=body,
-            headers=request_headers)
+        if stream:
+            # the body is read by the caller
+            result = do_request(
+                request_url,
+                data=body,
+                headers=request_headers,
+                stream=True)
+        else:
+            result = do_request(
+                request_url,
+                data=body,
+                headers=request_headers)
         te = time.time()
 
-        if not silent:
+        if debug:
             LOG.debug("REST call: %s %s. Response: %s. Took %2.4f",
                       method, request_url,
-                      result.json() if result.content else '',
+                      '<streamed>' if stream else self._decode(result),
                       te - ts)
 
-        self._validate_result(
-            result, RESTClient._VERB_RESP_CODES[method.lower()],
-            _("%(verb)s %(url)s") % {'verb': method, 'url': request_url},
-            silent=silent)
+        try:
+            self._validate_result(
+                result, expected,
+                _("%(verb)s %(url)s") % {'verb': method, 'url': request_url},
+                silent=silent)
+        except Exception:
+            if stream and hasattr(result, 'close'):
+                # release the connection of the streamed response
+                result.close()
+            raise
+
+        if conditional and not self._update_validator(request_url, result):
+            # the body of the response was evicted meanwhile
+            return self._send_request(url, method=method, body=body,
+                                      headers=headers, silent=silent)
         return result
 
+    def _update_validator(self, request_url, result):
+        """Remember the validator of the response to a GET request.
+
+        A 304 Not Modified response is given the body it was validated
+        against. Return False if that body is not known anymore.
+        """
+        if result.status_code == requests.codes.not_modified:
+            content = self.validators.get(request_url)
+            if content is None:
+                return False
+            vars(result)[DECODED_BODY_ATTR] = self.codec.loads(content)
+            return True
+
+        content = result.content
+        if not content or not isinstance(content, (six.binary_type,
+                                                   six.text_type)):
+            return True
+        validator = result.headers.get('ETag')
+        if not validator:
+            try:
+                revision = self._decode(result).get('_revision')
+            except (AttributeError, ValueError):
+                revision = None
+            if revision is None:
+                self.validators.discard(request_url)
+                return True
+            validator = '"%s"' % revision
+        # the body is kept encoded, which is more compact, and decoded
+        # again for each caller
+        self.validators.put(request_url, validator, content)
+        return True
+
+    def _decode(self, result):
+        """Return the decoded body of a response, decoding it only once."""
+        cache = vars(result)
+        if DECODED_BODY_ATTR in cache:
+            return cache[DECODED_BODY_ATTR]
+        if not result.content:
+            return ''
+        if not isinstance(result.content, (six.binary_type, six.text_type)):
+            # not a JSON document, let the response decode itself
+            return result.json()
+        cache[DECODED_BODY_ATTR] = self.codec.loads(result.content)
+        return cache[DECODED_BODY_ATTR]
+
 
 class JSONRESTClient(RESTClient):
 
@@ -214,20 +552,31 @@ class JSONRESTClient(RESTClient):
 
     def __init__(self, connection, url_prefix=None,
                  default_headers=None,
-                 client_obj=None):
+                 client_obj=None,
+                 codec=None,
+                 validators=None,
+                 single_flight=None):
 
         super(JSONRESTClient, self).__init__(
             connection,
             url_prefix=url_prefix,
             default_headers=RESTClient.merge_headers(
                 JSONRESTClient._DEFAULT_HEADERS, default_headers),
-            client_obj=None)
+            client_obj=None,
+            codec=codec,
+            validators=validators,
+            single_flight=single_flight)
 
     def _rest_call(self, *args, **kwargs):
         if kwargs.get('body') is not None:
-            kwargs['body'] = jsonutils.dumps(kwargs['body'], sort_keys=True)
+            kwargs['body'] = self.codec.dumps(kwargs['body'])
         result = super(JSONRESTClient, self)._rest_call(*args, **kwargs)
-        return result.json() if result.content else result
+        if kwargs.get('stream'):
+            # decoded by the caller, from the response stream
+            return result
+        if result.content or DECODED_BODY_ATTR in vars(result):
+            return self._decode(result)
+        return result
 
 
 class NSX3Client(JSONRESTClient):
@@ -240,15 +589,30 @@ class NSX3Client(JSONRESTClient):
                  nsx_api_managers=None,
                  max_attempts=utils.DEFAULT_MAX_ATTEMPTS,
                  client_obj=None,
-                 url_path_base=NSX_V1_API_PREFIX):
+                 url_path_base=NSX_V1_API_PREFIX,
+                 codec=None,
+                 cache=None,
+                 validators=None,
+                 single_flight=None,
+                 write_queue=None,
+                 object_states=None,
+                 lookup_index=None):
 
         # If the client obj is defined - copy configuration from it
         if client_obj:
             self.nsx_api_managers = client_obj.nsx_api_managers or []
             self.max_attempts = client_obj.max_attempts
+            self.cache = client_obj.cache
+            self.write_queue = client_obj.write_queue
+            self.object_states = client_obj.object_states
+            self.lookup_index = client_obj.lookup_index
         else:
             self.nsx_api_managers = nsx_api_managers or []
             self.max_attempts = max_attempts
+            self.cache = cache
+            self.write_queue = write_queue
+            self.object_states = object_states
+            self.lookup_index = lookup_index
 
         url_prefix = url_prefix or url_path_base
         if url_prefix and url_path_base not in url_prefix:
@@ -262,7 +626,116 @@ class NSX3Client(JSONRESTClient):
         super(NSX3Client, self).__init__(
             connection, url_prefix=url_prefix,
             default_headers=default_headers,
-            client_obj=client_obj)
+            client_obj=client_obj,
+            codec=codec,
+            validators=validators,
+            single_flight=single_flight)
+
+    def new_batch(self, atomic=False, continue_on_error=True,
+                  max_requests=BATCH_MAX_REQUESTS):
+        """Return a BatchRequest whose URIs are relative to this client"""
+        return BatchRequest(self, atomic=atomic,
+                            continue_on_error=continue_on_error,
+                            max_requests=max_requests)
+
+    def _api_root_client(self):
+        """Return a client of the root of the manager API"""
+        prefix = urlparse.urlparse(self._url_prefix)
+        root = None
+        if prefix.netloc:
+            root = '%s://%s' % (prefix.scheme or 'https', prefix.netloc)
+        return self.__class__(
+            self._conn, url_prefix=root, client_obj=self,
+            url_path_base=self.NSX_V1_API_PREFIX, codec=self.codec,
+            validators=self.validators, single_flight=self.single_flight)
+
+    @property
+    def retry_budget(self):
+        """The retry budget shared by the requests of the cluster, if any"""
+        return getattr(self._conn, 'retry_budget', None)
+
+    @property
+    def cache_stats(self):
+        """The hit and miss statistics of the response cache, if any"""
+        return self.cache.as_dict() if self.cache else None
+
+    def url_get(self, url, headers=None, silent=False):
+        request_url = self._build_url(url)
+        ttl = self.cache.ttl(request_url) if self.cache else None
+        if ttl is None or headers:
+            return super(NSX3Client, self).url_get(
+                url, headers=headers, silent=silent)
+
+        result = self.cache.get(request_url)
+        if result is not None:
+            return result
+        generation = self.cache.generation
+        result = super(NSX3Client, self).url_get(
+            url, headers=headers, silent=silent)
+        if isinstance(result, (dict, list)):
+            self.cache.put(request_url, result, ttl, generation=generation)
+        return result
+
+    def get_object_state(self, url):
+        """Return the last state seen of an object, or None.
+
+        Only kept when the object state cache is enabled.
+        """
+        if self.object_states is None:
+            return None
+        return self.object_states.get(self._build_url(url))
+
+    def lookup(self, url, criteria):
+        """Look up the objects of the list url matching some criteria.
+
+        See utils.LookupIndex.lookup, the collection being listed once into
+        the lookup index. None if it is disabled.
+        """
+        if self.lookup_index is None:
+            return None
+        return self.lookup_index.lookup(
+            self._build_url(url), criteria,
+            lambda: self.iter_list(url, stream=True))
+
+    def find(self, url, attribute, value):
+        """Return the objects of the list url whose attribute has value.
+
+        None if the lookup index is disabled.
+        """
+        found = self.lookup(url, [(attribute, value)])
+        return found[0] if found is not None else None
+
+    def _rest_call(self, url, method='GET', **kwargs):
+        request_url = self._build_url(url)
+        if method in ('GET', 'HEAD') or (not self.cache and
+                                         self.object_states is None and
+                                         self.lookup_index is None):
+            result = super(NSX3Client, self)._rest_call(
+                url, method=method, **kwargs)
+        else:
+            result = None
+            failed = True
+            try:
+                result = super(NSX3Client, self)._rest_call(
+                    url, method=method, **kwargs)
+                failed = False
+            finally:
+                self._written(method, request_url, result, failed)
+        if self.object_states is not None and method not in ('HEAD',
+                                                             'DELETE'):
+            self.object_states.put(request_url, result)
+        return result
+
+    def _written(self, method, request_url, result, failed):
+        """Update the caches after a write to request_url."""
+        # even a failed write may have modified the object
+        if self.cache:
+            self.cache.invalidate(request_url)
+        if self.object_states is not None:
+            self.object_states.discard(request_url)
+        if self.lookup_index is not None:
+            self.lookup_index.write(method, request_url, result,
+                                    failed=failed)
 
     def _raise_error(self, status_code, operation, result_msg,
                      error_code=None):
@@ -272,3 +745,165 @@ class NSX3Client(JSONRESTClient):
                     operation=operation,
                     details=result_msg,
                     error_code=error_code)
+
+
+class BatchItem(object):
+    """The future result of a request of a batch."""
+
+    def __init__(self, method, uri, body=None, headers=None):
+        self.method = method
+        self.uri = uri
+        self.body = body
+        self.headers = headers
+        self.status_code = None
+        self.done = False
+        self._result = None
+        self._error = None
+
+    def set_result(self, status_code, result):
+        self.status_code = status_code
+        self._result = result
+        self.done = True
+
+    def set_error(self, error, status_code=None):
+        self.status_code = status_code
+        self._error = error
+        self.done = True
+
+    @property
+    def failed(self):
+        return self._error is not None
+
+    def result(self):
+        """Return the body of the response, or raise its error."""
+        if not self.done:
+            raise exceptions.BatchNotSubmitted(
+                operation="%s %s" % (self.method, self.uri))
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class BatchRequest(object):
+    """Groups many requests into as few calls to the batch API as possible.
+
+    Each request added returns a BatchItem, resolved by submit. The
+    requests are sent by batches of at most max_requests, the limit of the
+    NSX manager. Once a batch failed, the next ones are not sent unless
+    continue_on_error is true, and the items left fail too.
+
+    With atomic, each batch is rolled back by the NSX manager if any of its
+    requests fails. A batch request split across several batches is only
+    atomic batch by batch, so that it should not hold more than
+    max_requests requests when atomicity matters.
+    """
+
+    def __init__(self, client, atomic=False, continue_on_error=True,
+                 max_requests=BATCH_MAX_REQUESTS):
+        self._client = client
+        self.atomic = atomic
+        self.continue_on_error = continue_on_error
+        self.max_requests = max_requests
+        self.items = []
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, method, uri, body=None, headers=None):
+        item = BatchItem(method.upper(), uri, body=body, headers=headers)
+        self.items.append(item)
+        return item
+
+    def create(self, resource='', body=None, headers=None):
+        return self.add('POST', resource, body=body, headers=headers)
+
+    def update(self, uuid, body=None, headers=None):
+        return self.add('PUT', uuid, body=body, headers=headers)
+
+    def delete(self, uuid, headers=None):
+        return self.add('DELETE', uuid, headers=headers)
+
+    def _sub_request_uri(self, uri):
+        # the batch API takes URIs relative to /api, such as /v1/ip-sets
+        url = urlparse.urlparse(self._client._build_url(uri))
+        path = '/' + url.path.strip('/')
+        if path.startswith('/api/'):
+            path = path[len('/api'):]
+        return '%s?%s' % (path, url.query) if url.query else path
+
+    def _sub_request(self, item):
+        request = {'method': item.method,
+                   'uri': self._sub_request_uri(item.uri)}
+        if item.body is not None:
+            request['body'] = item.body
+        if item.headers:
+            request['headers'] = item.headers
+        return request
+
+    def submit(self):
+        """Send the requests not submitted yet, return their items."""
+        items = [item for item in self.items if not item.done]
+        api = self._client._api_root_client()
+        failed = False
+        for start in range(0, len(items), self.max_requests):
+            batch = items[start:start + self.max_requests]
+            if failed and not self.continue_on_error:
+                self._fail(batch, _("not sent as a previous batch failed"))
+                continue
+            try:
+                failed = not self._submit_batch(api, batch) or failed
+            finally:
+                for item in batch:
+                    if item.method != 'GET':
+                        self._client._written(
+                            item.method, self._client._build_url(item.uri),
+                            item._result, item.failed or not item.done)
+        return items
+
+    def _submit_batch(self, api, batch):
+        """Send a batch, return False if any of its requests failed."""
+        url = 'batch?atomic=%s' % ('true' if self.atomic else 'false')
+        try:
+            response = api.url_post(url, {
+                'continue_on_error': self.continue_on_error,
+                'requests': [self._sub_request(item) for item in batch]})
+        except exceptions.ManagerError as e:
+            for item in batch:
+                item.set_error(e)
+            return False
+
+        results = response.get('results', [])
+        for item, result in zip(batch, results):
+            status_code = result.get('code')
+            body = result.get('body')
+            if status_code in RESTClient._VERB_RESP_CODES.get(
+                    item.method.lower(), [requests.codes.ok]):
+                item.set_result(status_code, body)
+            else:
+                item.set_error(self._error(item, status_code, body),
+                               status_code=status_code)
+        if response.get('rolled_back'):
+            self._fail([item for item in batch if not item.failed],
+                       _("rolled back as a request of the batch failed"))
+        # the NSX manager stops at the first error unless continue_on_error
+        self._fail(batch[len(results):],
+                   _("not run as a previous request failed"))
+        return not any(item.failed for item in batch)
+
+    def _error(self, item, status_code, body):
+        error_code = None
+        details = body
+        if isinstance(body, dict) and 'error_message' in body:
+            error_code = body.get('error_code')
+            details = body['error_message']
+        error = http_error_to_exception(status_code, error_code)
+        return error(manager=self._client.nsx_api_managers,
+                     operation="%s %s" % (item.method, item.uri),
+                     details=details, error_code=error_code)
+
+    def _fail(self, items, details):
+        for item in items:
+            item.set_error(exceptions.ManagerError(
+                manager=self._client.nsx_api_managers,
+                operation="%s %s" % (item.method, item.uri),
+                details=details))
@@ -14,27 +14,39 @@
 #    under the License.
 #
 import abc
+import collections
 import contextlib
 import copy
 import datetime
+import email.utils
+import functools
 import itertools
 import logging
+import os
+import random
+import ssl
+import time
+import weakref
 
 import eventlet
 from eventlet import greenpool
 from eventlet import pools
+from eventlet import queue
 import OpenSSL
 from oslo_log import log
 from oslo_service import loopingcall
 import requests
 from requests import adapters
 from requests import exceptions as requests_exceptions
+from requests.packages.urllib3 import exceptions as urllib3_exceptions
+from requests.packages.urllib3.util import retry as urllib3_retry
 import six
 import six.moves.urllib.parse as urlparse
 
 from vmware_nsxlib._i18n import _
 from vmware_nsxlib.v3 import client as nsx_client
 from vmware_nsxlib.v3 import exceptions
+from vmware_nsxlib.v3 import utils
 
 
 LOG = log.getLogger(__name__)
@@ -82,6 +94,53 @@ class AbstractHTTPProvider(object):
         Return True if it's a connection exception and False otherwise.
         """
 
+    def is_timeout_exception(self, exception):
+        """Determine if the given exception is a response timeout.
+
+        Return True if the endpoint accepted the request but did not
+        respond in time, and False otherwise.
+        """
+        return False
+
+
+def keepalive_probe(nsxlib_config):
+    """Return the HTTP method and uri used to probe an endpoint."""
+    method = (nsxlib_config.keepalive_probe_method or 'GET').upper()
+    uri = (nsxlib_config.keepalive_probe_uri or
+           nsxlib_config.keepalive_section)
+    return method, uri
+
+
+def validate_probe_result(endpoint, method, uri, result):
+    if method == 'HEAD':
+        # a successful status is all a HEAD can tell
+        return
+    # If keeplive section returns a list, it is assumed to be non-empty
+    if not result or result.get('result_count', 1) <= 0:
+        msg = _("No %(section)s found "
+                "for '%(url)s'") % {'section': uri,
+                                    'url': endpoint.provider.url}
+        LOG.warning(msg)
+        raise exceptions.ResourceNotFound(
+            manager=endpoint.provider.url, operation=msg)
+
+
+def ssl_context(nsxlib_config, provider):
+    """Return a ssl context for the connections to a NSX manager."""
+    if nsxlib_config.insecure:
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    else:
+        context = ssl.create_default_context(cafile=provider.ca_file)
+
+    if nsxlib_config.client_cert_provider:
+        # the cert file is only available inside the provider context,
+        # load it into the ssl context before it gets disposed
+        with nsxlib_config.client_cert_provider as cert_provider:
+            context.load_cert_chain(cert_provider.filename())
+    return context
+
 
 class TimeoutSession(requests.Session):
     """Extends requests.Session to support timeout at the session level."""
@@ -139,6 +198,30 @@ class TimeoutSession(requests.Session):
         return ret
 
 
+class BudgetedRetry(urllib3_retry.Retry):
+    """urllib3 retry configuration drawing each retry from a RetryBudget."""
+
+    def __init__(self, *args, **kwargs):
+        self.budget = kwargs.pop('budget', None)
+        super(BudgetedRetry, self).__init__(*args, **kwargs)
+
+    def new(self, **kw):
+        new_retry = super(BudgetedRetry, self).new(**kw)
+        new_retry.budget = self.budget
+        return new_retry
+
+    def increment(self, method=None, url=None, response=None, error=None,
+                  _pool=None, _stacktrace=None):
+        new_retry = super(BudgetedRetry, self).increment(
+            method=method, url=url, response=response, error=error,
+            _pool=_pool, _stacktrace=_stacktrace)
+        if self.budget and not self.budget.acquire():
+            raise urllib3_exceptions.MaxRetryError(
+                _pool, url, error or urllib3_exceptions.ResponseError(
+                    'retry budget exhausted'))
+        return new_retry
+
+
 class NSXRequestsHTTPProvider(AbstractHTTPProvider):
     """Concrete implementation of AbstractHTTPProvider.
 
@@ -153,16 +236,9 @@ class NSXRequestsHTTPProvider(AbstractHTTPProvider):
         client = nsx_client.NSX3Client(
             conn, url_prefix=endpoint.provider.url,
             url_path_base=cluster_api.nsxlib_config.url_base)
-        keepalive_section = cluster_api.nsxlib_config.keepalive_section
-        result = client.get(keepalive_section, silent=True)
-        # If keeplive section returns a list, it is assumed to be non-empty
-        if not result or result.get('result_count', 1) <= 0:
-            msg = _("No %(section)s found "
-                    "for '%(url)s'") % {'section': keepalive_section,
-                                        'url': endpoint.provider.url}
-            LOG.warning(msg)
-            raise exceptions.ResourceNotFound(
-                manager=endpoint.provider.url, operation=msg)
+        method, uri = keepalive_probe(cluster_api.nsxlib_config)
+        result = client._rest_call(uri, method=method, silent=True)
+        validate_probe_result(endpoint, method, uri, result)
 
     def new_connection(self, cluster_api, provider):
         config = cluster_api.nsxlib_config
@@ -181,10 +257,15 @@ class NSXRequestsHTTPProvider(AbstractHTTPProvider):
             # verify using the said ca bundle path
             session.verify = provider.ca_file
 
+        max_retries = config.retries
+        if cluster_api.retry_budget:
+            max_retries = BudgetedRetry(total=config.retries, redirect=None,
+                                        budget=cluster_api.retry_budget)
+
         # we are pooling with eventlet in the cluster class
         adapter = adapters.HTTPAdapter(
             pool_connections=1, pool_maxsize=1,
-            max_retries=config.retries,
+            max_retries=max_retries,
             pool_block=False)
         session.mount('http://', adapter)
         session.mount('https://', adapter)
@@ -194,6 +275,9 @@ class NSXRequestsHTTPProvider(AbstractHTTPProvider):
     def is_connection_exception(self, exception):
         return isinstance(exception, requests_exceptions.ConnectionError)
 
+    def is_timeout_exception(self, exception):
+        return isinstance(exception, requests_exceptions.ReadTimeout)
+
 
 class ClusterHealth(object):
     """Indicator of overall cluster health.
@@ -218,6 +302,223 @@ class EndpointState(object):
     DOWN = 'DOWN'
 
 
+class CircuitBreakerState(object):
+    """The states of an endpoint circuit breaker."""
+    # requests flow to the endpoint
+    CLOSED = 'CLOSED'
+    # the endpoint failed and is left alone until its backoff expires
+    OPEN = 'OPEN'
+    # the backoff expired and a few trial requests are let through
+    HALF_OPEN = 'HALF_OPEN'
+
+
+class CircuitBreaker(object):
+    """Per endpoint circuit breaker.
+
+    The failures open the breaker once their rate over a sliding window of
+    the latest outcomes reaches failure_rate, or once the rate of the hard
+    failures alone (the endpoint can't be connected to) reaches the lower
+    hard_failure_rate. Soft failures are read timeouts and overloaded
+    manager responses. Half a window of outcomes is needed to open it, so
+    that an isolated failure doesn't take an endpoint out of service.
+
+    An open breaker is closed again only after a backoff, exponential in
+    the number of consecutive trips and jittered so that the workers of
+    a cluster don't probe in lockstep, and a successful trial request in
+    the half-open state. At most half_open_requests trial requests are
+    in flight at a time.
+    """
+
+    def __init__(self, failure_rate=0.5, window_size=10,
+                 backoff=1, max_backoff=60, half_open_requests=1,
+                 hard_failure_rate=0.3):
+        self.failure_rate = failure_rate
+        self.hard_failure_rate = min(hard_failure_rate, failure_rate)
+        self.window_size = window_size
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.half_open_requests = half_open_requests
+        # latest outcomes, None for successes, else whether the failure was
+        # hard
+        self._window = collections.deque(maxlen=window_size)
+        self._state = CircuitBreakerState.CLOSED
+        self._trips = 0
+        self._successes = 0
+        self._retry_at = 0
+        self._trials = 0
+
+    @property
+    def state(self):
+        if (self._state == CircuitBreakerState.OPEN and
+                time.time() >= self._retry_at):
+            self._state = CircuitBreakerState.HALF_OPEN
+            self._trials = 0
+        return self._state
+
+    @property
+    def trips(self):
+        return self._trips
+
+    def retry_in(self):
+        """Seconds left before the next trial, 0 unless open."""
+        if self.state != CircuitBreakerState.OPEN:
+            return 0
+        return max(self._retry_at - time.time(), 0)
+
+    def trial_available(self):
+        return (self.state == CircuitBreakerState.HALF_OPEN and
+                self._trials < self.half_open_requests)
+
+    def start_trial(self):
+        self._trials += 1
+
+    def end_trial(self):
+        self._trials = max(self._trials - 1, 0)
+
+    def _open(self):
+        self._trips += 1
+        delay = min(self.backoff * 2 ** (self._trips - 1), self.max_backoff)
+        # equal jitter: wait at least half of the backoff
+        delay = delay / 2.0 + random.uniform(0, delay / 2.0)
+        self._retry_at = time.time() + delay
+        self._state = CircuitBreakerState.OPEN
+        self._successes = 0
+
+    def record_success(self):
+        self._window.append(None)
+        if self.state == CircuitBreakerState.HALF_OPEN:
+            self.end_trial()
+            self._state = CircuitBreakerState.CLOSED
+        if self._state == CircuitBreakerState.CLOSED:
+            self._successes += 1
+            if self._successes >= self.window_size:
+                # healthy for a whole window, forget about past trips
+                self._trips = 0
+
+    def record_failure(self, hard=True):
+        """Record a failure, return True if it opened the breaker."""
+        self._window.append(bool(hard))
+        state = self.state
+        if state == CircuitBreakerState.OPEN:
+            return False
+        if state == CircuitBreakerState.HALF_OPEN:
+            self.end_trial()
+            self._open()
+            return True
+        self._successes = 0
+        outcomes = len(self._window)
+        if outcomes < self.window_size // 2:
+            return False
+        failures = len([hard for hard in self._window if hard is not None])
+        hard_failures = len([hard for hard in self._window if hard])
+        if (failures >= self.failure_rate * outcomes or
+                hard_failures >= self.hard_failure_rate * outcomes):
+            self._open()
+            return True
+        return False
+
+
+class ConcurrencyLimiter(object):
+    """Adaptive limit of the concurrent requests sent to an endpoint.
+
+    Additive increase / multiplicative decrease: the limit grows by one
+    after a whole limit of successful responses, and is cut by
+    `backoff_ratio` when the endpoint throttles requests (429 or 503), or
+    when its short term latency rises above `latency_tolerance` times its
+    long term latency. The limit is decreased at most once per
+    DECREASE_INTERVAL, since a burst of overload signals all reflect the
+    same limit.
+    """
+
+    DECREASE_INTERVAL = 1
+    # weight of the newest sample in the short and long term latencies
+    LATENCY_DECAY = 0.3
+    BASELINE_DECAY = 0.01
+    # latency rises smaller than this are noise, in seconds
+    LATENCY_SLACK = 0.1
+
+    def __init__(self, max_limit, min_limit=1, backoff_ratio=0.5,
+                 latency_tolerance=2.0):
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.backoff_ratio = backoff_ratio
+        self.latency_tolerance = latency_tolerance
+        self.decreases = 0
+        self._limit = float(max_limit)
+        self._latency = None
+        self._baseline = None
+        self._decreased_at = 0
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def _increase(self):
+        self._limit = min(self._limit + 1.0 / self._limit, self.max_limit)
+
+    def _decrease(self):
+        now = time.time()
+        if now - self._decreased_at < self.DECREASE_INTERVAL:
+            return
+        self._decreased_at = now
+        self._limit = max(self._limit * self.backoff_ratio, self.min_limit)
+        self.decreases += 1
+
+    def record_latency(self, latency):
+        if self._latency is None:
+            self._latency = self._baseline = latency
+        self._latency += (latency - self._latency) * self.LATENCY_DECAY
+        self._baseline += (latency - self._baseline) * self.BASELINE_DECAY
+        if (self._latency > self._baseline * self.latency_tolerance and
+                self._latency > self._baseline + self.LATENCY_SLACK):
+            self._decrease()
+        else:
+            self._increase()
+
+    def record_overload(self):
+        self._decrease()
+
+
+class HedgePolicy(object):
+    """When to hedge a GET request, and how many hedges are allowed.
+
+    A GET still in flight after the latency percentile of its endpoint is
+    duplicated to another endpoint, the first response winning. Every
+    hedgeable request deposits a ratio of a token in a budget, and each
+    hedge withdraws a whole one, so that hedging adds at most that ratio of
+    requests to the cluster load.
+    """
+
+    # latency samples required before hedging the requests of an endpoint
+    MIN_SAMPLES = 20
+    # minimum delay in seconds before hedging, so that an endpoint with a
+    # null latency percentile does not get every request duplicated
+    MIN_DELAY = 0.01
+
+    def __init__(self, percentile=95, ratio=0.1, max_tokens=10):
+        self.percentile = percentile
+        self.budget = utils.RetryBudget(ratio=ratio, min_retries_per_second=0,
+                                        max_tokens=max_tokens, name='Hedge')
+        # hedged requests answered by the hedge rather than the original
+        self.wins = 0
+
+    def delay(self, endpoint):
+        """Return how long to wait before hedging, None to never hedge."""
+        if endpoint.state != EndpointState.UP:
+            return None
+        delay = endpoint.latency_percentile(self.percentile,
+                                            min_samples=self.MIN_SAMPLES)
+        if delay is None:
+            return None
+        return max(delay, self.MIN_DELAY)
+
+    def as_dict(self):
+        return {'requests': self.budget.requests,
+                'hedges': self.budget.retries,
+                'hedges_denied': self.budget.retries_denied,
+                'wins': self.wins}
+
+
 class Provider(object):
     """Data holder for a provider
 
@@ -235,6 +536,40 @@ class Provider(object):
         return str(self.url)
 
 
+class EndpointStats(object):
+    """Counters of the traffic used to assess an endpoint health.
+
+    Successful responses to real requests prove the endpoint is alive, and
+    postpone the next keepalive probe; probes are only sent to idle or
+    DOWN endpoints.
+    """
+
+    def __init__(self):
+        # responses to proxied requests
+        self.responses = 0
+        # keepalive probes sent, and how many of them failed
+        self.probes = 0
+        self.probe_failures = 0
+        # latency of the last successful probe in seconds
+        self.last_probe_latency = None
+
+    def record_response(self):
+        self.responses += 1
+
+    def record_probe(self, latency=None, failed=False):
+        self.probes += 1
+        if failed:
+            self.probe_failures += 1
+        else:
+            self.last_probe_latency = latency
+
+    def as_dict(self):
+        return {'responses': self.responses,
+                'probes': self.probes,
+                'probe_failures': self.probe_failures,
+                'last_probe_latency': self.last_probe_latency}
+
+
 class Endpoint(object):
     """A single NSX manager endpoint (host).
 
@@ -245,11 +580,54 @@ class Endpoint(object):
     to the underlying connections.
     """
 
-    def __init__(self, provider, pool):
+    # weight of the newest sample in the latency moving average
+    LATENCY_DECAY = 0.3
+    # number of recent latency samples kept for the percentiles
+    LATENCY_WINDOW = 100
+
+    def __init__(self, provider, pool, breaker=None, limiter=None):
         self.provider = provider
         self.pool = pool
+        self.breaker = breaker or CircuitBreaker()
+        self.limiter = limiter
         self._state = EndpointState.INITIALIZED
         self._last_updated = datetime.datetime.now()
+        # requests currently proxied to this endpoint
+        self.outstanding = 0
+        # exponentially weighted moving average of the request latency
+        # in seconds, None until the first response
+        self.latency = None
+        self.latencies = collections.deque(maxlen=self.LATENCY_WINDOW)
+        self.stats = EndpointStats()
+
+    def record_latency(self, latency):
+        self.latencies.append(latency)
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = (self.LATENCY_DECAY * latency +
+                            (1 - self.LATENCY_DECAY) * self.latency)
+
+    def latency_percentile(self, percentile, min_samples=1):
+        """Return the percentile of the recent request latencies.
+
+        None if fewer than min_samples requests completed.
+        """
+        if len(self.latencies) < max(min_samples, 1):
+            return None
+        latencies = sorted(self.latencies)
+        index = int(round(percentile / 100.0 * len(latencies))) - 1
+        return latencies[min(max(index, 0), len(latencies) - 1)]
+
+    def set_concurrency(self, limit):
+        """Resize the connection pool to at most limit connections."""
+        if self.pool.max_size != limit:
+            LOG.info("Endpoint '%(ep)s' concurrency limit changing from "
+                     "%(old)s to %(new)s",
+                     {'ep': self.provider, 'old': self.pool.max_size,
+                      'new': limit})
+            # connections above the new size are dropped as they return
+            self.pool.resize(limit)
 
     def regenerate_pool(self):
         self.pool = pools.Pool(min_size=self.pool.min_size,
@@ -265,6 +643,17 @@ class Endpoint(object):
     def state(self):
         return self._state
 
+    @property
+    def available(self):
+        """Whether the endpoint can be handed a new request.
+
+        UP endpoints are, as well as DOWN ones whose circuit breaker
+        allows another trial request.
+        """
+        return (self._state == EndpointState.UP or
+                (self._state == EndpointState.DOWN and
+                 self.breaker.trial_available()))
+
     def set_state(self, state):
         if self.state != state:
             LOG.info("Endpoint '%(ep)s' changing from state"
@@ -283,6 +672,162 @@ class Endpoint(object):
         return "[%s] %s" % (self.state, self.provider)
 
 
+# responses of an overloaded manager, soft failures of the endpoint
+SOFT_FAILURE_STATUS_CODES = (requests.codes.BAD_GATEWAY,
+                             requests.codes.SERVICE_UNAVAILABLE,
+                             requests.codes.GATEWAY_TIMEOUT)
+
+# responses of a manager throttling requests, retried after a delay
+THROTTLE_STATUS_CODES = (requests.codes.TOO_MANY_REQUESTS,
+                         requests.codes.SERVICE_UNAVAILABLE)
+# delays in seconds between retries of throttled requests, when the
+# response has no Retry-After header
+THROTTLE_BACKOFF = 0.5
+THROTTLE_MAX_DELAY = 60
+
+
+def get_retry_after(response):
+    """Return the delay in seconds requested by a Retry-After header."""
+    value = (getattr(response, 'headers', None) or {}).get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        date = email.utils.parsedate_tz(value)
+        if date:
+            return max(email.utils.mktime_tz(date) - time.time(), 0)
+
+
+def _close_response(response):
+    """Close a response not returned, releasing its connection if held."""
+    close = getattr(response, 'close', None)
+    if close:
+        try:
+            close()
+        except Exception as e:
+            LOG.debug("Failed to close response: %s", e)
+
+
+def throttle_delay(response, attempt):
+    """Return the delay before retrying a throttled request.
+
+    The Retry-After header of the response is honored, otherwise the delay
+    is a jittered exponential backoff of the attempt number.
+    """
+    delay = get_retry_after(response)
+    if delay is None:
+        delay = random.uniform(0, THROTTLE_BACKOFF * 2 ** attempt)
+    return min(delay, THROTTLE_MAX_DELAY)
+
+
+SCHEDULER_ROUND_ROBIN = 'round-robin'
+SCHEDULER_LEAST_OUTSTANDING = 'least-outstanding'
+SCHEDULER_EWMA_LATENCY = 'ewma-latency'
+SCHEDULER_POWER_OF_TWO = 'power-of-two'
+
+
+@six.add_metaclass(abc.ABCMeta)
+class EndpointScheduler(object):
+    """Interface for the policies choosing the endpoint of a request."""
+
+    def __init__(self, endpoints):
+        self._endpoints = list(endpoints)
+        self._schedule = itertools.cycle(self._endpoints)
+
+    def _up_endpoints(self):
+        # all the available endpoints, rotated so that ties are broken in
+        # a round robin fashion
+        up = []
+        for i in range(len(self._endpoints)):
+            endpoint = next(self._schedule)
+            if endpoint.available:
+                up.append(endpoint)
+        if up:
+            # advance the rotation by one for the next selection
+            next(self._schedule)
+        return up
+
+    @abc.abstractmethod
+    def select(self):
+        """Return an available endpoint to service a request, or None."""
+        pass
+
+
+class RoundRobinScheduler(EndpointScheduler):
+    """Service requests using round robin over the UP endpoints."""
+
+    def select(self):
+        # check for UP state until exhausting all endpoints
+        seen, total = 0, len(self._endpoints)
+        while seen < total:
+            endpoint = next(self._schedule)
+            if endpoint.available:
+                return endpoint
+            seen += 1
+
+
+class LeastOutstandingScheduler(EndpointScheduler):
+    """Pick the UP endpoint with the fewest requests in flight."""
+
+    def select(self):
+        up = self._up_endpoints()
+        if up:
+            return min(up, key=lambda ep: ep.outstanding)
+
+
+class EwmaLatencyScheduler(EndpointScheduler):
+    """Pick the UP endpoint with the lowest expected completion time.
+
+    The cost of an endpoint is its latency moving average weighted by the
+    requests it already has in flight. Endpoints without any latency
+    sample yet are preferred so that they get measured.
+    """
+
+    @staticmethod
+    def _cost(endpoint):
+        return (endpoint.latency or 0.0) * (endpoint.outstanding + 1)
+
+    def select(self):
+        up = self._up_endpoints()
+        if up:
+            return min(up, key=self._cost)
+
+
+class PowerOfTwoScheduler(EndpointScheduler):
+    """Pick the less loaded out of 2 random UP endpoints.
+
+    Load is measured by the requests in flight, with the latency moving
+    average breaking ties.
+    """
+
+    def select(self):
+        up = self._up_endpoints()
+        if len(up) <= 1:
+            return up[0] if up else None
+        return min(random.sample(up, 2),
+                   key=lambda ep: (ep.outstanding, ep.latency or 0.0))
+
+
+SCHEDULERS = {
+    SCHEDULER_ROUND_ROBIN: RoundRobinScheduler,
+    SCHEDULER_LEAST_OUTSTANDING: LeastOutstandingScheduler,
+    SCHEDULER_EWMA_LATENCY: EwmaLatencyScheduler,
+    SCHEDULER_POWER_OF_TWO: PowerOfTwoScheduler,
+}
+
+
+def get_scheduler(name, endpoints):
+    """Build the scheduler registered under the said name."""
+    try:
+        scheduler_class = SCHEDULERS[name or SCHEDULER_ROUND_ROBIN]
+    except KeyError:
+        raise exceptions.InvalidInput(operation="Endpoint scheduling",
+                                      arg_name="endpoint_scheduler",
+                                      arg_val=name)
+    return scheduler_class(endpoints)
+
+
 class EndpointConnection(object):
     """Simple data holder
 
@@ -294,6 +839,135 @@ class EndpointConnection(object):
         self.connection = connection
 
 
+class StreamedResponse(object):
+    """A streamed response, holding its pooled connection until read.
+
+    The connection goes back to the endpoint pool once the body was read to
+    the end or the response closed, when the request is accounted for. A
+    body read through the raw stream is only accounted for once the
+    response is closed, or else garbage collected.
+    """
+
+    _ITER_BODY = ('iter_content', 'iter_bytes', 'iter_lines', 'iter_text')
+
+    def __init__(self, response, release):
+        self._response = response
+        self._release = release
+
+    def __getattr__(self, name):
+        attr = getattr(self._response, name)
+        if name in self._ITER_BODY:
+            return functools.partial(self._iter_body, attr)
+        if name == 'json':
+            return functools.partial(self._read_body, attr)
+        return attr
+
+    def _iter_body(self, iter_body, *args, **kwargs):
+        try:
+            for chunk in iter_body(*args, **kwargs):
+                yield chunk
+        finally:
+            self.close()
+
+    def _read_body(self, read_body, *args, **kwargs):
+        try:
+            return read_body(*args, **kwargs)
+        finally:
+            self.close()
+
+    @property
+    def content(self):
+        return self._read_body(lambda: self._response.content)
+
+    @property
+    def text(self):
+        return self._read_body(lambda: self._response.text)
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        release, self._release = self.__dict__.get('_release'), None
+        if release is None:
+            return
+        try:
+            close = getattr(self._response, 'close', None)
+            if close:
+                close()
+        finally:
+            release()
+
+
+class ConnectionInfo(object):
+    """Bookkeeping of a connection to an endpoint."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.created = time.time()
+        self.last_used = None
+        self.requests = 0
+        self.retired = False
+
+    def as_dict(self):
+        return {'endpoint': str(self.endpoint.provider),
+                'created': self.created,
+                'last_used': self.last_used,
+                'requests': self.requests,
+                'retired': self.retired}
+
+
+class ConnectionRegistry(object):
+    """Maps the connections of a cluster to their endpoint and usage.
+
+    Connections are weakly referenced, so the ones dropped by a pool
+    leave the registry. A connection expires once it is older than
+    `max_age` seconds, it served `max_requests` requests, or it was
+    retired; expired connections are replaced one at a time as they
+    are checked out of their pool.
+    """
+
+    def __init__(self, max_age=None, max_requests=None):
+        self.max_age = max_age
+        self.max_requests = max_requests
+        self._connections = weakref.WeakKeyDictionary()
+
+    def register(self, conn, endpoint):
+        info = ConnectionInfo(endpoint)
+        self._connections[conn] = info
+        return info
+
+    def lookup(self, conn):
+        return self._connections.get(conn)
+
+    def record_use(self, conn):
+        info = self._connections.get(conn)
+        if info:
+            info.last_used = time.time()
+            info.requests += 1
+
+    def expired(self, conn):
+        info = self._connections.get(conn)
+        if not info:
+            return False
+        return (info.retired or
+                (self.max_requests is not None and
+                 info.requests >= self.max_requests) or
+                (self.max_age is not None and
+                 time.time() - info.created >= self.max_age))
+
+    def retire_endpoint(self, endpoint):
+        """Expire all the current connections of the endpoint."""
+        for info in list(self._connections.values()):
+            if info.endpoint is endpoint:
+                info.retired = True
+
+    def remove(self, conn):
+        self._connections.pop(conn, None)
+
+    def __len__(self):
+        return len(self._connections)
+
+
 class ClusteredAPI(object):
     """Duck types the major HTTP based methods of a requests.Session
 
@@ -302,15 +976,38 @@ class ClusteredAPI(object):
     its managed NSX manager endpoints.
     """
     _HTTP_VERBS = ['get', 'delete', 'head', 'put', 'post', 'patch', 'create']
+    # seconds between checks of the endpoints validated at initialization
+    _INIT_WAIT_INTERVAL = 0.1
 
     def __init__(self, providers,
                  http_provider,
                  min_conns_per_pool=1,
                  max_conns_per_pool=500,
-                 keepalive_interval=33):
+                 keepalive_interval=33,
+                 scheduler=SCHEDULER_ROUND_ROBIN,
+                 circuit_breaker_opts=None,
+                 retry_budget_opts=None,
+                 concurrency_limiter_opts=None,
+                 throttle_retries=0,
+                 connection_max_age=None,
+                 connection_max_requests=None,
+                 hedge_opts=None,
+                 lazy_init=False):
 
         self._http_provider = http_provider
+        self._connection_max_age = connection_max_age
+        self._connection_max_requests = connection_max_requests
         self._keepalive_interval = keepalive_interval
+        self._scheduler_name = scheduler
+        self._circuit_breaker_opts = circuit_breaker_opts or {}
+        self._concurrency_limiter_opts = concurrency_limiter_opts
+        self._throttle_retries = throttle_retries
+        self._retry_budget = (utils.RetryBudget(**retry_budget_opts)
+                              if retry_budget_opts else None)
+        self._hedge_policy = (HedgePolicy(**hedge_opts)
+                              if hedge_opts else None)
+        self._lazy_init = lazy_init
+        self._keepalive_loops = []
 
         def _init_cluster(*args, **kwargs):
             self._init_endpoints(providers,
@@ -320,67 +1017,137 @@ class ClusteredAPI(object):
 
         # keep this internal method for reinitialize upon fork
         # for api workers to ensure each process has its own keepalive
-        # loops + state
+        # loops + state. A fork is also detected by the first request
+        # of the child process.
         self._reinit_cluster = _init_cluster
 
     def _init_endpoints(self, providers,
                         min_conns_per_pool, max_conns_per_pool):
         LOG.debug("Initializing API endpoints")
-
-        def _create_conn(p):
+        # the process owning the endpoints, connections and keepalive loops
+        self._pid = os.getpid()
+        for loop in self._keepalive_loops:
+            # the loops of the parent process, or of a previous init
+            loop.stop()
+        self._keepalive_loops = []
+
+        def _create_conn(endpoint):
             def _conn():
                 # called when a pool needs to create a new connection
-                return self._http_provider.new_connection(self, p)
+                conn = self._http_provider.new_connection(
+                    self, endpoint.provider)
+                self._connections.register(conn, endpoint)
+                return conn
 
             return _conn
 
+        self._connections = ConnectionRegistry(
+            max_age=self._connection_max_age,
+            max_requests=self._connection_max_requests)
         self._endpoints = {}
         for provider in providers:
-            pool = pools.Pool(
+            endpoint = Endpoint(
+                provider, None,
+                breaker=CircuitBreaker(**self._circuit_breaker_opts),
+                limiter=self._new_limiter(max_conns_per_pool))
+            endpoint.pool = pools.Pool(
                 min_size=min_conns_per_pool,
                 max_size=max_conns_per_pool,
                 order_as_stack=True,
-                create=_create_conn(provider))
-
-            endpoint = Endpoint(provider, pool)
+                create=_create_conn(endpoint))
             self._endpoints[provider.id] = endpoint
 
-        # service requests using round robin
-        self._endpoint_schedule = itertools.cycle(self._endpoints.values())
+        self._scheduler = get_scheduler(self._scheduler_name,
+                                        self._endpoints.values())
 
         # duck type to proxy http invocations
         for method in ClusteredAPI._HTTP_VERBS:
             setattr(self, method, self._proxy_stub(method))
 
-        conns = greenpool.GreenPool()
+        self._validations = greenpool.GreenPool()
         for endpoint in self._endpoints.values():
-            conns.spawn(self._validate, endpoint)
+            self._validations.spawn(self._validate, endpoint)
+
+        if self._lazy_init:
+            # the first request waits for the validation instead
+            eventlet.spawn_n(self._start_keepalive)
+            LOG.debug("Validating API endpoint(s) in the background")
+            return
+        self._wait_for_endpoints()
+        self._start_keepalive()
+
+        LOG.debug("Done initializing API endpoint(s). "
+                  "API cluster health: %s", self.health)
+
+    def _wait_for_endpoints(self):
+        """Wait until an endpoint is UP, or all of them were validated."""
+        validations = self._validations
+        if validations is None:
+            return
         eventlet.sleep(0)
-        while conns.running():
+        while validations.running():
             if (self.health == ClusterHealth.GREEN
                     or self.health == ClusterHealth.ORANGE):
                 # only wait for 1 or more endpoints to reduce init time
                 break
-            eventlet.sleep(0.5)
+            eventlet.sleep(self._INIT_WAIT_INTERVAL)
+        if validations is self._validations:
+            self._validations = None
 
+    def _start_keepalive(self):
+        self._wait_for_endpoints()
         for endpoint in self._endpoints.values():
             # dynamic loop for each endpoint to ensure connectivity
             loop = loopingcall.DynamicLoopingCall(
                 self._endpoint_keepalive, endpoint)
-            loop.start(initial_delay=self._keepalive_interval,
-                       periodic_interval_max=self._keepalive_interval,
+            loop.start(initial_delay=self._keepalive_delay(endpoint),
+                       periodic_interval_max=max(
+                           self._keepalive_interval,
+                           endpoint.breaker.max_backoff),
                        stop_on_exception=False)
+            self._keepalive_loops.append(loop)
+
+    def _ensure_initialized(self):
+        """Reinitialize after a fork, and wait for a lazy initialization."""
+        if self._pid != os.getpid():
+            LOG.info("API cluster forked from process %(parent)s, "
+                     "reinitializing it in process %(pid)s",
+                     {'parent': self._pid, 'pid': os.getpid()})
+            self._reinit_cluster()
+        self._wait_for_endpoints()
+
+    def _new_limiter(self, max_conns_per_pool):
+        if self._concurrency_limiter_opts is None:
+            return None
+        return ConcurrencyLimiter(max_conns_per_pool,
+                                  **self._concurrency_limiter_opts)
+
+    def _keepalive_due(self, endpoint):
+        breaker_state = endpoint.breaker.state
+        if breaker_state == CircuitBreakerState.OPEN:
+            # back off before probing an endpoint which failed
+            return False
+        if breaker_state == CircuitBreakerState.HALF_OPEN:
+            # the probe is a trial of the endpoint
+            return True
+        # any response to a proxied request refreshes last_updated, so
+        # endpoints serving traffic are not probed
+        delta = datetime.datetime.now() - endpoint.last_updated
+        return delta.seconds >= self._keepalive_interval
 
-        LOG.debug("Done initializing API endpoint(s). "
-                  "API cluster health: %s", self.health)
+    def _keepalive_delay(self, endpoint, validated=False):
+        if endpoint.breaker.state == CircuitBreakerState.OPEN:
+            return endpoint.breaker.retry_in()
+        if validated:
+            return self._keepalive_interval
+        delta = datetime.datetime.now() - endpoint.last_updated
+        return max(self._keepalive_interval - delta.seconds, 0)
 
     def _endpoint_keepalive(self, endpoint):
-        delta = datetime.datetime.now() - endpoint.last_updated
-        if delta.seconds >= self._keepalive_interval:
-            # TODO(boden): backoff on validation failure
+        validated = self._keepalive_due(endpoint)
+        if validated:
             self._validate(endpoint)
-            return self._keepalive_interval
-        return self._keepalive_interval - delta.seconds
+        return self._keepalive_delay(endpoint, validated=validated)
 
     @property
     def providers(self):
@@ -394,6 +1161,29 @@ class ClusteredAPI(object):
     def http_provider(self):
         return self._http_provider
 
+    @property
+    def retry_budget(self):
+        return self._retry_budget
+
+    @property
+    def retry_budget_stats(self):
+        """Retry budget counters, or None if retries are not budgeted."""
+        return self._retry_budget.as_dict() if self._retry_budget else None
+
+    @property
+    def hedge_stats(self):
+        """Hedged GET counters, or None if GET requests are not hedged."""
+        return self._hedge_policy.as_dict() if self._hedge_policy else None
+
+    def _retry_allowed(self):
+        return not self._retry_budget or self._retry_budget.acquire()
+
+    @property
+    def endpoint_stats(self):
+        """Health traffic counters of each endpoint, by provider id."""
+        return dict((provider_id, endpoint.stats.as_dict())
+                    for provider_id, endpoint in self._endpoints.items())
+
     @property
     def health(self):
         down = 0
@@ -410,38 +1200,110 @@ class ClusteredAPI(object):
                 if up == len(self._endpoints)
                 else ClusterHealth.ORANGE)
 
+    @contextlib.contextmanager
+    def _checkout(self, endpoint):
+        """Check a connection out of the endpoint pool.
+
+        An expired connection is closed and replaced with a new one, so
+        connections are renewed one at a time rather than by rebuilding
+        the pool.
+        """
+        # pool.get() will wait if pool has 0 free
+        conn = endpoint.pool.get()
+        try:
+            if self._connections.expired(conn):
+                LOG.debug("Replacing expired connection %(info)s",
+                          {'info': self._connections.lookup(conn).as_dict()})
+                new_conn = endpoint.pool.create()
+                self._retire_connection(conn)
+                conn = new_conn
+            self._connections.record_use(conn)
+            yield conn
+        finally:
+            endpoint.pool.put(conn)
+
+    def _retire_connection(self, conn):
+        self._connections.remove(conn)
+        close = getattr(conn, 'close', None)
+        if close:
+            try:
+                close()
+            except Exception as e:
+                LOG.debug("Failed to close retired connection: %s", e)
+
+    def connection_info(self, conn):
+        """Return the ConnectionInfo of a connection, or None."""
+        return self._connections.lookup(conn)
+
     def _validate(self, endpoint):
         try:
-            with endpoint.pool.item() as conn:
+            with self._checkout(endpoint) as conn:
+                ts = time.time()
                 self._http_provider.validate_connection(self, endpoint, conn)
+                endpoint.stats.record_probe(latency=time.time() - ts)
+                endpoint.breaker.record_success()
                 endpoint.set_state(EndpointState.UP)
         except exceptions.ClientCertificateNotTrusted:
+            endpoint.stats.record_probe(failed=True)
             LOG.warning("Failed to validate API cluster endpoint "
                         "'%(ep)s' due to untrusted client certificate",
                         {'ep': endpoint})
-            # regenerate connection pool based on new certificate
-            endpoint.regenerate_pool()
+            # renew the connections based on new certificate
+            self._connections.retire_endpoint(endpoint)
         except Exception as e:
+            endpoint.stats.record_probe(failed=True)
+            endpoint.breaker.record_failure()
             endpoint.set_state(EndpointState.DOWN)
             LOG.warning("Failed to validate API cluster endpoint "
                         "'%(ep)s' due to: %(err)s",
                         {'ep': endpoint, 'err': e})
 
     def _select_endpoint(self):
-        # check for UP state until exhausting all endpoints
-        seen, total = 0, len(self._endpoints.values())
-        while seen < total:
-            endpoint = next(self._endpoint_schedule)
-            if endpoint.state == EndpointState.UP:
-                return endpoint
-            seen += 1
+        self._ensure_initialized()
+        endpoint = self._scheduler.select()
+        if endpoint and endpoint.state != EndpointState.UP:
+            # DOWN endpoints are only handed out for breaker trials
+            endpoint.breaker.start_trial()
+        return endpoint
+
+    def _record_response(self, endpoint, response, latency=None):
+        endpoint.stats.record_response()
+        status_code = getattr(response, 'status_code', None)
+        if endpoint.limiter:
+            if status_code in THROTTLE_STATUS_CODES:
+                endpoint.limiter.record_overload()
+            elif latency is not None:
+                endpoint.limiter.record_latency(latency)
+            endpoint.set_concurrency(endpoint.limiter.limit)
+        if status_code in SOFT_FAILURE_STATUS_CODES:
+            self._record_failure(endpoint, hard=False)
+            return
+        endpoint.breaker.record_success()
+        if endpoint.breaker.state == CircuitBreakerState.CLOSED:
+            endpoint.set_state(EndpointState.UP)
+
+    def _record_failure(self, endpoint, hard=True):
+        # an endpoint which can't be connected to is left to the keepalive
+        # probes, which the breaker only backs off on repeated failures
+        if endpoint.breaker.record_failure(hard=hard) or hard:
+            endpoint.set_state(EndpointState.DOWN)
+
+    def _record_exception(self, endpoint, exception, trial=False):
+        """Record a failed request, return True if it can be retried."""
+        if self._http_provider.is_connection_exception(exception):
+            self._record_failure(endpoint)
+            return True
+        if self._http_provider.is_timeout_exception(exception):
+            self._record_failure(endpoint, hard=False)
+        elif trial:
+            # not an endpoint failure, let another trial through
+            endpoint.breaker.end_trial()
+        return False
 
     def endpoint_for_connection(self, conn):
-        # check all endpoint pools
-        for endpoint in self._endpoints.values():
-            if (conn in endpoint.pool.channel.queue or
-                    conn in endpoint.pool.free_items):
-                return endpoint
+        info = self._connections.lookup(conn)
+        if info:
+            return info.endpoint
 
     @property
     def cluster_id(self):
@@ -454,8 +1316,9 @@ class ClusteredAPI(object):
             yield conn_data.connection
 
     @contextlib.contextmanager
-    def endpoint_connection(self):
-        endpoint = self._select_endpoint()
+    def endpoint_connection(self, endpoint=None):
+        if endpoint is None:
+            endpoint = self._select_endpoint()
         if not endpoint:
             LOG.debug("All endpoints down for: %s" %
                       [str(ep) for ep in self._endpoints.values()])
@@ -470,18 +1333,124 @@ class ClusteredAPI(object):
                      {'ep': endpoint,
                       'max': endpoint.pool.max_size,
                       'waiting': endpoint.pool.waiting()})
-        # pool.item() will wait if pool has 0 free
-        with endpoint.pool.item() as conn:
-            yield EndpointConnection(endpoint, conn)
+        # requests waiting for a connection count as outstanding too
+        endpoint.outstanding += 1
+        try:
+            with self._checkout(endpoint) as conn:
+                yield EndpointConnection(endpoint, conn)
+        finally:
+            endpoint.outstanding -= 1
 
     def _proxy_stub(self, proxy_for):
         def _call_proxy(url, *args, **kwargs):
-            return self._proxy(proxy_for, url, *args, **kwargs)
+            if self._retry_budget:
+                self._retry_budget.deposit()
+            proxy = self._proxy
+            if proxy_for == 'get' and self._hedge_policy:
+                proxy = self._hedged_proxy
+            attempt = 0
+            while True:
+                response = proxy(proxy_for, url, *args, **kwargs)
+                delay = self._throttled_retry_delay(
+                    proxy_for, response, attempt)
+                if delay is None:
+                    return response
+                _close_response(response)
+                eventlet.sleep(delay)
+                attempt += 1
         return _call_proxy
 
+    def _throttled_retry_delay(self, method, response, attempt):
+        """Return the delay before retrying a throttled request, if any."""
+        status_code = getattr(response, 'status_code', None)
+        if (status_code not in THROTTLE_STATUS_CODES or
+                # a 503 may come after a POST was processed, re-sending it
+                # could create a duplicate object
+                (method == 'post' and
+                 status_code != requests.codes.TOO_MANY_REQUESTS) or
+                attempt >= self._throttle_retries or
+                not self._retry_allowed()):
+            return None
+        delay = throttle_delay(response, attempt)
+        LOG.info("Request throttled by NSX with status %(status)s, "
+                 "retrying in %(delay).2f seconds",
+                 {'status': response.status_code, 'delay': delay})
+        return delay
+
+    def _hedge_endpoint(self, endpoint):
+        """Return the least loaded UP endpoint other than endpoint."""
+        candidates = [ep for ep in self._endpoints.values()
+                      if ep is not endpoint and ep.state == EndpointState.UP]
+        if candidates:
+            return min(candidates, key=lambda ep: ep.outstanding)
+
+    def _hedged_proxy(self, proxy_for, uri, *args, **kwargs):
+        """Proxy an idempotent request, duplicated if it is slow.
+
+        The request is sent to a second endpoint if it is still in flight
+        after the latency percentile of the first one, and the hedge budget
+        allows it. The first response wins, the other one is closed when it
+        completes.
+        """
+        policy = self._hedge_policy
+        policy.budget.deposit()
+        endpoint = self._select_endpoint()
+        delay = policy.delay(endpoint) if endpoint else None
+        if delay is None:
+            return self._proxy_to(endpoint, proxy_for, uri, *args, **kwargs)
+
+        results = queue.LightQueue()
+
+        def _request(ep):
+            try:
+                results.put((ep, self._proxy_to(
+                    ep, proxy_for, uri, *args, **kwargs), None))
+            except Exception as e:
+                results.put((ep, None, e))
+
+        eventlet.spawn_n(_request, endpoint)
+        pending = 1
+        try:
+            served_by, response, error = results.get(timeout=delay)
+        except queue.Empty:
+            hedge = self._hedge_endpoint(endpoint)
+            if hedge and policy.budget.acquire():
+                LOG.debug("%(method)s %(uri)s slower than %(delay).3f "
+                          "seconds on %(ep)s, hedging to %(hedge)s",
+                          {'method': proxy_for.upper(), 'uri': uri,
+                           'delay': delay, 'ep': endpoint.provider,
+                           'hedge': hedge.provider})
+                eventlet.spawn_n(_request, hedge)
+                pending += 1
+            served_by, response, error = results.get()
+        pending -= 1
+        while error is not None and pending:
+            # a failure only wins if the other request fails too
+            served_by, response, error = results.get()
+            pending -= 1
+        if served_by is not endpoint:
+            policy.wins += 1
+        if pending:
+            eventlet.spawn_n(self._close_hedge_losers, results, pending)
+        if error is not None:
+            raise error
+        return response
+
+    @staticmethod
+    def _close_hedge_losers(results, pending):
+        for i in range(pending):
+            _close_response(results.get()[1])
+
     def _proxy(self, proxy_for, uri, *args, **kwargs):
-        # proxy http request call to an avail endpoint
-        with self.endpoint_connection() as conn_data:
+        return self._proxy_to(None, proxy_for, uri, *args, **kwargs)
+
+    def _proxy_to(self, endpoint, proxy_for, uri, *args, **kwargs):
+        # proxy http request call to the endpoint, or an avail one
+        checkout = self.endpoint_connection(endpoint=endpoint)
+        conn_data = checkout.__enter__()
+        # a streamed response keeps the connection until it is read
+        release = functools.partial(checkout.__exit__, None, None, None)
+        try:
             conn = conn_data.connection
             endpoint = conn_data.endpoint
 
@@ -491,25 +1460,47 @@ class ClusteredAPI(object):
             if not uri.startswith('/'):
                 uri = "/%s" % uri
             url = "%s%s" % (endpoint.provider.url, uri)
+            trial = endpoint.breaker.state == CircuitBreakerState.HALF_OPEN
             try:
                 LOG.debug("API cluster proxy %s %s to %s",
                           proxy_for.upper(), uri, url)
                 # call the actual connection method to do the
                 # http request/response over the wire
+                ts = time.time()
                 response = do_request(url, *args, **kwargs)
-                endpoint.set_state(EndpointState.UP)
-
+                if kwargs.get('stream'):
+                    response = StreamedResponse(response, functools.partial(
+                        self._release_streamed, endpoint, response, ts,
+                        release))
+                    release = None
+                    return response
+                self._record_latency(endpoint, response, time.time() - ts)
                 return response
             except Exception as e:
                 LOG.warning("Request failed due to: %s", e)
-                if not self._http_provider.is_connection_exception(e):
+                if not self._record_exception(endpoint, e, trial=trial):
                     # only trap and retry connection errors
                     raise e
-                endpoint.set_state(EndpointState.DOWN)
+                if not self._retry_allowed():
+                    LOG.warning("Not retrying %s on another endpoint, the "
+                                "retry budget is exhausted", uri)
+                    raise e
                 LOG.debug("Connection to %s failed, checking additional "
                           "endpoints" % url)
                 # retry until exhausting endpoints
                 return self._proxy(proxy_for, uri, *args, **kwargs)
+        finally:
+            if release is not None:
+                release()
+
+    def _record_latency(self, endpoint, response, latency):
+        endpoint.record_latency(latency)
+        self._record_response(endpoint, response, latency=latency)
+
+    def _release_streamed(self, endpoint, response, ts, release):
+        # the latency covers the transfer of the body
+        self._record_latency(endpoint, response, time.time() - ts)
+        release()
 
 
 class NSXClusteredAPI(ClusteredAPI):
@@ -525,7 +1516,18 @@ class NSXClusteredAPI(ClusteredAPI):
             self._build_conf_providers(),
             self._http_provider,
             max_conns_per_pool=self.nsxlib_config.concurrent_connections,
-            keepalive_interval=self.nsxlib_config.conn_idle_timeout)
+            keepalive_interval=self.nsxlib_config.conn_idle_timeout,
+            scheduler=self.nsxlib_config.endpoint_scheduler,
+            circuit_breaker_opts=self.nsxlib_config.circuit_breaker_opts(),
+            retry_budget_opts=self.nsxlib_config.retry_budget_opts(),
+            concurrency_limiter_opts=(
+                self.nsxlib_config.concurrency_limiter_opts()),
+            throttle_retries=self.nsxlib_config.throttle_retries,
+            connection_max_age=self.nsxlib_config.connection_max_age,
+            connection_max_requests=(
+                self.nsxlib_config.connection_max_requests),
+            hedge_opts=self.nsxlib_config.hedge_opts(),
+            lazy_init=self.nsxlib_config.lazy_cluster_init)
 
         LOG.debug("Created NSX clustered API with '%s' "
                   "provider", self._http_provider.provider_id)
@@ -18,6 +18,16 @@ from oslo_log import versionutils
 
 LOG = log.getLogger(__name__)
 
+# cache_ttls of the resources read often and almost never modified
+REFERENCE_RESOURCES_CACHE_TTLS = {
+    'transport-zones': 300,
+    'edge-clusters': 300,
+    'switching-profiles': 300,
+    'dhcp/server-profiles': 300,
+    'md-proxies': 300,
+    'node': 300,
+}
+
 
 class NsxLibConfig(object):
     """Class holding all the configuration parameters used by the nsxlib code.
@@ -68,6 +78,158 @@ class NsxLibConfig(object):
     :param dns_domain: Domain to use for building the hostnames.
     :param dhcp_profile_uuid: Currently unused and deprecated.
                               Kept for backward compatibility.
+    :param adaptive_concurrency: If true, the concurrent connections to each
+                                 NSX manager are adjusted between
+                                 min_concurrent_connections and
+                                 concurrent_connections: halved when the
+                                 manager throttles requests (429 or 503
+                                 responses) or its latency rises, and
+                                 grown back one at a time as it recovers.
+                                 Disabled by default.
+    :param min_concurrent_connections: Lower bound of the adaptive concurrent
+                                       connections to each NSX manager.
+    :param concurrency_latency_tolerance: The ratio of the recent latency of
+                                          a NSX manager over its long term
+                                          latency above which its concurrent
+                                          connections are decreased.
+    :param throttle_retries: Maximum number of times to retry a request
+                             throttled by the NSX manager (429 or 503
+                             responses), after the delay requested by its
+                             Retry-After header or an exponential backoff.
+                             POST requests are only retried on 429
+                             responses. 0, the default, disables retries.
+    :param connection_max_age: None, or the time in seconds after which a
+                               connection to a NSX manager is closed and
+                               replaced with a new one.
+    :param connection_max_requests: None, or the number of requests after
+                                    which a connection to a NSX manager is
+                                    closed and replaced with a new one.
+    :param keepalive_probe_uri: The API path requested to check the
+                                connectivity of an idle NSX manager, relative
+                                to the API base. Defaults to the keepalive
+                                section of the library (transport-zones for
+                                the manager API, infra for the policy API).
+                                A cheaper path such as 'node/status' can be
+                                used instead.
+    :param keepalive_probe_method: The HTTP method of the keepalive probe,
+                                   'GET' or 'HEAD'. The response of a GET
+                                   probe on a list is expected to be
+                                   non-empty; a HEAD probe only checks the
+                                   status code.
+    :param circuit_breaker_failure_rate: The ratio of failures (connection
+                                         failures, read timeouts,
+                                         502/503/504 responses) over the
+                                         latest requests of a NSX manager
+                                         above which it is taken out of
+                                         service.
+    :param circuit_breaker_hard_failure_rate: The lower ratio of the
+                                              connection failures alone
+                                              above which a NSX manager
+                                              is taken out of service.
+    :param circuit_breaker_window: The number of latest requests the
+                                   failure rate is computed over.
+    :param circuit_breaker_backoff: The time in seconds a failed NSX manager
+                                    is left alone before being tried again.
+                                    Doubled on each consecutive failure, and
+                                    jittered.
+    :param circuit_breaker_max_backoff: Upper bound in seconds of the
+                                        backoff.
+    :param circuit_breaker_trials: Maximum number of concurrent trial
+                                   requests to a NSX manager whose backoff
+                                   expired.
+    :param lazy_cluster_init: If true, the NSX managers are validated in the
+                              background rather than when creating the
+                              NsxLib, and the first request waits for the
+                              first one to be up.
+    :param endpoint_scheduler: The policy used to choose the NSX manager
+                               servicing each request. One of
+                               'round-robin', 'least-outstanding' (fewest
+                               requests in flight), 'ewma-latency' (lowest
+                               latency moving average weighted by the
+                               requests in flight) or 'power-of-two' (less
+                               loaded out of 2 random managers).
+    :param hedge_percentile: None, or the percentile of the recent latencies
+                             of a NSX manager after which a GET request
+                             still in flight is duplicated to another NSX
+                             manager, the first response winning. If None,
+                             GET requests are not hedged.
+    :param hedge_budget_ratio: Number of hedged requests allowed per GET
+                               request, so that hedging cannot multiply the
+                               load of the NSX managers.
+    :param json_codec: The JSON library encoding the requests and decoding
+                       the responses. One of 'json' (oslo.serialization),
+                       'orjson' (requires the orjson library, faster) or
+                       'auto' (orjson if installed).
+    :param json_sort_keys: If true, the keys of the JSON request bodies are
+                           sorted. Disable to save some CPU on large bodies.
+    :param cache_ttls: None, or a dict of the resources whose GET responses
+                       are cached, with their time to live in seconds, such
+                       as {'transport-zones': 300}. The resources are given
+                       by their path relative to the API base, and writes
+                       through the NsxLib invalidate them. See
+                       REFERENCE_RESOURCES_CACHE_TTLS.
+    :param cache_max_entries: Maximum number of cached responses, the least
+                              recently used ones being evicted.
+    :param conditional_get: If true, GET requests are sent with the ETag, or
+                            the revision, of the last response to the same
+                            URL, and a 304 Not Modified response is answered
+                            from that last response, saving its transfer.
+    :param conditional_get_max_entries: Maximum number of responses kept for
+                                        conditional GET requests, the least
+                                        recently used ones being evicted.
+    :param coalesce_gets: If true, identical GET requests made concurrently
+                          share the response of the first one rather than
+                          each taking a connection of the pool. The GET
+                          requests made once a write was sent are never
+                          coalesced with the ones sent before. Disabled by
+                          default.
+    :param merge_writes: If true, the concurrent read-modify-write cycles of
+                         the same resource within the process, such as
+                         the additions to the list of a load balancer
+                         service, are merged into a single cycle, and the
+                         other writes of hot shared resources are
+                         serialized, rather than racing each other for
+                         its revision. Disabled by default.
+    :param object_state_cache: If true, the last state seen of the objects,
+                               with its revision, is kept so that they can
+                               be updated without reading them first. An
+                               update based on a stale state fails with a
+                               stale revision error and is retried after
+                               reading the object.
+    :param object_state_max_entries: Maximum number of object states kept,
+                                     the least recently used ones being
+                                     evicted.
+    :param lookup_index_ttl: None, or the time to live in seconds of the
+                             lookup indexes of the collections. If set, the
+                             lookups by name, by id or by attribute, such
+                             as find_by_display_name, list the collection
+                             once into an index kept up to date with the
+                             writes made through the NsxLib, rather than
+                             on each call. A lookup finding nothing lists
+                             the collection again.
+    :param async_writes: If true, the writes made through the proxies
+                         returned by NsxLib.async_writes run in the
+                         background, and return futures. Otherwise they
+                         run synchronously.
+    :param async_write_workers: Maximum number of background writes running
+                                concurrently. The writes to the same
+                                resource always run one after the other.
+    :param async_write_queue_size: Maximum number of background writes
+                                   queued or running, submitting more
+                                   blocks until one of them completes.
+    :param search_concurrency: Maximum number of pages of a search fetched in
+                               parallel by search_all_by_tags. If 1, the
+                               pages are fetched one after the other.
+    :param retry_budget_ratio: None, or the number of retries allowed per
+                               API request, shared by the HTTP connection
+                               retries, the failover to another NSX manager
+                               and the stale revision retries. If None,
+                               retries are only bound by their own limits.
+    :param retry_budget_min_retries: Number of retries per second allowed
+                                     regardless of the request rate, so that
+                                     a lightly loaded client can still retry.
+    :param retry_budget_max_tokens: Maximum number of retries which can be
+                                    saved up by the retry budget.
 
     """
 
@@ -90,7 +252,43 @@ class NsxLibConfig(object):
                  plugin_ver=None,
                  dns_nameservers=None,
                  dns_domain='openstacklocal',
-                 dhcp_profile_uuid=None):
+                 dhcp_profile_uuid=None,
+                 adaptive_concurrency=False,
+                 min_concurrent_connections=1,
+                 concurrency_latency_tolerance=2.0,
+                 throttle_retries=0,
+                 connection_max_age=None,
+                 connection_max_requests=None,
+                 keepalive_probe_uri=None,
+                 keepalive_probe_method='GET',
+                 circuit_breaker_failure_rate=0.5,
+                 circuit_breaker_hard_failure_rate=0.3,
+                 circuit_breaker_window=10,
+                 circuit_breaker_backoff=1,
+                 circuit_breaker_max_backoff=60,
+                 circuit_breaker_trials=1,
+                 lazy_cluster_init=False,
+                 endpoint_scheduler='round-robin',
+                 hedge_percentile=None,
+                 hedge_budget_ratio=0.1,
+                 json_codec='json',
+                 json_sort_keys=True,
+                 cache_ttls=None,
+                 cache_max_entries=1000,
+                 conditional_get=False,
+                 conditional_get_max_entries=1000,
+                 coalesce_gets=False,
+                 merge_writes=False,
+                 object_state_cache=False,
+                 object_state_max_entries=1000,
+                 lookup_index_ttl=None,
+                 async_writes=False,
+                 async_write_workers=10,
+                 async_write_queue_size=1000,
+                 search_concurrency=1,
+                 retry_budget_ratio=None,
+                 retry_budget_min_retries=1,
+                 retry_budget_max_tokens=100):
 
         self.nsx_api_managers = nsx_api_managers
         self._username = username
@@ -110,6 +308,43 @@ class NsxLibConfig(object):
         self.plugin_ver = plugin_ver
         self.dns_nameservers = dns_nameservers or []
         self.dns_domain = dns_domain
+        self.adaptive_concurrency = adaptive_concurrency
+        self.min_concurrent_connections = min_concurrent_connections
+        self.concurrency_latency_tolerance = concurrency_latency_tolerance
+        self.throttle_retries = throttle_retries
+        self.connection_max_age = connection_max_age
+        self.connection_max_requests = connection_max_requests
+        self.keepalive_probe_uri = keepalive_probe_uri
+        self.keepalive_probe_method = keepalive_probe_method
+        self.circuit_breaker_failure_rate = circuit_breaker_failure_rate
+        self.circuit_breaker_hard_failure_rate = (
+            circuit_breaker_hard_failure_rate)
+        self.circuit_breaker_window = circuit_breaker_window
+        self.circuit_breaker_backoff = circuit_breaker_backoff
+        self.circuit_breaker_max_backoff = circuit_breaker_max_backoff
+        self.circuit_breaker_trials = circuit_breaker_trials
+        self.lazy_cluster_init = lazy_cluster_init
+        self.endpoint_scheduler = endpoint_scheduler
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget_ratio = hedge_budget_ratio
+        self.json_codec = json_codec
+        self.json_sort_keys = json_sort_keys
+        self.cache_ttls = cache_ttls
+        self.cache_max_entries = cache_max_entries
+        self.conditional_get = conditional_get
+        self.conditional_get_max_entries = conditional_get_max_entries
+        self.coalesce_gets = coalesce_gets
+        self.merge_writes = merge_writes
+        self.object_state_cache = object_state_cache
+        self.object_state_max_entries = object_state_max_entries
+        self.lookup_index_ttl = lookup_index_ttl
+        self.async_writes = async_writes
+        self.async_write_workers = async_write_workers
+        self.async_write_queue_size = async_write_queue_size
+        self.search_concurrency = search_concurrency
+        self.retry_budget_ratio = retry_budget_ratio
+        self.retry_budget_min_retries = retry_budget_min_retries
+        self.retry_budget_max_tokens = retry_budget_max_tokens
 
         if dhcp_profile_uuid:
             # this is deprecated, and never used.
@@ -123,6 +358,60 @@ class NsxLibConfig(object):
         self.keepalive_section = keepalive_section
         self.url_base = url_base
 
+    def circuit_breaker_opts(self):
+        return {'failure_rate': self.circuit_breaker_failure_rate,
+                'hard_failure_rate': self.circuit_breaker_hard_failure_rate,
+                'window_size': self.circuit_breaker_window,
+                'backoff': self.circuit_breaker_backoff,
+                'max_backoff': self.circuit_breaker_max_backoff,
+                'half_open_requests': self.circuit_breaker_trials}
+
+    def concurrency_limiter_opts(self):
+        if not self.adaptive_concurrency:
+            return None
+        return {'min_limit': self.min_concurrent_connections,
+                'latency_tolerance': self.concurrency_latency_tolerance}
+
+    def retry_budget_opts(self):
+        if self.retry_budget_ratio is None:
+            return None
+        return {'ratio': self.retry_budget_ratio,
+                'min_retries_per_second': self.retry_budget_min_retries,
+                'max_tokens': self.retry_budget_max_tokens}
+
+    def hedge_opts(self):
+        if self.hedge_percentile is None:
+            return None
+        return {'percentile': self.hedge_percentile,
+                'ratio': self.hedge_budget_ratio}
+
+    def cache_opts(self):
+        if not self.cache_ttls:
+            return None
+        return {'ttls': self.cache_ttls,
+                'max_entries': self.cache_max_entries}
+
+    def conditional_get_opts(self):
+        if not self.conditional_get:
+            return None
+        return {'max_entries': self.conditional_get_max_entries}
+
+    def object_state_opts(self):
+        if not self.object_state_cache:
+            return None
+        return {'max_entries': self.object_state_max_entries}
+
+    def lookup_index_opts(self):
+        if self.lookup_index_ttl is None:
+            return None
+        return {'ttl': self.lookup_index_ttl}
+
+    def async_write_opts(self):
+        if not self.async_writes:
+            return None
+        return {'max_workers': self.async_write_workers,
+                'max_pending': self.async_write_queue_size}
+
     def _attribute_by_index(self, scalar_or_list, index):
         if isinstance(scalar_or_list, list):
             if not len(scalar_or_list):
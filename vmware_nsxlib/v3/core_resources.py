@@ -153,7 +153,8 @@ class NsxLibLogicalSwitch(utils.NsxLibApiBase):
         # Using internal method so we can access max_attempts in the decorator
         @utils.retry_upon_exception(
             exceptions.StaleRevision,
-            max_attempts=self.nsxlib_config.max_attempts)
+            max_attempts=self.nsxlib_config.max_attempts,
+            budget=self.client.retry_budget)
         def _do_delete():
             resource = '%s?detach=true&cascade=true' % lswitch_id
             self.client.delete(self.get_path(resource))
@@ -165,7 +166,8 @@ class NsxLibLogicalSwitch(utils.NsxLibApiBase):
         # Using internal method so we can access max_attempts in the decorator
         @utils.retry_upon_exception(
             exceptions.StaleRevision,
-            max_attempts=self.nsxlib_config.max_attempts)
+            max_attempts=self.nsxlib_config.max_attempts,
+            budget=self.client.retry_budget)
         def _do_update():
             lswitch = self.get(lswitch_id)
             # Assign name to a local variable since 'name' is out of scope
@@ -205,9 +207,8 @@ class NsxLibSwitchingProfile(utils.NsxLibApiBase):
     def uri_segment(self):
         return 'switching-profiles'
 
-    def list(self):
-        return self.client.list(
-            self.get_path('?include_system_owned=True'))
+    def _list_path(self):
+        return self.get_path('?include_system_owned=True')
 
     def create(self, profile_type, display_name=None,
                description=None, **api_args):
@@ -614,9 +615,11 @@ class NsxLibLogicalRouter(utils.NsxLibApiBase):
         # Using internal method so we can access max_attempts in the decorator
         @utils.retry_upon_exception(
             exceptions.StaleRevision,
-            max_attempts=self.client.max_attempts)
+            max_attempts=self.client.max_attempts,
+            budget=self.client.retry_budget)
         def _do_update():
-            lrouter = self.get(lrouter_id)
+            lrouter = self._get_for_update(self.get_path(lrouter_id),
+                                           read=lambda: self.get(lrouter_id))
             for k in kwargs:
                 lrouter[k] = kwargs[k]
             # If revision_id of the payload that we send is older than what
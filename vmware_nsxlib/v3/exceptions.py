@@ -63,6 +63,23 @@ class CertificateError(NsxLibException):
     message = _("Certificate error: %(msg)s")
 
 
+class MissingDependency(NsxLibException):
+    message = _("The %(library)s library is required by %(feature)s")
+
+
+class UnsupportedHTTPProvider(NsxLibException):
+    message = _("The %(provider)s HTTP provider is not supported by "
+                "%(feature)s")
+
+
+class BatchNotSubmitted(NsxLibException):
+    message = _("The batch holding %(operation)s was not submitted")
+
+
+class WriteExecutorShutdown(NsxLibException):
+    message = _("The write executor was shut down")
+
+
 class ManagerError(NsxLibException):
     message = _("Unexpected error from backend manager (%(manager)s) "
                 "for %(operation)s %(details)s")
@@ -97,6 +114,16 @@ class StaleRevision(ManagerError):
     pass
 
 
+class TooManyRequests(ManagerError):
+    message = _("Too many requests to backend manager (%(manager)s) for "
+                "%(operation)s %(details)s")
+
+
+class ServiceUnavailable(ManagerError):
+    message = _("Backend manager (%(manager)s) is unavailable for "
+                "%(operation)s %(details)s")
+
+
 class ClientCertificateNotTrusted(ManagerError):
     message = _("Certificate not trusted")
 
@@ -0,0 +1,177 @@
+# Copyright 2017 VMware, Inc.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""HTTP/2 provider multiplexing the requests to each NSX manager.
+
+The connections pooled by ClusteredAPI are lightweight sessions sharing a
+single httpx client per NSX manager. When the manager negotiates h2, the
+concurrent requests of the pool are streams multiplexed over one TLS
+socket instead of concurrent_connections sockets. Otherwise the client
+falls back to HTTP/1.1 with up to concurrent_connections keep-alive
+sockets, like NSXRequestsHTTPProvider.
+
+This module requires the httpx library with its http2 extra.
+"""
+
+from oslo_log import log
+
+from vmware_nsxlib.v3 import cluster
+from vmware_nsxlib.v3 import exceptions
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+LOG = log.getLogger(__name__)
+
+HTTP2 = 'HTTP/2'
+
+
+class SharedClient(object):
+    """A httpx client shared by the sessions of an endpoint."""
+
+    def __init__(self, client):
+        self.client = client
+        self.sessions = 0
+        self.http_version = None
+        # set once a request failed to connect
+        self.broken = False
+
+
+class HTTP2Session(object):
+    """Duck types the parts of requests.Session used by the cluster.
+
+    A connection failure marks the underlying client broken, so that the
+    sessions opened next use a new client. A client is closed once all of
+    its sessions are.
+    """
+
+    def __init__(self, provider, provider_id, shared):
+        self._provider = provider
+        self._provider_id = provider_id
+        self._shared = shared
+        shared.sessions += 1
+
+    @property
+    def http_version(self):
+        """The negotiated HTTP version, None before the first response."""
+        return self._shared.http_version
+
+    def request(self, method, url, data=None, headers=None, stream=False):
+        client = self._shared.client
+        try:
+            # a streamed response is read by the caller, and must be closed
+            response = client.send(
+                client.build_request(method.upper(), url, content=data,
+                                     headers=headers),
+                stream=stream)
+        except Exception as e:
+            if self._provider.is_connection_exception(e):
+                self._shared.broken = True
+            raise
+        if self._shared.http_version != response.http_version:
+            self._shared.http_version = response.http_version
+            if response.http_version != HTTP2:
+                LOG.info("NSX manager %(url)s did not negotiate HTTP/2, "
+                         "falling back to %(version)s",
+                         {'url': self._provider_id,
+                          'version': response.http_version})
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def close(self):
+        if self._shared is not None:
+            self._provider._release(self._provider_id, self._shared)
+            self._shared = None
+
+
+class NSXHTTP2Provider(cluster.AbstractHTTPProvider):
+    """Concrete implementation of AbstractHTTPProvider.
+
+    using a httpx.Client shared by all the pooled connections of an
+    endpoint, with HTTP/2 enabled.
+    """
+
+    def __init__(self):
+        if httpx is None:
+            raise exceptions.MissingDependency(
+                library='httpx', feature=self.__class__.__name__)
+        # the current shared client of each endpoint, by provider id
+        self._clients = {}
+
+    @property
+    def provider_id(self):
+        return "httpx-%s" % httpx.__version__
+
+    validate_connection = cluster.NSXRequestsHTTPProvider.validate_connection
+
+    def _new_client(self, config, provider):
+        limits = httpx.Limits(
+            max_connections=config.concurrent_connections,
+            max_keepalive_connections=config.concurrent_connections)
+        transport = httpx.HTTPTransport(
+            verify=cluster.ssl_context(config, provider),
+            http2=True, limits=limits, retries=config.retries)
+        auth = None
+        if not config.client_cert_provider:
+            auth = (provider.username, provider.password)
+        # NSX v3 doesn't use redirects
+        return httpx.Client(
+            transport=transport, auth=auth, follow_redirects=False,
+            timeout=httpx.Timeout(config.http_read_timeout,
+                                  connect=config.http_timeout))
+
+    def new_connection(self, cluster_api, provider):
+        shared = self._clients.get(provider.id)
+        if shared is None:
+            shared = SharedClient(
+                self._new_client(cluster_api.nsxlib_config, provider))
+            self._clients[provider.id] = shared
+        return HTTP2Session(self, provider.id, shared)
+
+    def _release(self, provider_id, shared):
+        shared.sessions -= 1
+        if (self._clients.get(provider_id) is shared and
+                (shared.broken or shared.sessions <= 0)):
+            # the next connections use a new client
+            del self._clients[provider_id]
+        if shared.sessions <= 0:
+            shared.client.close()
+
+    def is_connection_exception(self, exception):
+        return isinstance(exception, (httpx.NetworkError,
+                                      httpx.ConnectTimeout,
+                                      httpx.RemoteProtocolError))
+
+    def is_timeout_exception(self, exception):
+        return isinstance(exception, httpx.ReadTimeout)
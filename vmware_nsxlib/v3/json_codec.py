@@ -0,0 +1,209 @@
+# Copyright 2017 VMware, Inc.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""JSON codecs encoding the request bodies and decoding the responses.
+
+The orjson codec requires the orjson library.
+"""
+
+import codecs
+import json
+import re
+
+from oslo_serialization import jsonutils
+import six
+
+from vmware_nsxlib.v3 import exceptions
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CODEC_JSON = 'json'
+CODEC_ORJSON = 'orjson'
+# orjson if installed, json otherwise
+CODEC_AUTO = 'auto'
+
+
+class JSONCodec(object):
+    """Codec based on oslo.serialization, encoding to ASCII text."""
+
+    name = CODEC_JSON
+
+    def __init__(self, sort_keys=True):
+        self.sort_keys = sort_keys
+
+    def dumps(self, obj):
+        return jsonutils.dumps(obj, sort_keys=self.sort_keys)
+
+    def loads(self, content):
+        return jsonutils.loads(content)
+
+
+class OrjsonCodec(JSONCodec):
+    """Codec based on orjson, encoding to UTF-8 bytes."""
+
+    name = CODEC_ORJSON
+
+    def __init__(self, sort_keys=True):
+        if orjson is None:
+            raise exceptions.MissingDependency(
+                library='orjson', feature=self.__class__.__name__)
+        super(OrjsonCodec, self).__init__(sort_keys=sort_keys)
+        self._options = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            self._options |= orjson.OPT_SORT_KEYS
+
+    def dumps(self, obj):
+        # types unknown to orjson are converted like jsonutils does
+        return orjson.dumps(obj, default=jsonutils.to_primitive,
+                            option=self._options)
+
+    def loads(self, content):
+        return orjson.loads(content)
+
+
+CODECS = {
+    CODEC_JSON: JSONCodec,
+    CODEC_ORJSON: OrjsonCodec,
+}
+
+
+def get_codec(name=CODEC_JSON, sort_keys=True):
+    """Build the codec registered under the said name."""
+    if name == CODEC_AUTO:
+        name = CODEC_ORJSON if orjson else CODEC_JSON
+    try:
+        codec_class = CODECS[name or CODEC_JSON]
+    except KeyError:
+        raise exceptions.InvalidInput(operation="JSON encoding",
+                                      arg_name="json_codec",
+                                      arg_val=name)
+    return codec_class(sort_keys=sort_keys)
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class _StreamReader(object):
+    """Reads JSON values from a stream of text or UTF-8 chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _read(self):
+        """Read the next chunk, return False at the end of the stream."""
+        if self._eof:
+            return False
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._eof = True
+            chunk = self._utf8.decode(b'', final=True)
+        else:
+            if isinstance(chunk, six.binary_type):
+                chunk = self._utf8.decode(chunk)
+        # only keep what was not parsed yet
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _error(self, expected):
+        raise ValueError("Expecting %s at character %d of the JSON stream: "
+                         "%r" % (expected, self._pos,
+                                 self._buffer[self._pos:self._pos + 20]))
+
+    def peek(self):
+        """Return the next non whitespace character, '' at the end."""
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            self._error("'%s'" % char)
+        self._pos += 1
+
+    def value(self):
+        """Parse the next value, reading as many chunks as needed."""
+        if not self.peek():
+            self._error('value')
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if self._read():
+                    continue
+                raise
+            if end == len(self._buffer) and self._read():
+                # a number may go on in the next chunk
+                continue
+            self._pos = end
+            return value
+
+
+def iter_results(chunks, page=None, fields=None):
+    """Decode the results of a list response from its stream.
+
+    Yield the objects of the top level 'results' array one at a time,
+    so that only one of them is decoded in memory at once. The other top
+    level members, such as the cursor and result_count, are stored in the
+    page dict as they are decoded.
+
+    :param chunks: The response body, as an iterable of bytes or text.
+    :param page: Optional dict receiving the members of the response other
+                 than the results.
+    :param fields: Optional list of fields, to only keep those of each
+                   result.
+    """
+    page = page if page is not None else {}
+    reader = _StreamReader(chunks)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key != 'results':
+            page[key] = reader.value()
+        else:
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.expect(']')
+            else:
+                while True:
+                    result = reader.value()
+                    if fields:
+                        result = dict((field, result[field])
+                                      for field in fields
+                                      if field in result)
+                    yield result
+                    if reader.peek() != ',':
+                        break
+                    reader.expect(',')
+                reader.expect(']')
+        if reader.peek() != ',':
+            break
+        reader.expect(',')
+    reader.expect('}')
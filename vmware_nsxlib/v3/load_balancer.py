@@ -74,19 +74,21 @@ class LoadBalancerBase(utils.NsxLibApiBase):
         :return: client update response
         """
         object_url = self.resource + '/' + resource_id
-        body = self.client.get(object_url)
-        if item_key in body:
-            item_list = body[item_key]
-            if item_id not in item_list:
-                item_list.append(item_id)
+
+        def _add_item(body):
+            if item_key in body:
+                item_list = body[item_key]
+                if item_id not in item_list:
+                    item_list.append(item_id)
+                else:
+                    LOG.error('Item %s is already in resource %s',
+                              item_id, item_key)
+                    return False
             else:
-                LOG.error('Item %s is already in resource %s',
-                          item_id, item_key)
-                return body
-        else:
-            item_list = [item_id]
-        body[item_key] = item_list
-        return self.client.update(object_url, body)
+                item_list = [item_id]
+            body[item_key] = item_list
+
+        return self._merged_update(object_url, _add_item)
 
     def remove_from_list(self, resource_id, item_id, item_key):
         """Remove item_id from resource item_key list
@@ -98,17 +100,19 @@ class LoadBalancerBase(utils.NsxLibApiBase):
         :return: client update response
         """
         object_url = self.resource + '/' + resource_id
-        body = self.client.get(object_url)
-        item_list = body.get(item_key)
-        if item_list and item_id in item_list:
-            item_list.remove(item_id)
-            body[item_key] = item_list
-            return self.client.update(object_url, body)
-        else:
-            ops = ('removing item %s from resource %s %s as it is not in '
-                   'the list', item_id, item_key, item_list)
-            raise nsxlib_exc.ResourceNotFound(
-                manager=self.client.nsx_api_managers, operation=ops)
+
+        def _remove_item(body):
+            item_list = body.get(item_key)
+            if item_list and item_id in item_list:
+                item_list.remove(item_id)
+                body[item_key] = item_list
+            else:
+                ops = ('removing item %s from resource %s %s as it is not in '
+                       'the list', item_id, item_key, item_list)
+                raise nsxlib_exc.ResourceNotFound(
+                    manager=self.client.nsx_api_managers, operation=ops)
+
+        return self._merged_update(object_url, _remove_item)
 
     def create(self, display_name=None, description=None, tags=None,
                resource_type=None, **kwargs):
@@ -117,6 +121,9 @@ class LoadBalancerBase(utils.NsxLibApiBase):
                                 resource_type, **kwargs)
         return self.client.create(self.resource, body)
 
+    def _list_path(self):
+        return self.resource
+
     def list(self):
         return self.client.list(resource=self.resource)
 
@@ -127,10 +134,12 @@ class LoadBalancerBase(utils.NsxLibApiBase):
     def update(self, object_id, display_name=None, description=None,
                tags=None, resource_type=None, **kwargs):
         object_url = self.resource + '/' + object_id
-        orig_body = self.client.get(object_url)
-        body = self._build_args(orig_body, display_name, description, tags,
-                                resource_type, **kwargs)
-        return self.client.update(object_url, body)
+
+        def _update_body(orig_body):
+            self._build_args(orig_body, display_name, description, tags,
+                             resource_type, **kwargs)
+
+        return self._merged_update(object_url, _update_body)
 
     def delete(self, object_id):
         object_url = self.resource + '/' + object_id
@@ -331,6 +340,9 @@ class Service(LoadBalancerBase):
         self.remove_from_list(service_id, vs_id, 'virtual_server_ids')
 
     def get_router_lb_service(self, nsx_router_id):
+        found = self._find('attachment.target_id', nsx_router_id)
+        if found is not None:
+            return found[0] if found else None
         lb_services = self.list()['results']
         for service in lb_services:
             if service.get('attachment'):
@@ -15,9 +15,12 @@
 #
 
 import abc
+import collections
 
 import six
 
+from vmware_nsxlib._i18n import _
+from vmware_nsxlib.v3 import exceptions
 from vmware_nsxlib.v3 import policy_constants
 
 TENANTS_PATH_PATTERN = "%s/"
@@ -30,6 +33,19 @@ REALIZED_STATE_GROUP = REALIZED_STATE_EF + "groups/nsgroups/%s-%s"
 REALIZED_STATE_COMM_MAP = REALIZED_STATE_EF + "firewalls/firewall-sections/%s"
 REALIZED_STATE_SERVICE = REALIZED_STATE_EF + "services/nsservices/services:%s"
 
+# resource type of the objects of each path section, in hierarchical bodies
+HIERARCHICAL_RESOURCE_TYPES = {
+    'domains': 'Domain',
+    'groups': 'Group',
+    'services': 'Service',
+    'service-entries': 'ServiceEntry',
+    'communication-profiles': 'CommunicationProfile',
+    'communication-profile-entries': 'CommunicationProfileEntry',
+    'communication-map': 'CommunicationMap',
+    'communication-entries': 'CommunicationEntry',
+    'domain-deployment-maps': 'DomainDeploymentMap',
+}
+
 
 @six.add_metaclass(abc.ABCMeta)
 class ResourceDef(object):
@@ -96,6 +112,17 @@ class ResourceDef(object):
         if entries_path and entries_path not in self.body:
             self.body[entries_path] = []
 
+    def get_patch_body(self):
+        """Return the body updating only the attributes set in the body.
+
+        The sub-entries are left unchanged, unless set.
+        """
+        body = dict(self.body)
+        entries_path = self.sub_entries_path()
+        if entries_path and not body.get(entries_path):
+            body.pop(entries_path, None)
+        return body
+
     @classmethod
     def get_single_entry(cls, obj_body):
         """Return the single sub-entry from the object body.
@@ -624,6 +651,15 @@ class NsxPolicyApi(object):
             body = resource_def.get_obj_dict()
         return self.client.create(path, body)
 
+    def update(self, resource_def):
+        """Update the attributes set in the body of a policy object.
+
+        Only those attributes are sent, with a PATCH, so that the object
+        does not need to be read first.
+        """
+        path = resource_def.get_resource_path()
+        return self.client.patch(path, resource_def.get_patch_body())
+
     def create_with_parent(self, parent_def, resource_def):
         path = parent_def.get_resource_path()
         body = parent_def.get_obj_dict()
@@ -647,5 +683,129 @@ class NsxPolicyApi(object):
         path = resource_def.get_section_path()
         return self.client.list(path)
 
+    def find(self, resource_def, attribute, value):
+        """Return the listed objects of a definition with an attribute value.
+
+        The objects are looked up in the lookup index of the client. None
+        if it is disabled.
+        """
+        if getattr(self.client, 'lookup_index', None) is None:
+            return None
+        return self.client.find(resource_def.get_section_path(), attribute,
+                                value)
+
     def get_by_path(self, path):
         return self.client.get(path)
+
+    def new_transaction(self, tenant=policy_constants.POLICY_INFRA_TENANT):
+        return PolicyTransaction(self, tenant=tenant)
+
+    def apply_transaction(self, transaction):
+        """Create, update and delete the objects of a transaction at once."""
+        return self.client.url_patch(transaction.tenant,
+                                     transaction.get_obj_dict())
+
+
+class _HierarchicalNode(object):
+    """An object of a hierarchical body, with its children."""
+
+    def __init__(self, section=None, obj_id=None):
+        # the section of the path holding the object, such as 'groups'
+        self.section = section
+        self.id = obj_id
+        # None for the parents only given by their id
+        self.body = None
+        self.children = collections.OrderedDict()
+
+    def get_obj_dict(self, resource_type):
+        body = dict(self.body or {})
+        if self.id:
+            body.setdefault('id', self.id)
+        body.setdefault('resource_type', resource_type)
+        if self.children:
+            for child in self.children.values():
+                # the children are not inlined in the body anymore
+                body.pop(child.section.replace('-', '_'), None)
+            body['children'] = [child.get_child_dict()
+                                for child in self.children.values()]
+        return body
+
+    def get_child_dict(self):
+        resource_type = HIERARCHICAL_RESOURCE_TYPES[self.section]
+        return {'resource_type': 'Child%s' % resource_type,
+                resource_type: self.get_obj_dict(resource_type)}
+
+
+class PolicyTransaction(object):
+    """Collects policy objects into a single hierarchical request.
+
+    The objects created, updated or deleted are nested under the tenant in
+    an Infra body, each wrapped in its Child<resource type> object, and
+    applied with a single PATCH. The parents not part of the transaction
+    are only given by their id, and left unchanged.
+    """
+
+    def __init__(self, policy_api,
+                 tenant=policy_constants.POLICY_INFRA_TENANT):
+        self.policy_api = policy_api
+        self.tenant = tenant
+        self._root = _HierarchicalNode()
+        self._nodes = {tenant: self._root}
+
+    def __len__(self):
+        return len([node for node in self._nodes.values()
+                    if node.body is not None])
+
+    def _invalid_path(self, path):
+        return exceptions.InvalidInput(
+            operation=_('Policy transaction of tenant %s') % self.tenant,
+            arg_name='path', arg_val=path)
+
+    def _get_node(self, path, with_id=True):
+        node = self._nodes.get(path)
+        if node is not None:
+            return node
+        if not path.startswith(self.tenant + '/'):
+            raise self._invalid_path(path)
+
+        # .../<section>/<id>, or .../<section> for the objects without id,
+        # such as the communication map of a domain
+        segments = path.split('/')
+        depth = 2 if with_id else 1
+        section = segments[-depth]
+        if section not in HIERARCHICAL_RESOURCE_TYPES:
+            raise self._invalid_path(path)
+        parent_path = '/'.join(segments[:-depth])
+        parent = self._get_node(
+            parent_path, with_id=(parent_path.split('/')[-1] not in
+                                  HIERARCHICAL_RESOURCE_TYPES))
+
+        node = _HierarchicalNode(section, segments[-1] if with_id else None)
+        parent.children[path] = node
+        self._nodes[path] = node
+        return node
+
+    def _node(self, resource_def):
+        return self._get_node(resource_def.get_resource_path().strip('/'),
+                              with_id=bool(resource_def.id))
+
+    def create_or_update(self, resource_def):
+        """Add the creation or update of a policy object.
+
+        An object whose body was set by update_attributes_in_body is only
+        updated with the attributes set, like NsxPolicyApi.update does.
+        """
+        node = self._node(resource_def)
+        node.body = (resource_def.get_patch_body() if resource_def.body
+                     else resource_def.get_obj_dict())
+
+    def delete(self, resource_def):
+        """Add the deletion of a policy object."""
+        node = self._node(resource_def)
+        node.body = {'marked_for_delete': True}
+
+    def get_obj_dict(self):
+        return self._root.get_obj_dict('Infra')
+
+    def apply(self):
+        return self.policy_api.apply_transaction(self)
@@ -18,6 +18,7 @@ import abc
 import uuid
 
 from oslo_log import log as logging
+from oslo_utils import excutils
 import six
 
 from vmware_nsxlib._i18n import _
@@ -28,7 +29,6 @@ from vmware_nsxlib.v3 import policy_defs
 LOG = logging.getLogger(__name__)
 
 # TODO(asarfaty): support retries?
-# TODO(asarfaty): In future versions PATCH may be supported for update
 
 
 @six.add_metaclass(abc.ABCMeta)
@@ -68,8 +68,17 @@ class NsxPolicyResourceBase(object):
             obj_uuid = str(uuid.uuid4())
         return obj_uuid
 
+    def _list_def(self, *args, **kwargs):
+        """Return the definition of the objects returned by list"""
+        return None
+
     def get_by_name(self, name, *args, **kwargs):
         # Return first match by name
+        list_def = self._list_def(*args, **kwargs)
+        if list_def is not None:
+            found = self.policy_api.find(list_def, 'display_name', name)
+            if found is not None:
+                return found[0] if found else None
         resources_list = self.list(*args, **kwargs)
         for obj in resources_list:
             if obj.get('display_name') == name:
@@ -104,8 +113,11 @@ class NsxPolicyDomainApi(NsxPolicyResourceBase):
         domain_def = policy_defs.DomainDef(domain_id, tenant=tenant)
         return self.policy_api.get(domain_def)
 
+    def _list_def(self, tenant=policy_constants.POLICY_INFRA_TENANT):
+        return policy_defs.DomainDef(tenant=tenant)
+
     def list(self, tenant=policy_constants.POLICY_INFRA_TENANT):
-        domain_def = policy_defs.DomainDef(tenant=tenant)
+        domain_def = self._list_def(tenant=tenant)
         return self.policy_api.list(domain_def)['results']
 
     def update(self, domain_id, name=None, description=None,
@@ -115,7 +127,7 @@ class NsxPolicyDomainApi(NsxPolicyResourceBase):
         domain_def.update_attributes_in_body(name=name,
                                              description=description)
         # update the backend
-        return self.policy_api.create_or_update(domain_def)
+        return self.policy_api.update(domain_def)
 
 
 class NsxPolicyGroupApi(NsxPolicyResourceBase):
@@ -165,11 +177,14 @@ class NsxPolicyGroupApi(NsxPolicyResourceBase):
                                          tenant=tenant)
         return self.policy_api.get(group_def)
 
+    def _list_def(self, domain_id,
+                  tenant=policy_constants.POLICY_INFRA_TENANT):
+        return policy_defs.GroupDef(domain_id=domain_id, tenant=tenant)
+
     def list(self, domain_id,
              tenant=policy_constants.POLICY_INFRA_TENANT):
         """List all the groups of a specific domain."""
-        group_def = policy_defs.GroupDef(domain_id=domain_id,
-                                         tenant=tenant)
+        group_def = self._list_def(domain_id, tenant=tenant)
         return self.policy_api.list(group_def)['results']
 
     def get_by_name(self, domain_id, name,
@@ -190,7 +205,7 @@ class NsxPolicyGroupApi(NsxPolicyResourceBase):
         group_def.update_attributes_in_body(name=name,
                                             description=description)
         # update the backend
-        return self.policy_api.create_or_update(group_def)
+        return self.policy_api.update(group_def)
 
     def update_condition(
         self, domain_id, group_id,
@@ -216,12 +231,9 @@ class NsxPolicyGroupApi(NsxPolicyResourceBase):
             conditions = [condition]
         else:
             conditions = []
-        # Get the current data, and update it with the new values
-        # We need to do that here because of the conditions data
-        group = self.get(domain_id, group_id, tenant=tenant)
-        group_def.update_attributes_in_body(body=group, conditions=conditions)
+        group_def.update_attributes_in_body(conditions=conditions)
         # update the backend
-        return self.policy_api.create_or_update(group_def)
+        return self.policy_api.update(group_def)
 
     def get_realized_state(self, domain_id, group_id, ep_id,
                            tenant=policy_constants.POLICY_INFRA_TENANT):
@@ -260,8 +272,11 @@ class NsxPolicyServiceBase(NsxPolicyResourceBase):
                                              tenant=tenant)
         return self.policy_api.get(service_def)
 
+    def _list_def(self, tenant=policy_constants.POLICY_INFRA_TENANT):
+        return policy_defs.ServiceDef(tenant=tenant)
+
     def list(self, tenant=policy_constants.POLICY_INFRA_TENANT):
-        service_def = policy_defs.ServiceDef(tenant=tenant)
+        service_def = self._list_def(tenant=tenant)
         return self.policy_api.list(service_def)['results']
 
     def get_realized_state(self, service_id, ep_id,
@@ -275,6 +290,53 @@ class NsxPolicyServiceBase(NsxPolicyResourceBase):
     def entry_def(self):
         pass
 
+    def _update(self, service_id, name=None, description=None,
+                tenant=policy_constants.POLICY_INFRA_TENANT,
+                **entry_attributes):
+        """Update the service and its entry with a single PATCH.
+
+        The service is read first, as the id of its entry is only known to
+        the backend. The data returned is that read, updated locally with
+        the PATCH body rather than read again.
+        """
+        service = self.get(service_id, tenant=tenant)
+        transaction = self.policy_api.new_transaction(tenant=tenant)
+
+        if name is not None or description is not None:
+            # update the service itself
+            service_def = policy_defs.ServiceDef(service_id=service_id,
+                                                 tenant=tenant)
+            service_def.update_attributes_in_body(name=name,
+                                                  description=description)
+            transaction.create_or_update(service_def)
+
+        # update the service entry if it exists
+        service_entry = policy_defs.ServiceDef.get_single_entry(service)
+        if service_entry:
+            entry_def = self.entry_def(service_id=service_id,
+                                       service_entry_id=service_entry['id'],
+                                       tenant=tenant)
+            entry_def.update_attributes_in_body(
+                name=name, description=description, **entry_attributes)
+            if service_entry.get('resource_type'):
+                # the type of the entry is needed in a hierarchical body
+                entry_def.body['resource_type'] = (
+                    service_entry['resource_type'])
+            transaction.create_or_update(entry_def)
+        else:
+            LOG.error("Cannot update service %s - expected 1 service "
+                      "entry", service_id)
+
+        if not len(transaction):
+            return service
+        # update the backend
+        transaction.apply()
+        if name is not None or description is not None:
+            service.update(service_def.get_patch_body())
+        if service_entry:
+            service_entry.update(entry_def.get_patch_body())
+        return service
+
 
 class NsxPolicyL4ServiceApi(NsxPolicyServiceBase):
     """NSX Policy Service with a single L4 service entry.
@@ -307,55 +369,12 @@ class NsxPolicyL4ServiceApi(NsxPolicyServiceBase):
 
         return self.policy_api.create_with_parent(service_def, entry_def)
 
-    def _update_service_entry(self, service_id, srv_entry,
-                              name=None, description=None,
-                              protocol=None, dest_ports=None,
-                              tenant=policy_constants.POLICY_INFRA_TENANT):
-        entry_id = srv_entry['id']
-        entry_def = policy_defs.L4ServiceEntryDef(service_id=service_id,
-                                                  service_entry_id=entry_id,
-                                                  tenant=tenant)
-        entry_def.update_attributes_in_body(body=srv_entry, name=name,
-                                            description=description,
-                                            protocol=protocol,
-                                            dest_ports=dest_ports)
-
-        self.policy_api.create_or_update(entry_def)
-
     def update(self, service_id, name=None, description=None,
                protocol=None, dest_ports=None,
                tenant=policy_constants.POLICY_INFRA_TENANT):
-        # Get the current data of service & its' service entry
-        service = self.get(service_id, tenant=tenant)
-
-        # update the service itself:
-        if name is not None or description is not None:
-            # update the service itself
-            service_def = policy_defs.ServiceDef(service_id=service_id,
-                                                 tenant=tenant)
-            service_def.update_attributes_in_body(name=name,
-                                                  description=description)
-
-            # update the backend
-            updated_service = self.policy_api.create_or_update(service_def)
-        else:
-            updated_service = service
-
-        # update the service entry if it exists
-        service_entry = policy_defs.ServiceDef.get_single_entry(service)
-        if not service_entry:
-            LOG.error("Cannot update service %s - expected 1 service "
-                      "entry", service_id)
-            return updated_service
-
-        self._update_service_entry(
-            service_id, service_entry,
-            name=name, description=description,
-            protocol=protocol, dest_ports=dest_ports,
-            tenant=tenant)
-
-        # re-read the service from the backend to return the current data
-        return self.get(service_id, tenant=tenant)
+        return self._update(service_id, name=name, description=description,
+                            protocol=protocol, dest_ports=dest_ports,
+                            tenant=tenant)
 
 
 class NsxPolicyIcmpServiceApi(NsxPolicyServiceBase):
@@ -390,56 +409,12 @@ class NsxPolicyIcmpServiceApi(NsxPolicyServiceBase):
 
         return self.policy_api.create_with_parent(service_def, entry_def)
 
-    def _update_service_entry(self, service_id, srv_entry,
-                              name=None, description=None,
-                              version=None, icmp_type=None, icmp_code=None,
-                              tenant=policy_constants.POLICY_INFRA_TENANT):
-        entry_id = srv_entry['id']
-        entry_def = policy_defs.IcmpServiceEntryDef(service_id=service_id,
-                                                    service_entry_id=entry_id,
-                                                    tenant=tenant)
-        entry_def.update_attributes_in_body(body=srv_entry, name=name,
-                                            description=description,
-                                            version=version,
-                                            icmp_type=icmp_type,
-                                            icmp_code=icmp_code)
-
-        self.policy_api.create_or_update(entry_def)
-
     def update(self, service_id, name=None, description=None,
                version=None, icmp_type=None, icmp_code=None,
                tenant=policy_constants.POLICY_INFRA_TENANT):
-        # Get the current data of service & its' service entry
-        service = self.get(service_id, tenant=tenant)
-
-        # update the service itself:
-        if name is not None or description is not None:
-            # update the service itself
-            service_def = policy_defs.ServiceDef(service_id=service_id,
-                                                 tenant=tenant)
-            service_def.update_attributes_in_body(name=name,
-                                                  description=description)
-
-            # update the backend
-            updated_service = self.policy_api.create_or_update(service_def)
-        else:
-            updated_service = service
-
-        # update the service entry if it exists
-        service_entry = policy_defs.ServiceDef.get_single_entry(service)
-        if not service_entry:
-            LOG.error("Cannot update service %s - expected 1 service "
-                      "entry", service_id)
-            return updated_service
-
-        self._update_service_entry(
-            service_id, service_entry,
-            name=name, description=description,
-            version=version, icmp_type=icmp_type, icmp_code=icmp_code,
-            tenant=tenant)
-
-        # re-read the service from the backend to return the current data
-        return self.get(service_id, tenant=tenant)
+        return self._update(service_id, name=name, description=description,
+                            version=version, icmp_type=icmp_type,
+                            icmp_code=icmp_code, tenant=tenant)
 
 
 class NsxPolicyCommunicationProfileApi(NsxPolicyResourceBase):
@@ -498,32 +473,24 @@ class NsxPolicyCommunicationProfileApi(NsxPolicyResourceBase):
             profile_id=profile_id, tenant=tenant)
         return self.policy_api.get(profile_def)
 
+    def _list_def(self, tenant=policy_constants.POLICY_INFRA_TENANT):
+        return policy_defs.CommunicationProfileDef(tenant=tenant)
+
     def list(self, tenant=policy_constants.POLICY_INFRA_TENANT):
-        profile_def = policy_defs.CommunicationProfileDef(tenant=tenant)
+        profile_def = self._list_def(tenant=tenant)
         return self.policy_api.list(profile_def)['results']
 
-    def _update_profile_entry(self, profile_id, profile_entry,
-                              name=None, description=None,
-                              services=None, action=None,
-                              tenant=policy_constants.POLICY_INFRA_TENANT):
-        entry_id = profile_entry['id']
-        entry_def = policy_defs.CommunicationProfileEntryDef(
-            profile_id=profile_id,
-            profile_entry_id=entry_id,
-            tenant=tenant)
-        entry_def.update_attributes_in_body(body=profile_entry,
-                                            name=name,
-                                            description=description,
-                                            services=services,
-                                            action=action)
-
-        self.policy_api.create_or_update(entry_def)
-
     def update(self, profile_id, name=None, description=None,
                services=None, action=None,
                tenant=policy_constants.POLICY_INFRA_TENANT):
-        # Get the current data of the profile & its' entry
+        """Update the profile and its entry with a single PATCH.
+
+        The profile is read first, as the id of its entry is only known to
+        the backend. The data returned is that read, updated locally with
+        the PATCH body rather than read again.
+        """
         profile = self.get(profile_id, tenant=tenant)
+        transaction = self.policy_api.new_transaction(tenant=tenant)
 
         if name is not None or description is not None:
             # update the profile itself
@@ -531,28 +498,34 @@ class NsxPolicyCommunicationProfileApi(NsxPolicyResourceBase):
                 profile_id=profile_id, tenant=tenant)
             profile_def.update_attributes_in_body(name=name,
                                                   description=description)
-
-            # update the backend
-            updated_profile = self.policy_api.create_or_update(profile_def)
-        else:
-            updated_profile = profile
+            transaction.create_or_update(profile_def)
 
         # update the profile entry if it exists
         profile_entry = policy_defs.CommunicationProfileDef.get_single_entry(
             profile)
-        if not profile_entry:
+        if profile_entry:
+            entry_def = policy_defs.CommunicationProfileEntryDef(
+                profile_id=profile_id,
+                profile_entry_id=profile_entry['id'],
+                tenant=tenant)
+            entry_def.update_attributes_in_body(name=name,
+                                                description=description,
+                                                services=services,
+                                                action=action)
+            transaction.create_or_update(entry_def)
+        else:
             LOG.error("Cannot update communication profile %s - expected 1 "
                       "profile entry", profile_id)
-            return updated_profile
-
-        self._update_profile_entry(
-            profile_id, profile_entry,
-            name=name, description=description,
-            services=services, action=action,
-            tenant=tenant)
 
-        # re-read the profile from the backend to return the current data
-        return self.get(profile_id, tenant=tenant)
+        if not len(transaction):
+            return profile
+        # update the backend
+        transaction.apply()
+        if name is not None or description is not None:
+            profile.update(profile_def.get_patch_body())
+        if profile_entry:
+            profile_entry.update(entry_def.get_patch_body())
+        return profile
 
 
 class NsxPolicyCommunicationMapApi(NsxPolicyResourceBase):
@@ -641,12 +614,15 @@ class NsxPolicyCommunicationMapApi(NsxPolicyResourceBase):
         return super(NsxPolicyCommunicationMapApi, self).get_by_name(
             name, domain_id, tenant=tenant)
 
+    def _list_def(self, domain_id,
+                  tenant=policy_constants.POLICY_INFRA_TENANT):
+        return policy_defs.CommunicationMapEntryDef(domain_id=domain_id,
+                                                    tenant=tenant)
+
     def list(self, domain_id,
              tenant=policy_constants.POLICY_INFRA_TENANT):
         """List all the map entries of a specific domain."""
-        map_def = policy_defs.CommunicationMapEntryDef(
-            domain_id=domain_id,
-            tenant=tenant)
+        map_def = self._list_def(domain_id, tenant=tenant)
         return self.policy_api.list(map_def)['results']
 
     def update(self, domain_id, map_id, name=None, description=None,
@@ -657,18 +633,7 @@ class NsxPolicyCommunicationMapApi(NsxPolicyResourceBase):
             domain_id=domain_id,
             map_id=map_id,
             tenant=tenant)
-
-        # Get the current data, and update it with the new values
-        try:
-            comm_map = self.get(domain_id, map_id, tenant=tenant)
-        except exceptions.ResourceNotFound:
-            return self.create_or_overwrite(name, domain_id, map_id,
-                                            description, sequence_number,
-                                            profile_id, source_groups,
-                                            dest_groups, tenant)
-
         map_def.update_attributes_in_body(
-            body=comm_map,
             name=name,
             description=description,
             sequence_number=sequence_number,
@@ -677,7 +642,26 @@ class NsxPolicyCommunicationMapApi(NsxPolicyResourceBase):
             dest_groups=dest_groups)
 
         # update the backend
-        return self.policy_api.create_or_update(map_def)
+        try:
+            return self.policy_api.update(map_def)
+        except exceptions.ManagerError:
+            # The PATCH of a missing entry creates it, but fails without the
+            # attributes required to create it, or the communication map
+            with excutils.save_and_reraise_exception() as ctxt:
+                if not self._exists(domain_id, map_id, tenant=tenant):
+                    ctxt.reraise = False
+        return self.create_or_overwrite(name, domain_id, map_id,
+                                        description, sequence_number,
+                                        profile_id, source_groups,
+                                        dest_groups, tenant)
+
+    def _exists(self, domain_id, map_id,
+                tenant=policy_constants.POLICY_INFRA_TENANT):
+        try:
+            self.get(domain_id, map_id, tenant=tenant)
+        except exceptions.ResourceNotFound:
+            return False
+        return True
 
     def get_realized_state(self, domain_id, ep_id,
                            tenant=policy_constants.POLICY_INFRA_TENANT):
@@ -721,8 +705,11 @@ class NsxPolicyEnforcementPointApi(NsxPolicyResourceBase):
             ep_id=ep_id, tenant=tenant)
         return self.policy_api.get(ep_def)
 
+    def _list_def(self, tenant=policy_constants.POLICY_INFRA_TENANT):
+        return policy_defs.EnforcementPointDef(tenant=tenant)
+
     def list(self, tenant=policy_constants.POLICY_INFRA_TENANT):
-        ep_def = policy_defs.EnforcementPointDef(tenant=tenant)
+        ep_def = self._list_def(tenant=tenant)
         return self.policy_api.list(ep_def)['results']
 
     def update(self, ep_id, name=None, description=None,
@@ -747,7 +734,7 @@ class NsxPolicyEnforcementPointApi(NsxPolicyResourceBase):
                                          password=password,
                                          thumbprint=thumbprint)
         # update the backend
-        return self.policy_api.create_or_update(ep_def)
+        return self.policy_api.update(ep_def)
 
     def get_realized_state(self, ep_id,
                            tenant=policy_constants.POLICY_INFRA_TENANT):
@@ -793,14 +780,18 @@ class NsxPolicyDeploymentMapApi(NsxPolicyResourceBase):
             map_id=map_id, domain_id=domain_id, tenant=tenant)
         return self.policy_api.get(map_def)
 
-    def list(self, domain_id=None,
-             tenant=policy_constants.POLICY_INFRA_TENANT):
+    def _list_def(self, domain_id=None,
+                  tenant=policy_constants.POLICY_INFRA_TENANT):
         if not domain_id:
             # domain_id must be provided
             err_msg = (_("Cannot list deployment maps without a domain"))
             raise exceptions.ManagerError(details=err_msg)
-        map_def = policy_defs.DeploymentMapDef(domain_id=domain_id,
-                                               tenant=tenant)
+        return policy_defs.DeploymentMapDef(domain_id=domain_id,
+                                            tenant=tenant)
+
+    def list(self, domain_id=None,
+             tenant=policy_constants.POLICY_INFRA_TENANT):
+        map_def = self._list_def(domain_id=domain_id, tenant=tenant)
         return self.policy_api.list(map_def)['results']
 
     def update(self, map_id, name=None, description=None,
@@ -813,4 +804,4 @@ class NsxPolicyDeploymentMapApi(NsxPolicyResourceBase):
                                           ep_id=ep_id,
                                           domain_id=domain_id)
         # update the backend
-        return self.policy_api.create_or_update(map_def)
+        return self.policy_api.update(map_def)
@@ -187,7 +187,8 @@ class LogicalPort(utils.NsxLibApiBase):
         # Using internal method so we can access max_attempts in the decorator
         @utils.retry_upon_exception(
             exceptions.StaleRevision,
-            max_attempts=self.client.max_attempts)
+            max_attempts=self.client.max_attempts,
+            budget=self.client.retry_budget)
         def _do_delete():
             return self.client.url_delete(
                 self.get_path('%s?detach=true' % lport_id))
@@ -206,9 +207,11 @@ class LogicalPort(utils.NsxLibApiBase):
         # Using internal method so we can access max_attempts in the decorator
         @utils.retry_upon_exception(
             exceptions.StaleRevision,
-            max_attempts=self.client.max_attempts)
+            max_attempts=self.client.max_attempts,
+            budget=self.client.retry_budget)
         def do_update():
-            lport = self.get(lport_id)
+            lport = self._get_for_update(self.get_path(lport_id),
+                                         read=lambda: self.get(lport_id))
             tags = lport.get('tags', [])
             if tags_update:
                 tags = utils.update_v3_tags(tags, tags_update)
@@ -309,9 +312,12 @@ class LogicalRouterPort(utils.NsxLibApiBase):
         # Using internal method so we can access max_attempts in the decorator
         @utils.retry_upon_exception(
             exceptions.StaleRevision,
-            max_attempts=self.client.max_attempts)
+            max_attempts=self.client.max_attempts,
+            budget=self.client.retry_budget)
         def _do_update():
-            logical_router_port = self.get(logical_port_id)
+            logical_router_port = self._get_for_update(
+                self.get_path(logical_port_id),
+                read=lambda: self.get(logical_port_id))
             # special treatment for updating/removing the relay service
             if 'relay_service_uuid' in kwargs:
                 if kwargs['relay_service_uuid']:
@@ -345,7 +351,8 @@ class LogicalRouterPort(utils.NsxLibApiBase):
         # Using internal method so we can access max_attempts in the decorator
         @utils.retry_upon_exception(
             exceptions.StaleRevision,
-            max_attempts=self.client.max_attempts)
+            max_attempts=self.client.max_attempts,
+            budget=self.client.retry_budget)
         def _do_delete():
             return self.client.url_delete(self.get_path(logical_port_id))
 
@@ -504,7 +511,8 @@ class LogicalDhcpServer(utils.NsxLibApiBase):
         # Using internal method so we can access max_attempts in the decorator
         @utils.retry_upon_exception(
             exceptions.StaleRevision,
-            max_attempts=self.client.max_attempts)
+            max_attempts=self.client.max_attempts,
+            budget=self.client.retry_budget)
         def _do_update():
             body = self.get(uuid)
             self._construct_server(body, dhcp_profile_id, server_ip, name,
@@ -537,7 +545,8 @@ class LogicalDhcpServer(utils.NsxLibApiBase):
         # Using internal method so we can access max_attempts in the decorator
         @utils.retry_upon_exception(
             exceptions.StaleRevision,
-            max_attempts=self.client.max_attempts)
+            max_attempts=self.client.max_attempts,
+            budget=self.client.retry_budget)
         def _do_update():
             body = self.get_binding(server_uuid, binding_uuid)
             body.update(kwargs)
@@ -17,6 +17,7 @@
 """
 NSX-V3 Plugin security & Distributed Firewall integration module
 """
+import sys
 
 from neutron_lib import constants
 from oslo_log import log
@@ -136,12 +137,7 @@ class NsxLibNsGroup(utils.NsxLibApiBase):
 
     def update(self, nsgroup_id, display_name=None, description=None,
                membership_criteria=None, members=None):
-        # Using internal method so we can access max_attempts in the decorator
-        @utils.retry_upon_exception(
-            exceptions.StaleRevision,
-            max_attempts=self.nsxlib_config.max_attempts)
-        def _do_update():
-            nsgroup = self.read(nsgroup_id)
+        def _update_nsgroup(nsgroup):
             if display_name is not None:
                 nsgroup['display_name'] = display_name
             if description is not None:
@@ -150,10 +146,10 @@ class NsxLibNsGroup(utils.NsxLibApiBase):
                 nsgroup['members'] = members
             if membership_criteria is not None:
                 nsgroup['membership_criteria'] = [membership_criteria]
-            return self.client.update(
-                'ns-groups/%s' % nsgroup_id, nsgroup)
 
-        return _do_update()
+        return self._merged_update('ns-groups/%s' % nsgroup_id,
+                                   _update_nsgroup,
+                                   read=lambda: self.read(nsgroup_id))
 
     def get_member_expression(self, target_type, target_id):
         return {
@@ -173,10 +169,36 @@ class NsxLibNsGroup(utils.NsxLibApiBase):
             member_expr = self.get_member_expression(
                 target_type, target_id)
             members.append(member_expr)
-        members = {'members': members}
+
+        def _add_members(pending):
+            # the members added concurrently are added with a single call
+            all_members = []
+            for pending_write in pending:
+                all_members.extend(pending_write.change)
+            try:
+                return self._update_with_members(
+                    nsgroup_id, {'members': all_members},
+                    consts.NSGROUP_ADD_MEMBERS)
+            except exceptions.ResourceNotFound:
+                raise
+            except exceptions.ManagerError:
+                if len(pending) == 1:
+                    raise
+            # add the members of each writer on its own, so that it only
+            # gets its own error
+            for pending_write in pending:
+                try:
+                    pending_write.set_result(self._update_with_members(
+                        nsgroup_id, {'members': pending_write.change},
+                        consts.NSGROUP_ADD_MEMBERS))
+                except exceptions.ManagerError:
+                    pending_write.set_exception(sys.exc_info())
+
         try:
-            return self._update_with_members(
-                nsgroup_id, members, consts.NSGROUP_ADD_MEMBERS)
+            return self._merged_write(
+                'ns-groups/%s?action=%s' % (nsgroup_id,
+                                            consts.NSGROUP_ADD_MEMBERS),
+                members, _add_members)
         except (exceptions.StaleRevision, exceptions.ResourceNotFound):
             raise
         except exceptions.ManagerError:
@@ -217,6 +239,10 @@ class NsxLibNsGroup(utils.NsxLibApiBase):
                       nsgroup_id)
 
     def find_by_display_name(self, display_name):
+        found = self._find('display_name', display_name,
+                           resource='ns-groups')
+        if found is not None:
+            return found
         found = []
         for resource in self.list():
             if resource['display_name'] == display_name:
@@ -229,25 +255,29 @@ class NsxLibFirewallSection(utils.NsxLibApiBase):
     def add_member_to_fw_exclude_list(self, target_id, target_type):
         @utils.retry_upon_exception(
             exceptions.StaleRevision,
-            max_attempts=self.nsxlib_config.max_attempts)
+            max_attempts=self.nsxlib_config.max_attempts,
+            budget=self.client.retry_budget)
         def _add_member_to_fw_exclude_list():
             resource = 'firewall/excludelist?action=add_member'
             body = {"target_id": target_id,
                     "target_type": target_type}
             self.client.create(resource, body)
 
-        _add_member_to_fw_exclude_list()
+        self._serialized_write('firewall/excludelist',
+                               _add_member_to_fw_exclude_list)
 
     def remove_member_from_fw_exclude_list(self, target_id, target_type):
         @utils.retry_upon_exception(
             exceptions.StaleRevision,
-            max_attempts=self.nsxlib_config.max_attempts)
+            max_attempts=self.nsxlib_config.max_attempts,
+            budget=self.client.retry_budget)
         def _remove_member_from_fw_exclude_list():
             resource = ('firewall/excludelist?action=remove_member&object_id='
                         + target_id)
             self.client.create(resource)
 
-        _remove_member_from_fw_exclude_list()
+        self._serialized_write('firewall/excludelist',
+                               _remove_member_from_fw_exclude_list)
 
     def get_excludelist(self):
         return self.client.list('firewall/excludelist')
@@ -329,7 +359,8 @@ class NsxLibFirewallSection(utils.NsxLibApiBase):
                      other_section=None):
         @utils.retry_upon_exception(
             exceptions.StaleRevision,
-            max_attempts=self.nsxlib_config.max_attempts)
+            max_attempts=self.nsxlib_config.max_attempts,
+            budget=self.client.retry_budget)
         def _create_empty():
             resource = 'firewall/sections?operation=%s' % operation
             body = self._build(display_name, description,
@@ -344,7 +375,8 @@ class NsxLibFirewallSection(utils.NsxLibApiBase):
                           other_section=None, rules=None):
         @utils.retry_upon_exception(
             exceptions.StaleRevision,
-            max_attempts=self.nsxlib_config.max_attempts)
+            max_attempts=self.nsxlib_config.max_attempts,
+            budget=self.client.retry_budget)
         def _create_with_rules():
             resource = 'firewall/sections?operation=%s' % operation
             body = {
@@ -368,7 +400,8 @@ class NsxLibFirewallSection(utils.NsxLibApiBase):
         # Using internal method so we can access max_attempts in the decorator
         @utils.retry_upon_exception(
             exceptions.StaleRevision,
-            max_attempts=self.nsxlib_config.max_attempts)
+            max_attempts=self.nsxlib_config.max_attempts,
+            budget=self.client.retry_budget)
         def _do_update():
             resource = 'firewall/sections/%s' % section_id
             section = self.read(section_id)
@@ -401,7 +434,9 @@ class NsxLibFirewallSection(utils.NsxLibApiBase):
                                              applied_tos)):
                 return self.client.update(resource, section, headers=headers)
 
-        return _do_update()
+        # the default section is updated by every worker on start up
+        return self._serialized_write('firewall/sections/%s' % section_id,
+                                      _do_update)
 
     def read(self, section_id):
         resource = 'firewall/sections/%s' % section_id
@@ -467,7 +502,8 @@ class NsxLibFirewallSection(utils.NsxLibApiBase):
     def add_rule(self, rule, section_id):
         @utils.retry_upon_exception(
             exceptions.StaleRevision,
-            max_attempts=self.nsxlib_config.max_attempts)
+            max_attempts=self.nsxlib_config.max_attempts,
+            budget=self.client.retry_budget)
         def _add_rule():
             resource = 'firewall/sections/%s/rules' % section_id
             params = '?operation=insert_bottom'
@@ -477,7 +513,8 @@ class NsxLibFirewallSection(utils.NsxLibApiBase):
     def add_rules(self, rules, section_id):
         @utils.retry_upon_exception(
             exceptions.StaleRevision,
-            max_attempts=self.nsxlib_config.max_attempts)
+            max_attempts=self.nsxlib_config.max_attempts,
+            budget=self.client.retry_budget)
         def _add_rules():
             resource = 'firewall/sections/%s/rules' % section_id
             params = '?action=create_multiple&operation=insert_bottom'
@@ -487,7 +524,8 @@ class NsxLibFirewallSection(utils.NsxLibApiBase):
     def delete_rule(self, section_id, rule_id):
         @utils.retry_upon_exception(
             exceptions.StaleRevision,
-            max_attempts=self.nsxlib_config.max_attempts)
+            max_attempts=self.nsxlib_config.max_attempts,
+            budget=self.client.retry_budget)
         def _delete_rule():
             resource = 'firewall/sections/%s/rules/%s' % (section_id, rule_id)
             return self.client.delete(resource)
@@ -632,10 +670,12 @@ class NsxLibIPSet(utils.NsxLibApiBase):
         # Using internal method so we can access max_attempts in the decorator
         @utils.retry_upon_exception(
             exceptions.StaleRevision,
-            max_attempts=self.nsxlib_config.max_attempts)
+            max_attempts=self.nsxlib_config.max_attempts,
+            budget=self.client.retry_budget)
         def _do_update():
             resource = 'ip-sets/%s' % ip_set_id
-            ip_set = self.read(ip_set_id)
+            ip_set = self._get_for_update(
+                resource, read=lambda: self.read(ip_set_id))
             tags = ip_set.get('tags', [])
             if tags_update:
                 tags = utils.update_v3_tags(tags, tags_update)
@@ -14,19 +14,29 @@
 #    under the License.
 
 import abc
+import collections
+import copy
+import re
+import sys
+import threading
+import time
 
 from neutron_lib import exceptions
 from oslo_log import log
+import six.moves.urllib.parse as urlparse
 import tenacity
 
 from vmware_nsxlib._i18n import _
 from vmware_nsxlib.v3 import exceptions as nsxlib_exceptions
+from vmware_nsxlib.v3 import write_executor
 
 LOG = log.getLogger(__name__)
 
 MAX_RESOURCE_TYPE_LEN = 20
 MAX_TAG_LEN = 40
 DEFAULT_MAX_ATTEMPTS = 10
+# the path of a URL up to the API version, such as policy/api/v1/
+_API_BASE = re.compile(r'^.*?api/v1/')
 
 
 def _validate_resource_type_length(resource_type):
@@ -68,10 +78,506 @@ def update_v3_tags(current_tags, tags_update):
     return tags
 
 
+class RetryBudget(object):
+    """Token bucket limiting the retries of all the requests of a cluster.
+
+    Every request deposits a `ratio` of a token, and the bucket is also
+    refilled with `min_retries_per_second` tokens per second. Each retry,
+    whatever the layer doing it, withdraws a whole token, and is denied
+    once the bucket is empty, so that retries cannot multiply the load of
+    an overloaded NSX manager.
+    """
+
+    def __init__(self, ratio=0.1, min_retries_per_second=1, max_tokens=100,
+                 name='Retry'):
+        self.name = name
+        self.ratio = ratio
+        self.min_retries_per_second = min_retries_per_second
+        self.max_tokens = max_tokens
+        self.requests = 0
+        self.retries = 0
+        self.retries_denied = 0
+        self._tokens = float(max_tokens)
+        self._refilled_at = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self, tokens=0):
+        now = time.time()
+        tokens += (now - self._refilled_at) * self.min_retries_per_second
+        self._refilled_at = now
+        self._tokens = min(self._tokens + tokens, self.max_tokens)
+
+    @property
+    def tokens(self):
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    @property
+    def exhausted(self):
+        return self.tokens < 1
+
+    def deposit(self):
+        """Account for a new request."""
+        with self._lock:
+            self.requests += 1
+            self._refill(self.ratio)
+
+    def acquire(self):
+        """Withdraw a token for a retry, return False if out of budget."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.retries += 1
+                return True
+            self.retries_denied += 1
+            denied = self.retries_denied
+        if denied == 1 or denied % 100 == 0:
+            LOG.warning("%(name)s budget exhausted, %(denied)d retries "
+                        "denied so far", {'name': self.name, 'denied': denied})
+        return False
+
+    def as_dict(self):
+        return {'requests': self.requests,
+                'retries': self.retries,
+                'retries_denied': self.retries_denied,
+                'tokens': self.tokens}
+
+
+def _nested_paths(path, other):
+    """Return whether a path is other, is under it or is one of its parents"""
+    return (path == other or path.startswith(other + '/') or
+            other.startswith(path + '/'))
+
+
+class _LRUCache(object):
+    """Base class of the caches of a bounded number of entries by URL.
+
+    Once max_entries is reached, the least recently used entry is evicted.
+    The subclasses call the methods below with self._lock held.
+    """
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_entry(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            # most recently used last
+            self._entries[key] = entry
+        return entry
+
+    def _put_entry(self, key, entry):
+        self._entries.pop(key, None)
+        self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _discard_entries(self, keys):
+        for key in keys:
+            del self._entries[key]
+
+
+class ResponseCache(_LRUCache):
+    """Cache of the responses to GET requests.
+
+    Only the resources listed in `ttls` are cached, each for its own time
+    to live in seconds. A resource is given by its path relative to the API
+    base, such as 'transport-zones', and covers its objects and lists.
+    Writing an object invalidates the cached responses of the object, of
+    its sub-resources and of the lists it belongs to.
+    """
+
+    def __init__(self, ttls, max_entries=1000):
+        super(ResponseCache, self).__init__(max_entries=max_entries)
+        # the longest resource paths first, to match the most specific one
+        self.ttls = sorted(((path.strip('/'), ttl)
+                            for path, ttl in ttls.items()),
+                           key=lambda item: -len(item[0]))
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # incremented on each write, see put
+        self.generation = 0
+        # the entries are url: (path, expiry time, response)
+
+    @staticmethod
+    def _path(url):
+        return urlparse.urlparse(url).path.strip('/')
+
+    def ttl(self, url):
+        """Return the time to live of the response to url, None if any."""
+        path = _API_BASE.sub('', self._path(url), count=1)
+        for resource, ttl in self.ttls:
+            if path == resource or path.startswith(resource + '/'):
+                return ttl
+
+    def get(self, url):
+        """Return a copy of the cached response to url, None if any."""
+        with self._lock:
+            entry = self._get_entry(url)
+            if entry is not None and entry[1] <= time.time():
+                del self._entries[url]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            response = entry[2]
+        return copy.deepcopy(response)
+
+    def put(self, url, response, ttl, generation=None):
+        """Cache the response to url.
+
+        The response is not cached if an object was written since the said
+        generation, as the response may have been read before the write.
+        """
+        response = copy.deepcopy(response)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._put_entry(url, (self._path(url), time.time() + ttl,
+                                  response))
+
+    def invalidate(self, url):
+        """Forget the responses affected by a write to url."""
+        path = self._path(url)
+        with self._lock:
+            self.generation += 1
+            stale = [key for key, entry in self._entries.items()
+                     if _nested_paths(path, entry[0])]
+            self._discard_entries(stale)
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def as_dict(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries)}
+
+
+class ValidatorCache(_LRUCache):
+    """Cache of the validators of the responses to GET requests.
+
+    A validator is the ETag of a response, or else the revision of the
+    object returned. It is kept with the body of the response, to answer
+    a conditional request the NSX manager replied 304 Not Modified to.
+    """
+
+    def __init__(self, max_entries=1000):
+        super(ValidatorCache, self).__init__(max_entries=max_entries)
+        self.requests = 0
+        self.not_modified = 0
+        self.bytes_saved = 0
+        # the entries are url: (validator, body)
+
+    def validator(self, url):
+        """Return the validator of the last response to url, None if any."""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            self.requests += 1
+            return entry[0]
+
+    def get(self, url):
+        """Return the body of the response not modified since."""
+        with self._lock:
+            entry = self._get_entry(url)
+            if entry is None:
+                return None
+            self.not_modified += 1
+            self.bytes_saved += len(entry[1])
+            return entry[1]
+
+    def put(self, url, validator, body):
+        with self._lock:
+            self._put_entry(url, (validator, body))
+
+    def discard(self, url):
+        with self._lock:
+            self._entries.pop(url, None)
+
+    def as_dict(self):
+        return {'requests': self.requests,
+                'not_modified': self.not_modified,
+                'bytes_saved': self.bytes_saved,
+                'entries': len(self._entries)}
+
+
+class ObjectStateCache(_LRUCache):
+    """Cache of the last state seen of the objects.
+
+    The state of an object is the body with its _revision returned by the
+    last GET, create or update of the object, so that it can be updated
+    without reading it again. A state that turns out to be stale makes the
+    update fail with a stale revision, as if it had been read just before.
+    """
+
+    def __init__(self, max_entries=1000):
+        super(ObjectStateCache, self).__init__(max_entries=max_entries)
+        self.hits = 0
+        self.misses = 0
+        # the entries are url without its query: body
+
+    @staticmethod
+    def _key(url, obj_id=None):
+        path = urlparse.urlsplit(url)
+        key = urlparse.urlunsplit((path.scheme, path.netloc,
+                                   path.path.rstrip('/'), '', ''))
+        if obj_id and not key.endswith('/%s' % obj_id):
+            # created in a collection
+            key += '/%s' % obj_id
+        return key
+
+    def get(self, url):
+        """Return a copy of the last state seen of the object, or None."""
+        key = self._key(url)
+        with self._lock:
+            body = self._get_entry(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return copy.deepcopy(body)
+
+    def put(self, url, body):
+        """Keep the object returned by a request to url, if it is one.
+
+        The responses of the requests with a query, such as the GET of some
+        fields or the actions, are not kept as they may not be the full
+        state of the object.
+        """
+        if (not isinstance(body, dict) or '_revision' not in body or
+                urlparse.urlsplit(url).query):
+            return
+        key = self._key(url, body.get('id'))
+        body = copy.deepcopy(body)
+        with self._lock:
+            self._put_entry(key, body)
+
+    def discard(self, url):
+        """Forget the object of url, the objects under it and its parents.
+
+        Modifying an object, such as a rule of a firewall section, may bump
+        the revision of its parents.
+        """
+        key = self._key(url)
+        with self._lock:
+            self._discard_entries([entry for entry in self._entries
+                                   if _nested_paths(key, entry)])
+
+    def as_dict(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries)}
+
+
+def _object_attribute(obj, attribute):
+    """Return a dotted attribute of an object, such as attachment.target_id"""
+    for name in attribute.split('.'):
+        if not isinstance(obj, dict):
+            return None
+        obj = obj.get(name)
+    return obj
+
+
+class _IndexedCollection(object):
+    """The objects of a collection, by id and by the attributes looked up."""
+
+    def __init__(self, url, objects, expiry):
+        path = urlparse.urlsplit(url)
+        self.path = path.path.strip('/')
+        # a list with a query may only return some of the objects
+        self.filtered = bool(path.query)
+        self.expiry = expiry
+        self.objects = collections.OrderedDict(
+            (obj['id'], obj) for obj in objects if obj.get('id'))
+        # attribute: {value: [ids]}
+        self._indexes = {}
+
+    def _index(self, index, attribute, obj_id, obj, add=True):
+        value = _object_attribute(obj, attribute)
+        try:
+            ids = index.get(value)
+        except TypeError:
+            # such as a list, not indexed
+            return
+        if add:
+            index.setdefault(value, []).append(obj_id)
+        elif ids and obj_id in ids:
+            ids.remove(obj_id)
+
+    def find(self, attribute, value):
+        """Return the ids of the objects whose attribute has value."""
+        index = self._indexes.get(attribute)
+        if index is None:
+            index = self._indexes[attribute] = {}
+            for obj_id, obj in self.objects.items():
+                self._index(index, attribute, obj_id, obj)
+        try:
+            return list(index.get(value, []))
+        except TypeError:
+            return []
+
+    def affected_by(self, path):
+        return (path == self.path or path.startswith(self.path + '/') or
+                self.path.startswith(path + '/'))
+
+    def _remove(self, obj_id):
+        obj = self.objects.pop(obj_id, None)
+        if obj is not None:
+            for attribute, index in self._indexes.items():
+                self._index(index, attribute, obj_id, obj, add=False)
+
+    def apply(self, method, path, result):
+        """Apply a successful write of an object to the collection.
+
+        :return: False if the write could not be applied.
+        """
+        if self.filtered:
+            return False
+        parent, _sep, obj_id = path.rpartition('/')
+        if method == 'DELETE':
+            if parent != self.path:
+                return False
+            self._remove(obj_id)
+            return True
+        if not isinstance(result, dict) or not result.get('id'):
+            return False
+        if not (path == self.path and method == 'POST' or
+                parent == self.path and obj_id == result['id']):
+            return False
+        obj_id = result['id']
+        self._remove(obj_id)
+        self.objects[obj_id] = copy.deepcopy(result)
+        for attribute, index in self._indexes.items():
+            self._index(index, attribute, obj_id, result)
+        return True
+
+
+class LookupIndex(object):
+    """Index of the objects of collections, by their attributes.
+
+    A collection, given by the URL listing it, is listed once and its
+    objects indexed by each attribute looked up, such as display_name or
+    attachment.target_id, so that the next lookups send no request. The
+    creates, updates and deletes of its objects made through the client
+    are applied to the index, while the other writes to the collection make
+    it listed again on its next lookup, as does an expired ttl. A lookup
+    finding nothing lists the collection again, unless it just did, so
+    that the objects created by other clients are found.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # incremented on each write, see _build
+        self.generation = 0
+        # list url: _IndexedCollection
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def _build(self, url, list_func):
+        generation = self.generation
+        collection = _IndexedCollection(url, list(list_func()),
+                                        time.time() + self.ttl)
+        with self._lock:
+            self.misses += 1
+            # an object written since may have been listed before the write
+            if generation == self.generation:
+                self._collections[url] = collection
+        return collection
+
+    def lookup(self, url, criteria, list_func):
+        """Look up the objects of a collection matching some criteria.
+
+        :param url: The URL listing the collection.
+        :param criteria: List of (attribute, value) tuples.
+        :param list_func: callable() returning the objects of the
+                          collection.
+        :return: The list of the objects matching each criterion, in
+                 order.
+        """
+        with self._lock:
+            collection = self._collections.get(url)
+            if collection is not None and collection.expiry <= time.time():
+                collection = None
+            if collection is not None:
+                self.hits += 1
+        built = collection is None
+        while True:
+            if collection is None:
+                collection = self._build(url, list_func)
+            with self._lock:
+                found = [[copy.deepcopy(collection.objects[obj_id])
+                          for obj_id in collection.find(attribute, value)]
+                         for attribute, value in criteria]
+            if built or any(found):
+                return found
+            built = True
+            collection = None
+
+    def write(self, method, url, result=None, failed=False):
+        """Apply a write to url to the indexed collections."""
+        path = urlparse.urlsplit(url)
+        query = path.query
+        path = path.path.strip('/')
+        with self._lock:
+            self.generation += 1
+            for list_url, collection in list(self._collections.items()):
+                if not collection.affected_by(path):
+                    continue
+                if failed or query or not collection.apply(method, path,
+                                                           result):
+                    del self._collections[list_url]
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._collections.clear()
+
+    def as_dict(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'collections': len(self._collections)}
+
+
+class _retry_if_exception_within_budget(tenacity.retry_if_exception_type):
+
+    def __init__(self, exc, budget, max_attempts):
+        super(_retry_if_exception_within_budget, self).__init__(exc)
+        self._budget = budget
+        self._max_attempts = max_attempts
+
+    def __call__(self, attempt):
+        # the last attempt is not retried, and spends no token
+        return (super(_retry_if_exception_within_budget, self).__call__(
+            attempt) and attempt.attempt_number < self._max_attempts and
+            self._budget.acquire())
+
+
 def retry_upon_exception(exc, delay=0.5, max_delay=2,
-                         max_attempts=DEFAULT_MAX_ATTEMPTS):
+                         max_attempts=DEFAULT_MAX_ATTEMPTS, budget=None):
+    retry = (_retry_if_exception_within_budget(exc, budget, max_attempts)
+             if budget else tenacity.retry_if_exception_type(exc))
     return tenacity.retry(reraise=True,
-                          retry=tenacity.retry_if_exception_type(exc),
+                          retry=retry,
                           wait=tenacity.wait_exponential(
                               multiplier=delay, max=max_delay),
                           stop=tenacity.stop_after_attempt(max_attempts))
@@ -162,8 +668,17 @@ class NsxLibApiBase(object):
             return '%s/%s' % (self.uri_segment, resource)
         return self.uri_segment
 
+    def _list_path(self):
+        """Return the path listing the resources."""
+        return self.uri_segment
+
     def list(self):
-        return self.client.list(self.uri_segment)
+        return self.client.list(self._list_path())
+
+    def iter_list(self, stream=False, fields=None):
+        """Yield the resources, fetching them page by page."""
+        return self.client.iter_list(self._list_path(), stream=stream,
+                                     fields=fields)
 
     def get(self, uuid, silent=False):
         return self.client.get(self.get_path(uuid), silent=silent)
@@ -171,36 +686,126 @@ class NsxLibApiBase(object):
     def delete(self, uuid):
         return self.client.delete(self.get_path(uuid))
 
+    def _find(self, attribute, value, resource=None):
+        """Return the objects of a resource whose attribute has value.
+
+        The objects are looked up in the lookup index of the client, see
+        LookupIndex. None if it is disabled.
+        """
+        found = self._lookup([(attribute, value)], resource=resource)
+        return found[0] if found is not None else None
+
+    def _lookup(self, criteria, resource=None):
+        if getattr(self.client, 'lookup_index', None) is None:
+            return None
+        return self.client.lookup(resource or self._list_path(), criteria)
+
     def find_by_display_name(self, display_name):
+        found = self._find('display_name', display_name)
+        if found is not None:
+            return found
         found = []
-        for resource in self.list()['results']:
+        for resource in self.iter_list():
             if resource['display_name'] == display_name:
                 found.append(resource)
         return found
 
     def _update_resource_with_retry(self, resource, payload):
-        # Using internal method so we can access max_attempts in the decorator
-        @retry_upon_exception(nsxlib_exceptions.StaleRevision,
-                              max_attempts=self.nsxlib_config.max_attempts)
-        def do_update():
-            revised_payload = self.client.get(resource)
+        def _update_payload(revised_payload):
             for key_name in payload.keys():
                 revised_payload[key_name] = payload[key_name]
-            return self.client.update(resource, revised_payload)
 
-        return do_update()
+        return self._merged_update(resource, _update_payload)
+
+    def _get_for_update(self, resource, read=None):
+        """Return the body of a resource about to be updated.
+
+        The last state seen of the resource is used when the object state
+        cache has it, saving a GET. Otherwise the resource is read.
+        """
+        object_states = getattr(self.client, 'object_states', None)
+        if object_states is not None:
+            body = self.client.get_object_state(resource)
+            if body is not None:
+                return body
+        return read() if read else self.client.get(resource)
+
+    def _merged_write(self, key, change, merge):
+        """Write a change merged with the concurrent ones of the process.
+
+        See write_executor.WriteMergeQueue.write. Without a write queue, the
+        change is written alone.
+        """
+        write_queue = getattr(self.client, 'write_queue', None)
+        if write_queue is not None:
+            return write_queue.write(key, change, merge)
+        pending = write_executor.PendingWrite(change)
+        write_executor.merge_writes([pending], merge)
+        return pending.future.result()
+
+    def _serialized_write(self, key, func, *args, **kwargs):
+        """Run a write after the other writes of key in the process."""
+        write_queue = getattr(self.client, 'write_queue', None)
+        if write_queue is not None:
+            return write_queue.serialize(key, func, *args, **kwargs)
+        return func(*args, **kwargs)
+
+    def _merged_update(self, resource, modify, read=None, write=None):
+        """Update a resource with a read-modify-write cycle.
+
+        The cycle is retried upon stale revision, and merged with the
+        concurrent updates of the resource within the process.
+
+        :param modify: callable(body) modifying the body of the resource in
+                       place, returning False if it left it unchanged.
+        :param read: Optional callable() reading the body of the resource.
+        :param write: Optional callable(body) writing the body back.
+        :return: The response of the write, or the body of the resource if
+                 it was left unchanged.
+        """
+        # Using internal method so we can access max_attempts in the decorator
+        @retry_upon_exception(nsxlib_exceptions.StaleRevision,
+                              max_attempts=self.nsxlib_config.max_attempts,
+                              budget=self.client.retry_budget)
+        def do_update(pending):
+            body = self._get_for_update(resource, read=read)
+            changed = False
+            for pending_write in pending:
+                if pending_write.done():
+                    # its change failed on a previous attempt
+                    continue
+                try:
+                    if pending_write.change(body) is not False:
+                        changed = True
+                except Exception:
+                    pending_write.set_exception(sys.exc_info())
+            if not changed:
+                return body
+            if write:
+                return write(body)
+            return self.client.update(resource, body)
+
+        return self._merged_write(resource, modify, do_update)
 
     def _get_resource_by_name_or_id(self, name_or_id, resource):
-        all_results = self.client.list(resource)['results']
-        matched_results = []
-        for rs in all_results:
-            if rs.get('id') == name_or_id:
-                # Matched by id - must be unique
+        found = self._lookup([('id', name_or_id),
+                              ('display_name', name_or_id)],
+                             resource=resource)
+        if found is not None:
+            if found[0]:
                 return name_or_id
-
-            if rs.get('display_name') == name_or_id:
-                # Matched by name - add to the list to verify it is unique
-                matched_results.append(rs)
+            matched_results = found[1]
+        else:
+            matched_results = []
+            for rs in self.client.iter_list(resource):
+                if rs.get('id') == name_or_id:
+                    # Matched by id - must be unique
+                    return name_or_id
+
+                if rs.get('display_name') == name_or_id:
+                    # Matched by name - add to the list to verify it is
+                    # unique
+                    matched_results.append(rs)
 
         if len(matched_results) == 0:
             err_msg = (_("Could not find %(resource)s %(name)s") %
@@ -223,7 +828,7 @@ class NsxLibApiBase(object):
         """
 
         return self._get_resource_by_name_or_id(name_or_id,
-                                                self.get_path())
+                                                self._list_path())
 
     def build_v3_api_version_tag(self):
         """Some resources are created on the manager
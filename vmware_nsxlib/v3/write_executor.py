@@ -0,0 +1,355 @@
+# Copyright 2017 VMware, Inc.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""Asynchronous execution and merging of the writes of the NsxLib APIs.
+
+The writes are submitted with an ordering key, usually the path of the
+resource they modify. The writes of a key run one after the other in their
+submission order, while the writes of different keys run concurrently, up
+to a maximum number of workers.
+
+The concurrent writes of a resource within the process can also be merged,
+so that a single read-modify-write cycle applies all of their changes
+rather than each of them racing the others for the revision of the
+resource.
+"""
+import collections
+import contextlib
+import sys
+
+import eventlet
+from eventlet import event
+from eventlet import semaphore
+from oslo_log import log
+import six
+
+from vmware_nsxlib.v3 import exceptions
+
+LOG = log.getLogger(__name__)
+
+
+class WriteFuture(object):
+    """The eventual result of a write submitted to a WriteExecutor."""
+
+    def __init__(self):
+        self._event = event.Event()
+        self._result = None
+        self._exc_info = None
+
+    def done(self):
+        return self._event.ready()
+
+    def wait(self):
+        """Wait for the write to complete, whether it failed or not."""
+        self._event.wait()
+
+    def result(self):
+        """Wait for the write, and return its result or raise its error."""
+        self.wait()
+        if self._exc_info:
+            six.reraise(*self._exc_info)
+        return self._result
+
+    def exception(self):
+        """Wait for the write, and return its error, None if it succeeded."""
+        self.wait()
+        return self._exc_info[1] if self._exc_info else None
+
+    def set_result(self, result):
+        self._result = result
+        self._event.send()
+
+    def set_exception(self, exc_info):
+        self._exc_info = exc_info
+        self._event.send()
+
+
+class WriteExecutor(object):
+    """Runs writes in the background, in order per ordering key.
+
+    At most max_pending writes are queued or running at once, submitting
+    more blocks until one of them completes.
+    """
+
+    def __init__(self, max_workers=10, max_pending=1000):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self._shutdown = False
+        self._workers = semaphore.Semaphore(max_workers)
+        self._pending = semaphore.Semaphore(max_pending)
+        # the writes not started yet, and the last future of each key with
+        # writes queued or running
+        self._queues = {}
+        self._tails = {}
+
+    @property
+    def pending(self):
+        return self.submitted - self.completed - self.failed
+
+    def submit(self, key, func, *args, **kwargs):
+        """Queue func(*args, **kwargs) after the writes of the same key.
+
+        :return: A WriteFuture of the result of the write.
+        """
+        if self._shutdown:
+            raise exceptions.WriteExecutorShutdown()
+        self._pending.acquire()
+        future = WriteFuture()
+        self.submitted += 1
+        self._tails[key] = future
+        queue = self._queues.get(key)
+        if queue is not None:
+            # the worker of the key runs it once the previous ones are done
+            queue.append((future, func, args, kwargs))
+        else:
+            self._queues[key] = collections.deque(
+                [(future, func, args, kwargs)])
+            eventlet.spawn_n(self._run, key)
+        return future
+
+    def _run(self, key):
+        queue = self._queues[key]
+        while queue:
+            future, func, args, kwargs = queue.popleft()
+            with self._workers:
+                try:
+                    result = func(*args, **kwargs)
+                except Exception:
+                    self.failed += 1
+                    LOG.debug("Write %(func)s of %(key)s failed",
+                              {'func': getattr(func, '__name__', func),
+                               'key': key})
+                    future.set_exception(sys.exc_info())
+                else:
+                    self.completed += 1
+                    future.set_result(result)
+            self._pending.release()
+        del self._queues[key]
+        del self._tails[key]
+
+    def flush(self, timeout=None):
+        """Wait for the writes submitted so far to complete.
+
+        :param timeout: None, or the maximum time to wait in seconds.
+        :return: True if all of those writes completed.
+        """
+        futures = list(self._tails.values())
+        with eventlet.Timeout(timeout, False):
+            for future in futures:
+                future.wait()
+        return all(future.done() for future in futures)
+
+    def shutdown(self, wait=True, timeout=None):
+        """Stop accepting writes, and wait for the queued ones if asked.
+
+        :return: True if all of the queued writes completed.
+        """
+        self._shutdown = True
+        if wait:
+            return self.flush(timeout=timeout)
+        return not self._tails
+
+    def as_dict(self):
+        return {'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'pending': self.pending,
+                'keys': len(self._tails)}
+
+
+def _arg_names(method):
+    """Return the names of the positional parameters of a method."""
+    func = getattr(method, '__func__', method)
+    while hasattr(func, '__wrapped__'):
+        func = func.__wrapped__
+    code = getattr(func, '__code__', None)
+    if code is None:
+        return ()
+    names = code.co_varnames[:code.co_argcount]
+    if getattr(method, '__self__', None) is not None:
+        names = names[1:]
+    return names
+
+
+class AsyncWriteApi(object):
+    """Proxy of a NsxLib API whose calls return WriteFutures.
+
+    Each call is ordered after the previous calls on the resource it
+    modifies, given by the ordering_key keyword argument, else by its first
+    argument named like an id, such as the section_id of add_rules or the
+    domain_id of a policy API, else by its first argument if a string. The
+    calls without any are ordered per API. Without an executor, the calls
+    run synchronously and return completed futures.
+    """
+
+    def __init__(self, api, executor=None):
+        self._api = api
+        self._executor = executor
+
+    def _resource_id(self, method, args, kwargs):
+        call_args = dict(zip(_arg_names(method), args))
+        call_args.update(kwargs)
+        for name in _arg_names(method):
+            if (name.endswith('_id') and
+                    isinstance(call_args.get(name), six.string_types)):
+                return call_args[name]
+        if args and isinstance(args[0], six.string_types):
+            return args[0]
+
+    def _ordering_key(self, method, args, kwargs):
+        # the firewall sections and policy APIs have no uri_segment
+        prefix = (getattr(self._api, 'uri_segment', None) or
+                  type(self._api).__name__)
+        resource_id = self._resource_id(method, args, kwargs)
+        if resource_id is None:
+            return prefix
+        return '%s/%s' % (prefix, resource_id)
+
+    def __getattr__(self, name):
+        method = getattr(self._api, name)
+        if not callable(method):
+            return method
+
+        def _submit(*args, **kwargs):
+            key = kwargs.pop('ordering_key', None)
+            if key is None:
+                key = self._ordering_key(method, args, kwargs)
+            if self._executor is not None:
+                return self._executor.submit(key, method, *args, **kwargs)
+            future = WriteFuture()
+            try:
+                future.set_result(method(*args, **kwargs))
+            except Exception:
+                future.set_exception(sys.exc_info())
+            return future
+        return _submit
+
+
+class PendingWrite(object):
+    """A change of a resource queued in a WriteMergeQueue."""
+
+    def __init__(self, change):
+        self.change = change
+        self.future = WriteFuture()
+
+    def done(self):
+        return self.future.done()
+
+    def set_result(self, result):
+        self.future.set_result(result)
+
+    def set_exception(self, exc_info):
+        self.future.set_exception(exc_info)
+
+
+def merge_writes(pending, merge):
+    """Write the changes of pending writes with a single merge call.
+
+    The pending writes not resolved by merge get its return value, or its
+    error.
+    """
+    try:
+        result = merge(pending)
+    except Exception:
+        exc_info = sys.exc_info()
+        for pending_write in pending:
+            if not pending_write.done():
+                pending_write.set_exception(exc_info)
+    else:
+        for pending_write in pending:
+            if not pending_write.done():
+                pending_write.set_result(result)
+
+
+class WriteMergeQueue(object):
+    """Serializes and merges the writes of each resource of the process.
+
+    Each resource, given by its key, has a local write lock. The writer
+    getting the lock writes all the changes queued for the resource so
+    far, its own included, with a single merge call such as one
+    read-modify-write cycle. The writers whose change was written by
+    another one get its result without sending any request.
+    """
+
+    def __init__(self):
+        self.writes = 0
+        self.cycles = 0
+        self._pending = {}
+        # the lock of each key, with the number of its users and its holder
+        self._locks = {}
+
+    @property
+    def merged(self):
+        """The number of writes done by the cycle of another writer."""
+        return self.writes - self.cycles
+
+    @contextlib.contextmanager
+    def lock(self, key):
+        """Hold the local write lock of a resource.
+
+        The lock is reentrant, so that a resource can be written while
+        writing it, such as by a change.
+        """
+        current = eventlet.getcurrent()
+        lock = self._locks.get(key)
+        if lock is not None and lock[2] is current:
+            yield
+            return
+        if lock is None:
+            lock = self._locks[key] = [semaphore.Semaphore(), 0, None]
+        lock[1] += 1
+        try:
+            with lock[0]:
+                lock[2] = current
+                try:
+                    yield
+                finally:
+                    lock[2] = None
+        finally:
+            lock[1] -= 1
+            if not lock[1]:
+                del self._locks[key]
+
+    def serialize(self, key, func, *args, **kwargs):
+        """Run a write of a resource once its other writes are done."""
+        with self.lock(key):
+            return func(*args, **kwargs)
+
+    def write(self, key, change, merge):
+        """Write a change of a resource, merged with the concurrent ones.
+
+        :param change: The change of this writer, passed to merge.
+        :param merge: callable(pending) writing the changes of a list of
+                      PendingWrite, in submission order. The same merge is
+                      expected for all the writes of a key.
+        :return: The result of the write of the change.
+        """
+        pending = PendingWrite(change)
+        self.writes += 1
+        self._pending.setdefault(key, []).append(pending)
+        with self.lock(key):
+            if not pending.done():
+                self.cycles += 1
+                merge_writes(self._pending.pop(key), merge)
+        return pending.future.result()
+
+    def as_dict(self):
+        return {'writes': self.writes,
+                'cycles': self.cycles,
+                'merged': self.merged,
+                'locked': len(self._locks)}